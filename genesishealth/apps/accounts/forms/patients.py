@@ -508,7 +508,7 @@ class BatchUnassignFromAPIPartnerForm(GenesisBatchForm):
 
 class BatchMigrateForm(GenesisBatchForm):
     def save(self):
-        batch_ids = map(lambda x: x['pk'], self.batch.values('pk'))
+        batch_ids = list(self.batch.values_list('pk', flat=True))
         migrate_readings.delay(batch_ids)
 
 
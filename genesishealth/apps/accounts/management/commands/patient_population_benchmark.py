@@ -0,0 +1,104 @@
+"""Compares ProfessionalProfile.get_patients against the original four-way
+OR over the patients' own, company and group nursing groups, for a
+professional whose nursing group has a large population.
+
+The patients are created inside a transaction that is rolled back
+afterwards.  They belong to the professional's business partner, whose
+nursing group is set for the run, so they reach the professional through
+the group fallback and the population column is filled in by the
+GenesisGroup post_save receiver."""
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+
+from genesishealth.apps.accounts.models import (
+    Contact, PatientProfile, ProfessionalProfile)
+from genesishealth.apps.nursing.models import NursingGroup
+
+
+def get_patients_legacy(professional):
+    return User.objects.filter(
+        Q(patient_profile__in=professional.patients.all()) |
+        Q(
+            patient_profile__nursing_group=professional.nursing_group,
+            patient_profile__nursing_group__isnull=False
+        ) |
+        Q(
+            patient_profile__nursing_group__isnull=True,
+            patient_profile__company__nursing_group=professional.nursing_group,
+            patient_profile__company__nursing_group__isnull=False
+        ) |
+        Q(
+            patient_profile__nursing_group__isnull=True,
+            patient_profile__company__nursing_group__isnull=True,
+            patient_profile__group__nursing_group=professional.nursing_group,
+            patient_profile__group__nursing_group__isnull=False
+        )
+    ).filter(patient_profile__account_status=PatientProfile.ACCOUNT_STATUS_ACTIVE)
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks a professional\'s patient population query.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=20000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        professional = ProfessionalProfile.objects.select_related(
+            'parent_group').first()
+        if professional is None:
+            raise CommandError('A professional is needed for the benchmark.')
+        with transaction.atomic():
+            start = time.perf_counter()
+            self.create_population(professional, options['patients'])
+            self.stdout.write('Created %d patients in %.2fs.' % (
+                options['patients'], time.perf_counter() - start))
+            for name, get_patients in (
+                    ('original', get_patients_legacy),
+                    ('population', ProfessionalProfile.get_patients)):
+                self.stdout.write('%s:' % name)
+                self.run('count', options['repeat'],
+                         lambda: get_patients(professional).count())
+                self.run('first page', options['repeat'],
+                         lambda: list(get_patients(professional).order_by(
+                             'last_name', 'pk')[:10]))
+                self.run('ids', options['repeat'],
+                         lambda: list(get_patients(professional).values_list(
+                             'pk', flat=True)))
+            transaction.set_rollback(True)
+
+    def create_population(self, professional, count):
+        nursing_group = NursingGroup.objects.create(
+            name='Population benchmark', address='', city='', zip='',
+            state='')
+        users = User.objects.bulk_create([
+            User(username='population-benchmark-%d' % i,
+                 last_name='Patient %d' % i)
+            for i in range(count)])
+        contacts = Contact.objects.bulk_create([
+            Contact() for i in range(count)])
+        PatientProfile.objects.bulk_create([
+            PatientProfile(
+                user=user, contact=contact, group=professional.parent_group)
+            for user, contact in zip(users, contacts)])
+        group = professional.parent_group
+        group.nursing_group = nursing_group
+        group.save()
+        professional.nursing_group = nursing_group
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE accounts_patientprofile')
+
+    def run(self, name, repeat, query):
+        timings = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            result = query()
+            timings.append(time.perf_counter() - start)
+        if isinstance(result, list):
+            result = len(result)
+        self.stdout.write('  %s: %d rows, best %.3fs, mean %.3fs' % (
+            name, result, min(timings), sum(timings) / len(timings)))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from genesishealth.apps.accounts.models import PatientProfile
+
+
+class Command(BaseCommand):
+    help = 'Recomputes patient reading statistics and reports timings.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--incremental', action='store_true',
+            help='Only update patients with readings saved since the last '
+                 'update.')
+
+    def handle(self, *args, **options):
+        results = PatientProfile.objects.update_stat_averages(
+            incremental=options['incremental'])
+        self.stdout.write(
+            '%s update of %d patients (%d updated, %d created): aggregated in '
+            '%.2fs, written in %.2fs, %.2fs total.' % (
+                'Incremental' if results['incremental'] else 'Full',
+                results['patients'], results['updated'], results['created'],
+                results['aggregate_seconds'], results['write_seconds'],
+                results['total_seconds']))
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0077_auto_20201206_1628'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patientstatisticrecord',
+            name='through_reading_id',
+            field=models.IntegerField(editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Same precedence as PatientProfileManager.update_population_nursing_groups.
+POPULATE_SQL = """
+UPDATE accounts_patientprofile p
+SET population_nursing_group_id = COALESCE(
+    p.nursing_group_id,
+    (SELECT c.nursing_group_id FROM accounts_company c
+     WHERE c.id = p.company_id),
+    (SELECT g.nursing_group_id FROM accounts_genesisgroup g
+     WHERE g.id = p.group_id))
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nursing', '0001_initial'),
+        ('accounts', '0078_patientstatisticrecord_through_reading_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patientprofile',
+            name='population_nursing_group',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='nursing.NursingGroup'),
+        ),
+        migrations.RunSQL(POPULATE_SQL, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='patientprofile',
+            index=models.Index(fields=['population_nursing_group', 'account_status'], name='accounts_patient_population'),
+        ),
+    ]
@@ -60,6 +60,14 @@ class GenesisGroup(models.Model):
     def __str__(self) -> str:
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(GenesisGroup, cls).from_db(db, field_names, values)
+        # Read from __dict__ so a deferred field is not loaded.
+        instance._loaded_nursing_group_id = instance.__dict__.get(
+            'nursing_group_id')
+        return instance
+
     def add_patient(self, patient: User) -> None:
         """This method updates an existing relationship if it already exists"""
         patient.patient_profile.group = self
@@ -687,3 +695,11 @@ class Company(models.Model):
 
     def __str__(self) -> str:
         return self.name
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Company, cls).from_db(db, field_names, values)
+        # Read from __dict__ so a deferred field is not loaded.
+        instance._loaded_nursing_group_id = instance.__dict__.get(
+            'nursing_group_id')
+        return instance
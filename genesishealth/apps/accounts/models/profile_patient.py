@@ -3,6 +3,7 @@ import io
 import math
 import random
 import re
+import time
 
 from datetime import date, timedelta, datetime
 from hashlib import sha1 as sha_constructor
@@ -10,14 +11,16 @@ from typing import Optional, Any
 
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models import Avg, Count
+from django.db import models, transaction
+from django.db.models import (
+    Avg, Count, F, IntegerField, Max, OuterRef, Q, Subquery)
+from django.db.models.functions import Coalesce
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.template.loader import render_to_string
 from django.utils.timezone import now, localtime
 
-from genesishealth.apps.accounts.models.group import Company
+from genesishealth.apps.accounts.models.group import Company, GenesisGroup
 from genesishealth.apps.accounts.models.profile_base import BaseProfile, ProfileManager
 from genesishealth.apps.accounts.password import make_password
 from genesishealth.apps.accounts.tasks import do_detect_timezone
@@ -28,7 +31,8 @@ from genesishealth.apps.health_information.models import (
 from genesishealth.apps.nursing.models import NursingGroup
 from genesishealth.apps.orders.models import Order, OrderCategory, OrderEntry
 from genesishealth.apps.products.models import ProductType
-from genesishealth.apps.readings.models import GlucoseReading
+from genesishealth.apps.readings.models import (
+    DailyReadingRollup, GlucoseReading)
 from genesishealth.apps.utils.tz_lookup import timezone_from_location_string
 
 
@@ -54,9 +58,22 @@ class PatientProfileManager(ProfileManager):
         HealthInformation.objects.create(patient=patient)
         return patient
 
-    def update_stat_averages(self) -> None:
-        """Updates all of the last_week_average_* stats."""
-        map(lambda x: x.update_stat_averages(), self.all())
+    def update_population_nursing_groups(self, **filters: Any) -> int:
+        """Recomputes population_nursing_group for the matching profiles
+        (all of them by default).  Returns the number of profiles updated."""
+        return self.filter(**filters).update(population_nursing_group=Coalesce(
+            F('nursing_group'),
+            Subquery(Company.objects.filter(
+                pk=OuterRef('company')).values('nursing_group')[:1]),
+            Subquery(GenesisGroup.objects.filter(
+                pk=OuterRef('group')).values('nursing_group')[:1]),
+            output_field=IntegerField()))
+
+    def update_stat_averages(self, incremental: bool = False) -> dict:
+        """Updates the statistic records of all patients (or, if
+        `incremental`, of patients with new readings).  Returns timings for
+        the run."""
+        return PatientStatisticRecord.refresh(incremental=incremental)
 
 
 class MyGHRPatientManager(PatientProfileManager):
@@ -238,6 +255,13 @@ class PatientProfile(BaseProfile):
     epc_member_identifier = models.CharField(max_length=255, null=True, blank=True)
     nursing_group = models.ForeignKey(
         'nursing.NursingGroup', null=True, related_name='patients', on_delete=models.SET_NULL)
+    # The patient's own nursing group, or else the company's, or else the
+    # group's: the nursing group whose professionals have the patient (see
+    # ProfessionalProfile.get_patients).  Kept up to date by save() and the
+    # Company and GenesisGroup post_save receivers below.
+    population_nursing_group = models.ForeignKey(
+        'nursing.NursingGroup', null=True, related_name='+', editable=False,
+        db_index=False, on_delete=models.SET_NULL)
 
     welcome_text_sent = models.BooleanField(default=False)
 
@@ -257,10 +281,21 @@ class PatientProfile(BaseProfile):
 
     class Meta:
         app_label = 'accounts'
+        indexes = [
+            models.Index(
+                fields=['population_nursing_group', 'account_status'],
+                name='accounts_patient_population'),
+        ]
 
     def __str__(self) -> str:
         return "%s profile" % (self.user and self.user.username or '')
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(PatientProfile, cls).from_db(db, field_names, values)
+        instance._population_sources = instance.get_population_sources()
+        return instance
+
     @classmethod
     def activate_user(cls, activation_key):
         if SHA1_RE.search(activation_key):
@@ -497,25 +532,23 @@ class PatientProfile(BaseProfile):
             return last_order.datetime_added + interval
         return last_order.datetime_shipped + interval
 
+    def _summarize_last_days(self, days, measure_type=None):
+        end = now()
+        # The summary excludes its end; readings at exactly `end` count.
+        return DailyReadingRollup.summarize(
+            self.user_id, end - timedelta(days=days),
+            end + timedelta(microseconds=1), measure_type)
+
     def get_average_daily_readings(self, days=7):
         if days == 0:
             return 0
-        before = now() - timedelta(days=days)
-        readings = self.user.glucose_readings.filter(
-            reading_datetime_utc__range=(before, now()))
-        return float(readings.count()) / days
+        return float(self._summarize_last_days(days)['count']) / days
 
     def get_average_glucose_level(self, days=7, measure_type=None):
-        before = now() - timedelta(days=days)
-        readings = self.user.glucose_readings.filter(
-            reading_datetime_utc__range=(before, now()))
-
-        if measure_type:
-            readings = readings.filter(measure_type=measure_type)
-
-        aggregates = readings.aggregate(Avg('glucose_value'))
-
-        return aggregates['glucose_value__avg']
+        summary = self._summarize_last_days(days, measure_type)
+        if summary['count'] == 0:
+            return None
+        return float(summary['total']) / summary['count']
 
     def get_caregiver(self):
         if self.professionals.count() > 0:
@@ -526,13 +559,8 @@ class PatientProfile(BaseProfile):
         return targets.compliance_goal
 
     def get_days_tested_for_period(self, start_date, end_date):
-        days_tested = set([])
-        for reading in GlucoseReading.objects.filter(
-                patient=self.user,
-                reading_datetime_utc__gte=start_date,
-                reading_datetime_utc__lt=end_date + timedelta(days=1)):
-            days_tested.add(reading.reading_datetime_utc.date())
-        return len(days_tested)
+        return len(DailyReadingRollup.summarize(
+            self.user_id, start_date, end_date + timedelta(days=1))['days'])
 
     def _get_device(self):
         try:
@@ -793,10 +821,8 @@ class PatientProfile(BaseProfile):
         return 3
 
     def get_total_tests_for_period(self, start, end):
-        return GlucoseReading.objects.filter(
-            patient=self.user,
-            reading_datetime_utc__gte=start,
-            reading_datetime_utc__lt=end + timedelta(days=1)).count()
+        return DailyReadingRollup.summarize(
+            self.user_id, start, end + timedelta(days=1))['count']
 
     def get_utilization_threshold(self):
         last_refill = self.get_last_refill_order()
@@ -842,7 +868,33 @@ class PatientProfile(BaseProfile):
             return
         device.register(self.user)
 
+    def get_population_sources(self) -> tuple:
+        # Read from __dict__ so deferred fields are not loaded.
+        return tuple(self.__dict__.get(f) for f in (
+            'nursing_group_id', 'company_id', 'group_id'))
+
+    def get_population_nursing_group_id(self) -> Optional[int]:
+        if self.nursing_group_id is not None:
+            return self.nursing_group_id
+        if self.company_id is not None:
+            nursing_group_id = Company.objects.filter(
+                pk=self.company_id).values_list('nursing_group', flat=True).first()
+            if nursing_group_id is not None:
+                return nursing_group_id
+        if self.group_id is not None:
+            return GenesisGroup.objects.filter(
+                pk=self.group_id).values_list('nursing_group', flat=True).first()
+        return None
+
     def save(self, *args, **kwargs):
+        sources = self.get_population_sources()
+        if sources != getattr(self, '_population_sources', None):
+            self.population_nursing_group_id = \
+                self.get_population_nursing_group_id()
+            self._population_sources = sources
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = list(kwargs['update_fields']) + [
+                    'population_nursing_group']
         super(PatientProfile, self).save(*args, **kwargs)
         # Make sure contact always stays up to date.
         shared_fields = ('first_name', 'last_name', 'email')
@@ -931,6 +983,30 @@ def post_save_patient_profile(
                 instance.save()
 
 
+def nursing_group_changed(instance) -> bool:
+    """Whether a saved Company or GenesisGroup's nursing group differs from
+    the one it was loaded with, and records the new one."""
+    nursing_group_id = instance.__dict__.get('nursing_group_id')
+    changed = nursing_group_id != getattr(
+        instance, '_loaded_nursing_group_id', object())
+    instance._loaded_nursing_group_id = nursing_group_id
+    return changed
+
+
+@receiver(post_save, sender=Company)
+def post_save_company(sender, instance, created, raw, using, **kwargs):
+    if nursing_group_changed(instance) and not created:
+        PatientProfile.objects.update_population_nursing_groups(
+            company=instance, nursing_group__isnull=True)
+
+
+@receiver(post_save, sender=GenesisGroup)
+def post_save_genesis_group(sender, instance, created, raw, using, **kwargs):
+    if nursing_group_changed(instance) and not created:
+        PatientProfile.objects.update_population_nursing_groups(
+            group=instance, nursing_group__isnull=True)
+
+
 class PatientStatisticRecord(models.Model):
     profile = models.OneToOneField(PatientProfile, related_name='stats', on_delete=models.CASCADE)
 
@@ -955,20 +1031,120 @@ class PatientStatisticRecord(models.Model):
     readings_last_180 = models.FloatField(null=True)
     average_value_last_180 = models.FloatField(null=True)
 
+    # Highest reading id that existed when the record was last refreshed.
+    through_reading_id = models.IntegerField(null=True, editable=False)
+
+    WINDOWS = (1, 7, 14, 30, 60, 90, 180)
+
     class Meta:
         app_label = 'accounts'
 
-    def update(self):
-        for i in (1, 7, 14, 30, 60, 90, 180):
-            qs = self.profile.user.glucose_readings.filter(
-                reading_datetime_utc__gte=(now() - timedelta(days=i)))
-            aggs = qs.aggregate(
-                Avg('glucose_value'), Count('glucose_value'))
+    @classmethod
+    def get_window_aggregates(cls, current_time):
+        """Returns count and average aggregates for every window, to be
+        computed over readings from the last max(WINDOWS) days."""
+        aggregates = {}
+        for i in cls.WINDOWS:
+            in_window = Q(
+                reading_datetime_utc__gte=current_time - timedelta(days=i))
+            aggregates['count_{}'.format(i)] = Count(
+                'glucose_value', filter=in_window)
+            aggregates['average_{}'.format(i)] = Avg(
+                'glucose_value', filter=in_window)
+        return aggregates
+
+    @classmethod
+    def get_value_field_names(cls):
+        names = []
+        for i in cls.WINDOWS:
+            names.append("readings_last_{}".format(i))
+            names.append("average_value_last_{}".format(i))
+        return names
+
+    @classmethod
+    def refresh(cls, incremental=False, chunk_size=1000):
+        """Recomputes the records of all patients, aggregating every window
+        for every patient in one grouped query and saving the records in
+        chunks.
+
+        With `incremental`, only patients with readings saved since the last
+        refresh are recomputed.  Windows still move on for everyone else, so
+        a full refresh should run daily.  Returns timings for the run."""
+        started = time.perf_counter()
+        current_time = now()
+        last_reading_id = GlucoseReading.objects.aggregate(
+            Max('pk'))['pk__max']
+        profiles = PatientProfile.objects.all()
+        readings = GlucoseReading.objects.filter(
+            patient__isnull=False,
+            reading_datetime_utc__gte=current_time - timedelta(
+                days=max(cls.WINDOWS)))
+        watermark = None
+        if incremental:
+            watermark = cls.objects.aggregate(
+                Max('through_reading_id'))['through_reading_id__max']
+        if watermark is not None:
+            patient_ids = GlucoseReading.objects.filter(
+                pk__gt=watermark, patient__isnull=False).values('patient_id')
+            profiles = profiles.filter(user_id__in=patient_ids)
+            readings = readings.filter(patient_id__in=patient_ids)
+        values = dict(
+            (row['patient_id'], row) for row in readings.order_by().values(
+                'patient_id').annotate(
+                **cls.get_window_aggregates(current_time)))
+        aggregated = time.perf_counter()
+
+        profile_ids = list(profiles.order_by('pk').values_list(
+            'pk', 'user_id'))
+        fields = cls.get_value_field_names() + ['through_reading_id']
+        updated = created = 0
+        for start in range(0, len(profile_ids), chunk_size):
+            chunk = profile_ids[start:start + chunk_size]
+            records = dict(
+                (record.profile_id, record) for record in cls.objects.filter(
+                    profile_id__in=[pk for pk, _ in chunk]))
+            new_records = []
+            for profile_id, user_id in chunk:
+                record = records.get(profile_id)
+                if record is None:
+                    record = cls(profile_id=profile_id)
+                    new_records.append(record)
+                record.set_values(values.get(user_id, {}))
+                record.through_reading_id = last_reading_id
+            with transaction.atomic():
+                cls.objects.bulk_update(records.values(), fields)
+                # A record created since the chunk was read is left alone.
+                cls.objects.bulk_create(new_records, ignore_conflicts=True)
+            updated += len(records)
+            created += len(new_records)
+        finished = time.perf_counter()
+        return {
+            'incremental': watermark is not None,
+            'patients': len(profile_ids),
+            'updated': updated,
+            'created': created,
+            'aggregate_seconds': aggregated - started,
+            'write_seconds': finished - aggregated,
+            'total_seconds': finished - started,
+        }
+
+    def set_values(self, values):
+        """Sets the fields from a row of `get_window_aggregates` results; an
+        empty row means no readings."""
+        for i in self.WINDOWS:
             readings_field_name = "readings_last_{}".format(i)
             average_value_field_name = "average_value_last_{}".format(i)
             setattr(self, readings_field_name,
-                    float(aggs['glucose_value__count']) / i)
-            setattr(self, average_value_field_name, aggs['glucose_value__avg'])
+                    float(values.get('count_{}'.format(i), 0)) / i)
+            setattr(self, average_value_field_name,
+                    values.get('average_{}'.format(i)))
+
+    def update(self):
+        current_time = now()
+        self.set_values(self.profile.user.glucose_readings.filter(
+            reading_datetime_utc__gte=current_time - timedelta(
+                days=max(self.WINDOWS))
+        ).aggregate(**self.get_window_aggregates(current_time)))
         self.save()
 
 
@@ -1,10 +1,8 @@
-from datetime import timedelta
 from typing import TYPE_CHECKING, Optional
 
-from django.db import models, connection
+from django.db import models
 from django.contrib.auth.models import User
 from django.db.models import QuerySet, Q
-from django.utils.timezone import now
 
 from genesishealth.apps.accounts.password import make_password
 from genesishealth.apps.accounts.reports import (
@@ -81,165 +79,60 @@ class ProfessionalProfile(BaseProfile):
         return self.user.created_professionalalerts.all()
 
     def get_patients(self) -> 'QuerySet[User]':
-        return User.objects.filter(
-            Q(patient_profile__in=self.patients.all()) |
-            Q(
-                patient_profile__nursing_group=self.nursing_group,
-                patient_profile__nursing_group__isnull=False
-            ) |
-            Q(
-                patient_profile__nursing_group__isnull=True,
-                patient_profile__company__nursing_group=self.nursing_group,
-                patient_profile__company__nursing_group__isnull=False
-            ) |
-            Q(
-                patient_profile__nursing_group__isnull=True,
-                patient_profile__company__nursing_group__isnull=True,
-                patient_profile__group__nursing_group=self.nursing_group,
-                patient_profile__group__nursing_group__isnull=False
-            )
-        ).filter(patient_profile__account_status=PatientProfile.ACCOUNT_STATUS_ACTIVE)
+        # The professional's own patients are few, so their ids are passed
+        # in; together with the population index that lets the database
+        # combine two index scans instead of testing every profile.
+        query = Q(patient_profile__in=list(
+            self.patients.values_list('pk', flat=True)))
+        if self.nursing_group_id is not None:
+            query |= Q(
+                patient_profile__population_nursing_group=self.nursing_group_id)
+        return User.objects.filter(query).filter(
+            patient_profile__account_status=PatientProfile.ACCOUNT_STATUS_ACTIVE)
 
     def get_patients_by_range(self, number_of_days: int = 7, target: str = 'inside') -> 'QuerySet[User]':
-        assert number_of_days in (1, 7, 14, 30, 60, 90)
+        from genesishealth.apps.reports.analytics import (
+            DASHBOARD_WINDOWS, ProfessionalAnalytics)
+        assert number_of_days in DASHBOARD_WINDOWS
         assert target in ('inside', 'above', 'below')
-        if target == 'inside':
-            query = """
-                SELECT u.id FROM
-                    auth_user u
-                        LEFT JOIN health_information_healthprofessionaltargets h
-                            ON (u.id = h.patient_id AND h.professional_id = %s)
-                        LEFT JOIN accounts_patientprofile p ON u.id = p.user_id
-                        LEFT JOIN accounts_patientstatisticrecord ps ON p.id = ps.profile_id
-                WHERE ps.average_value_last_{0} IS NOT NULL AND (
-                    h.id IS NOT NULL AND (
-                        ps.average_value_last_{0} > h.premeal_glucose_goal_minimum
-                        AND ps.average_value_last_{0} < h.postmeal_glucose_goal_maximum
-                    )) OR (
-                    h.ID IS NULL AND (
-                        ps.average_value_last_{0} > 90
-                        AND ps.average_value_last_{0} < 120
-                    ))""".format(number_of_days)  # noqa
-        elif target == 'below':
-            query = """
-                SELECT u.id FROM
-                    auth_user u
-                        LEFT JOIN health_information_healthprofessionaltargets h
-                            ON (u.id = h.patient_id AND h.professional_id = %s)
-                        LEFT JOIN accounts_patientprofile p ON u.id = p.user_id
-                        LEFT JOIN accounts_patientstatisticrecord ps ON p.id = ps.profile_id
-                WHERE ps.average_value_last_{0} IS NOT NULL AND (
-                    h.id IS NOT NULL AND (
-                        ps.average_value_last_{0} < h.premeal_glucose_goal_minimum
-                    )) OR (
-                    h.ID IS NULL AND (
-                        ps.average_value_last_{0} < 90
-                    ))""".format(number_of_days)  # noqa
-        else:
-            query = """
-                SELECT u.id FROM
-                    auth_user u
-                        LEFT JOIN health_information_healthprofessionaltargets h
-                            ON (u.id = h.patient_id AND h.professional_id = %s)
-                        LEFT JOIN accounts_patientprofile p ON u.id = p.user_id
-                        LEFT JOIN accounts_patientstatisticrecord ps ON p.id = ps.profile_id
-                WHERE ps.average_value_last_{0} IS NOT NULL AND (
-                    h.id IS NOT NULL AND (
-                        ps.average_value_last_{0} > h.postmeal_glucose_goal_maximum
-                    )) OR (
-                    h.ID IS NULL AND (
-                        ps.average_value_last_{0} > 120
-                    ))""".format(number_of_days)  # noqa
-        cursor = connection.cursor()
-        cursor.execute(query, [self.user.pk])
-        ids = map(lambda x: x[0], cursor.fetchall())
-        return self.get_patients().filter(pk__in=ids)
+        c = ProfessionalAnalytics(self.user).get_range_statistics(
+            number_of_days)
+        key = {'inside': 'in', 'above': 'above', 'below': 'below'}[target]
+        return self.get_patients().filter(
+            pk__in=c['{0}_range_ids'.format(key)])
 
     def get_patients_with_no_readings(self, number_of_days: int = 7) -> 'QuerySet[User]':
-        assert number_of_days in (1, 7, 14, 30, 60, 90)
-        query = """
-            SELECT u.id FROM
-                auth_user u
-                    LEFT JOIN health_information_healthprofessionaltargets h
-                        ON (u.id = h.patient_id AND h.professional_id = %s)
-                    LEFT JOIN accounts_patientprofile p ON u.id = p.user_id
-                    LEFT JOIN accounts_patientstatisticrecord ps ON p.id = ps.profile_id
-            WHERE ps.readings_last_{0} IS NOT NULL
-                AND ps.readings_last_{0} = 0""".format(number_of_days)  # noqa
-        cursor = connection.cursor()
-        cursor.execute(query, [self.user.pk])
-        ids = map(lambda x: x[0], cursor.fetchall())
-        return self.get_patients().filter(pk__in=ids)
+        return self._get_patients_by_compliance(number_of_days, 'no_readings')
 
     def get_in_compliance_patients(self, number_of_days: int = 7) -> 'QuerySet[User]':
-        assert number_of_days in (1, 7, 14, 30, 60, 90)
-        query = """
-            SELECT u.id FROM
-                auth_user u
-                    LEFT JOIN health_information_healthprofessionaltargets h
-                        ON (u.id = h.patient_id AND h.professional_id = %s)
-                    LEFT JOIN accounts_patientprofile p ON u.id = p.user_id
-                    LEFT JOIN accounts_patientstatisticrecord ps ON p.id = ps.profile_id
-            WHERE ps.readings_last_{0} IS NOT NULL AND (
-                    h.id IS NOT NULL AND ps.readings_last_{0} >= h.minimum_compliance
-                ) OR (
-                    h.ID IS NULL AND ps.readings_last_{0} >= 1
-                )""".format(number_of_days)  # noqa
-        cursor = connection.cursor()
-        cursor.execute(query, [self.user.pk])
-        ids = map(lambda x: x[0], cursor.fetchall())
-        return self.get_patients().filter(pk__in=ids)
+        return self._get_patients_by_compliance(number_of_days, 'in_compliance')
 
     def get_out_of_compliance_patients(self, number_of_days: int = 7) -> 'QuerySet[User]':
-        assert number_of_days in (1, 7, 14, 30, 60, 90)
-        query = """
-            SELECT u.id FROM
-                auth_user u
-                    LEFT JOIN health_information_healthprofessionaltargets h
-                        ON (u.id = h.patient_id AND h.professional_id = %s)
-                    LEFT JOIN accounts_patientprofile p ON u.id = p.user_id
-                    LEFT JOIN accounts_patientstatisticrecord ps ON p.id = ps.profile_id
-            WHERE ps.readings_last_{0} IS NOT NULL AND (
-                    h.id IS NOT NULL AND ps.readings_last_{0} < h.minimum_compliance
-                ) OR (
-                    h.ID IS NULL AND ps.readings_last_{0} < 1
-                )""".format(number_of_days)  # noqa
-        cursor = connection.cursor()
-        cursor.execute(query, [self.user.pk])
-        ids = map(lambda x: x[0], cursor.fetchall())
-        return self.get_patients().filter(pk__in=ids)
+        return self._get_patients_by_compliance(
+            number_of_days, 'out_of_compliance')
+
+    def _get_patients_by_compliance(self, number_of_days: int, category: str) -> 'QuerySet[User]':
+        # The same figures as the compliance dashboard, which links here.
+        from genesishealth.apps.reports.analytics import (
+            DASHBOARD_WINDOWS, ProfessionalAnalytics)
+        assert number_of_days in DASHBOARD_WINDOWS
+        c = ProfessionalAnalytics(self.user).get_compliance_statistics(
+            number_of_days)
+        return self.get_patients().filter(pk__in=c['{0}_ids'.format(category)])
 
     def get_out_of_range_patients(self, number_of_days: int = 7) -> 'QuerySet[User]':
-        assert number_of_days in (1, 7, 14, 30, 60, 90)
-        query = """
-            SELECT u.id FROM
-                auth_user u
-                    LEFT JOIN health_information_healthprofessionaltargets h
-                        ON (u.id = h.patient_id AND h.professional_id = %s)
-                    LEFT JOIN accounts_patientprofile p ON u.id = p.user_id
-                    LEFT JOIN accounts_patientstatisticrecord ps ON p.id = ps.profile_id
-            WHERE ps.average_value_last_{0} IS NOT NULL AND (
-                h.id IS NOT NULL AND (
-                    ps.average_value_last_{0} < h.premeal_glucose_goal_minimum
-                    OR ps.average_value_last_{0} > h.postmeal_glucose_goal_maximum
-                )) OR (
-                h.ID IS NULL AND (
-                    ps.average_value_last_{0} < 90
-                    OR ps.average_value_last_{0} > 120
-                ))""".format(number_of_days)  # noqa
-        cursor = connection.cursor()
-        cursor.execute(query, [self.user.pk])
-        ids = map(lambda x: x[0], cursor.fetchall())
-        return self.get_patients().filter(pk__in=ids)
+        from genesishealth.apps.reports.analytics import (
+            DASHBOARD_WINDOWS, ProfessionalAnalytics)
+        assert number_of_days in DASHBOARD_WINDOWS
+        c = ProfessionalAnalytics(self.user).get_range_statistics(
+            number_of_days)
+        return self.get_patients().filter(
+            pk__in=c['below_range_ids'] | c['above_range_ids'])
 
     def get_patients_with_fewer_than_x_readings(self, reading_number: int, for_days: int) -> 'QuerySet[User]':
-        patient_ids = []
-        cutoff = now() - timedelta(days=for_days)
-        for patient in self.get_patients():
-            readings = patient.glucose_readings.filter(reading_datetime_utc__gt=cutoff)
-            if len(readings) < reading_number:
-                patient_ids.append(patient.id)
-        return self.get_patients().filter(id__in=patient_ids)
+        from genesishealth.apps.reports.analytics import ProfessionalAnalytics
+        return ProfessionalAnalytics(self.user).get_patients_with_fewer_than_x_readings(
+            reading_number, for_days)
 
     def get_patients_with_x_or_more_high_readings(
             self,
@@ -247,16 +140,9 @@ class ProfessionalProfile(BaseProfile):
             glucose_value: int,
             for_days: int
     ) -> 'QuerySet[User]':
-        patient_ids = []
-        cutoff = now() - timedelta(days=for_days)
-        for patient in self.get_patients():
-            readings = patient.glucose_readings.filter(
-                reading_datetime_utc__gt=cutoff,
-                glucose_value__gte=glucose_value
-            )
-            if len(readings) > reading_number:
-                patient_ids.append(patient.id)
-        return self.get_patients().filter(id__in=patient_ids)
+        from genesishealth.apps.reports.analytics import ProfessionalAnalytics
+        return ProfessionalAnalytics(self.user).get_patients_with_x_or_more_high_readings(
+            reading_number, glucose_value, for_days)
 
     def get_patients_with_x_or_more_low_readings(
             self,
@@ -264,16 +150,9 @@ class ProfessionalProfile(BaseProfile):
             glucose_value: int,
             for_days: int
     ) -> 'QuerySet[User]':
-        patient_ids = []
-        cutoff = now() - timedelta(days=for_days)
-        for patient in self.get_patients():
-            readings = patient.glucose_readings.filter(
-                reading_datetime_utc__gt=cutoff,
-                glucose_value__lte=glucose_value
-            )
-            if len(readings) > reading_number:
-                patient_ids.append(patient.id)
-        return self.get_patients().filter(id__in=patient_ids)
+        from genesishealth.apps.reports.analytics import ProfessionalAnalytics
+        return ProfessionalAnalytics(self.user).get_patients_with_x_or_more_low_readings(
+            reading_number, glucose_value, for_days)
 
     def get_professionals_in_group(self) -> 'QuerySet[ProfessionalProfile]':
         return self.parent_group.get_professionals()
@@ -1,11 +1,24 @@
+import logging
+
 from celery.schedules import crontab
 from celery.task import periodic_task, task
 
 
+logger = logging.getLogger('accounts')
+
+
 @periodic_task(run_every=crontab(hour=1, minute=0))
 def update_stat_averages():
     from genesishealth.apps.accounts.models import PatientProfile
-    PatientProfile.objects.update_stat_averages()
+    logger.info('Updated patient statistics: %s' % (
+        PatientProfile.objects.update_stat_averages()))
+
+
+@periodic_task(run_every=crontab(minute=30))
+def update_stat_averages_incremental():
+    from genesishealth.apps.accounts.models import PatientProfile
+    logger.info('Updated patient statistics: %s' % (
+        PatientProfile.objects.update_stat_averages(incremental=True)))
 
 
 @periodic_task(run_every=crontab(minute="*/2"))
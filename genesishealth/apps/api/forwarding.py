@@ -0,0 +1,234 @@
+"""Forwarding of glucose readings to API partners.
+
+Each partner gets one pooled HTTP session per process, so connections to its
+push_data location are kept alive between readings and between batches.  A
+batch of forward attempts is prepared in the calling thread, posted by up to
+settings.API_FORWARD_CONCURRENCY threads at once, and recorded with bulk
+writes once every post has finished; the sending threads never touch the
+database.
+"""
+import base64
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from genesishealth.apps.utils.func import utcnow
+
+logger = logging.getLogger('api')
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(partner_id):
+    """Returns the process's pooled session for the partner."""
+    with _sessions_lock:
+        session = _sessions.get(partner_id)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=settings.API_FORWARD_CONCURRENCY)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            # Partner certificates have never been verified.
+            session.verify = False
+            _sessions[partner_id] = session
+    return session
+
+
+class PartnerForwarder(object):
+    def __init__(self, partner, url=None, concurrency=None, retries=None,
+                 backoff=None):
+        from genesishealth.apps.api.models import APILogRecord
+        self.partner = partner
+        if url is None:
+            url = partner.get_url(APILogRecord.API_NAME_PUSH_DATA)
+        self.url = url
+        if concurrency is None:
+            concurrency = settings.API_FORWARD_CONCURRENCY
+        self.concurrency = concurrency
+        if retries is None:
+            retries = settings.API_FORWARD_RETRIES
+        self.retries = retries
+        if backoff is None:
+            backoff = settings.API_FORWARD_RETRY_BACKOFF
+        self.backoff = backoff
+        self.session = get_session(partner.pk)
+        credentials = '%s:%s' % (
+            partner.outgoing_username, partner.outgoing_password)
+        self.headers = {
+            'Authorization': 'Basic %s' % base64.standard_b64encode(
+                credentials.encode('utf-8')).decode('ascii'),
+            'Content-type': 'application/json',
+        }
+        if partner.api_version == '2.1':
+            self.headers['x-api-key'] = partner.outgoing_api_key
+
+    def post(self, encoded_data):
+        """Posts one reading and returns its (log status, response).
+        Connection failures and server errors are retried, waiting `backoff`
+        seconds and then twice as long each time."""
+        from genesishealth.apps.api.models import APILogRecord
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                response = self.session.post(
+                    self.url, data=encoded_data, headers=self.headers,
+                    timeout=10)
+            except requests.RequestException as e:
+                result = (APILogRecord.STATUS_CONNECTION_ERROR, str(e))
+                continue
+            if response.status_code >= 500:
+                result = (APILogRecord.STATUS_CONNECTION_ERROR, response.text)
+                continue
+            if response.status_code >= 400:
+                return (APILogRecord.STATUS_CONNECTION_ERROR, response.text)
+            try:
+                decoded_response = json.loads(response.text)
+            except ValueError:
+                return (APILogRecord.STATUS_JSON_ERROR, response.text)
+            if (isinstance(decoded_response, dict) and
+                    decoded_response.get('success')):
+                return (APILogRecord.STATUS_COMPLETE, response.text)
+            return (APILogRecord.STATUS_RETURNED_ERROR, response.text)
+        return result
+
+    def post_all(self, payloads):
+        if self.concurrency > 1 and len(payloads) > 1:
+            with ThreadPoolExecutor(
+                    max_workers=min(self.concurrency, len(payloads)),
+                    thread_name_prefix='partner-forwarder') as executor:
+                return list(executor.map(self.post, payloads))
+        return [self.post(payload) for payload in payloads]
+
+    def send(self, attempts):
+        """Sends the attempts that are still due, and returns how many were
+        committed.  Attempts for patients who are no longer the partner's
+        are skipped."""
+        from genesishealth.apps.api.models import (
+            APILogRecord, APIReadingForwardAttempt)
+        from genesishealth.apps.gdrives.models import (
+            GDriveTransmissionLogEntry)
+        attempts = [
+            attempt for attempt in attempts
+            if not attempt.committed and
+            attempt.attempts < self.partner.maximum_send_attempts]
+        patient_ids = set(self.partner.patients.filter(
+            user__in=set(attempt.reading.patient_id for attempt in attempts)
+        ).values_list('user', flat=True))
+        sendable = []
+        for attempt in attempts:
+            if attempt.reading.patient_id in patient_ids:
+                sendable.append(attempt)
+            else:
+                logger.warning(
+                    'Skipping reading %s for partner %s, whose patient it '
+                    'no longer is.', attempt.reading_id, self.partner)
+        if not sendable:
+            return 0
+
+        logs = []
+        posted = []
+        for attempt in sendable:
+            log = APILogRecord(
+                is_inbound=False,
+                datetime=utcnow(),
+                url=self.url,
+                action_type=APILogRecord.API_NAME_PUSH_DATA,
+                for_partner=self.partner,
+                reading=attempt.reading)
+            logs.append(log)
+            attempt.attempts += 1
+            # A reading that cannot be sent must not hold up the rest; it
+            # is logged and counted against its attempts like a failed post.
+            try:
+                log.data = json.dumps(
+                    self.partner.generate_reading_data(attempt.reading))
+            except Exception as e:
+                logger.exception(
+                    'Could not build the data for reading %s for partner '
+                    '%s.', attempt.reading_id, self.partner)
+                log.status = APILogRecord.STATUS_PAYLOAD_ERROR
+                log.response = repr(e)
+            else:
+                posted.append((attempt, log))
+        results = self.post_all([log.data for attempt, log in posted])
+
+        committed = []
+        for (attempt, log), (status, response) in zip(posted, results):
+            log.status = status
+            log.response = response
+            if status == APILogRecord.STATUS_COMPLETE:
+                attempt.committed = True
+                committed.append(attempt.reading_id)
+        with transaction.atomic():
+            APILogRecord.objects.bulk_create(logs)
+            APIReadingForwardAttempt.objects.bulk_update(
+                sendable, ['attempts', 'committed'])
+            GDriveTransmissionLogEntry.objects.filter(
+                reading__in=[attempt.reading_id for attempt, log in posted]
+            ).update(sent_to_api=True)
+            if committed:
+                GDriveTransmissionLogEntry.objects.filter(
+                    reading__in=committed).update(received_by_api=True)
+        return len(committed)
+
+    def send_queued(self, batch_size=500):
+        """Sends all of the partner's queued attempts, a batch at a time.
+        Returns the number of attempts processed and the number committed."""
+        from genesishealth.apps.readings.models import GlucoseReading
+        queued = self.partner.get_queued_attempts().exclude(
+            reading__measure_type=GlucoseReading.MEASURE_TYPE_TEST
+        ).select_related('reading__device', 'reading__patient')
+        sent = committed = 0
+        last_id = 0
+        while True:
+            batch = list(queued.filter(pk__gt=last_id).order_by('pk')[
+                :batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].pk
+            committed += self.send(batch)
+            sent += len(batch)
+        return sent, committed
+
+    def reforward(self, readings, batch_size=500, after_id=0, progress=None):
+        """Forwards the readings that have not yet reached the partner,
+        streaming them in id order a batch at a time.
+
+        Each batch's readings are reset for sending and given any missing
+        forward attempts in bulk, then sent as one batch.  After each batch
+        progress, if given, is called with the last reading id, which can be
+        passed back as after_id to resume, and the running totals.  Returns
+        the number of readings processed and the number committed."""
+        from genesishealth.apps.api.models import APIReadingForwardAttempt
+        reading_ids = readings.order_by('pk').values_list('pk', flat=True)
+        processed = committed = 0
+        while True:
+            batch = list(reading_ids.filter(pk__gt=after_id)[:batch_size])
+            if not batch:
+                break
+            after_id = batch[-1]
+            readings.model.objects.filter(pk__in=batch).update(
+                commit_attempts=0, committed=False)
+            APIReadingForwardAttempt.objects.bulk_create([
+                APIReadingForwardAttempt(partner=self.partner, reading_id=pk)
+                for pk in batch], ignore_conflicts=True)
+            attempts = self.partner.forward_attempts.filter(
+                reading__in=batch
+            ).select_related('reading__device', 'reading__patient')
+            committed += self.send(list(attempts))
+            processed += len(batch)
+            if progress is not None:
+                progress(after_id, processed, committed)
+        return processed, committed
@@ -0,0 +1,108 @@
+"""Measures how fast readings can be posted to a partner, against a local
+stub of a partner's push_data endpoint.
+
+The original forwarder opened a new connection for every reading and sent
+them one after another; PartnerForwarder keeps a pool of connections alive
+and posts up to --concurrency readings at once.  The stub answers each post
+with {"success": true} after --latency milliseconds.  Nothing is written to
+the database."""
+import base64
+import json
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand
+
+from genesishealth.apps.api.forwarding import PartnerForwarder
+from genesishealth.apps.api.models import APIPartner
+
+PAYLOAD = json.dumps({
+    'Glucose': {
+        'patient_id': 1,
+        'value': '120',
+        'context': 'normal',
+        'readingOn': '2020-01-01T12:00:00Z',
+        'readingTimeZone': 'America/Chicago',
+    }
+})
+
+
+class StubPartnerHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0
+    connections = set()
+
+    def do_POST(self):
+        self.connections.add(self.client_address)
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.latency:
+            time.sleep(self.latency)
+        body = json.dumps({'success': True}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def post_legacy(partner, url, encoded_data):
+    request = Request(url)
+    credentials = '%s:%s' % (
+        partner.outgoing_username, partner.outgoing_password)
+    request.add_header('Authorization', 'Basic %s' % base64.standard_b64encode(
+        credentials.encode('utf-8')).decode('ascii'))
+    request.add_header('Content-type', 'application/json')
+    context = ssl._create_unverified_context()
+    response = urlopen(request, encoded_data.encode('utf-8'), 10,
+                       context=context)
+    return json.loads(response.read())
+
+
+class Command(BaseCommand):
+    help = 'Measures reading forwarding throughput against a stub partner.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readings', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument(
+            '--latency', type=int, default=20,
+            help='Milliseconds the stub takes to answer each post.')
+
+    def handle(self, *args, **options):
+        StubPartnerHandler.latency = options['latency'] / 1000.
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubPartnerHandler)
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        url = 'http://127.0.0.1:%d/push/' % server.server_port
+        partner = APIPartner(
+            name='Stub partner', short_name='stub', api_version='2.0',
+            outgoing_username='stub', outgoing_password='stub')
+        payloads = [PAYLOAD] * options['readings']
+        try:
+            self.run('original', lambda: [
+                post_legacy(partner, url, payload) for payload in payloads])
+            forwarder = PartnerForwarder(
+                partner, url=url, concurrency=options['concurrency'],
+                retries=0)
+            self.run('pooled', lambda: forwarder.post_all(payloads))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def run(self, name, send):
+        StubPartnerHandler.connections = set()
+        start = time.perf_counter()
+        results = send()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            '%s: %d readings in %.2fs (%.1f per second) over %d '
+            'connections' % (
+                name, len(results), elapsed, len(results) / elapsed,
+                len(StubPartnerHandler.connections)))
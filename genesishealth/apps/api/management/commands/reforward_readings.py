@@ -0,0 +1,45 @@
+"""Forwards a partner's patients' historical readings, for onboarding a
+partner.
+
+Readings are streamed in id order and sent in batches; after each batch the
+last reading id is printed, and an interrupted run can be resumed from it
+with --after-id."""
+from django.core.management.base import BaseCommand, CommandError
+
+from genesishealth.apps.api.forwarding import PartnerForwarder
+from genesishealth.apps.api.models import APIPartner
+from genesishealth.apps.readings.models import GlucoseReading
+
+
+class Command(BaseCommand):
+    help = 'Forwards the historical readings of a partner\'s patients.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('partner_id', type=int)
+        parser.add_argument(
+            '--patient', type=int, action='append', dest='patient_ids',
+            help='Only forward this patient\'s readings.  May be repeated.')
+        parser.add_argument('--after-id', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        try:
+            partner = APIPartner.objects.get(pk=options['partner_id'])
+        except APIPartner.DoesNotExist:
+            raise CommandError('Partner not found.')
+        if not partner.forward_readings:
+            raise CommandError('%s does not take forwarded readings.' % partner)
+        readings = GlucoseReading.objects.filter(
+            patient__patient_profile__partners=partner)
+        if options['patient_ids']:
+            readings = readings.filter(patient__in=options['patient_ids'])
+        processed, committed = PartnerForwarder(partner).reforward(
+            readings, batch_size=options['batch_size'],
+            after_id=options['after_id'], progress=self.progress)
+        self.stdout.write('Done: %d readings, %d committed.' % (
+            processed, committed))
+
+    def progress(self, last_id, processed, committed):
+        self.stdout.write(
+            '%d readings, %d committed; resume with --after-id %d' % (
+                processed, committed, last_id))
@@ -1,15 +1,10 @@
-import base64
 import csv
 import io
 import json
 import logging
 import os
-import ssl
 
 from datetime import datetime, time, timedelta
-from urllib.error import HTTPError, URLError
-from urllib.request import urlopen, Request
-
 from dateutil.parser import parse
 
 from django.conf import settings
@@ -18,8 +13,9 @@ from django.core.exceptions import ImproperlyConfigured
 from django.db import models
 from django.utils.timezone import now
 
-from genesishealth.apps.readings.tasks import forward_reading_to_partner
-from genesishealth.apps.utils.func import utcnow
+from genesishealth.apps.api.forwarding import PartnerForwarder
+from genesishealth.apps.api.tasks import forward_queued_readings
+from genesishealth.apps.api.timezones import get_timezone_name
 
 import paramiko
 
@@ -31,6 +27,7 @@ logger = logging.getLogger('api')
 class APILogRecord(models.Model):
     STATUS_CONNECTION_ERROR = 'connection_error'
     STATUS_JSON_ERROR = 'json_error'
+    STATUS_PAYLOAD_ERROR = 'payload_error'
     STATUS_RETURNED_ERROR = 'returned_error'
     STATUS_COMPLETE = 'complete'
 
@@ -183,27 +180,8 @@ class APIPartner(models.Model):
             "%Y-%m-%dT%H:%M:%SZ"
         )
 
-        def check_timezone(tz_name, reading):
-            timezone = pytz.timezone(tz_name)
-            naive = reading.reading_datetime_utc.replace(tzinfo=None)
-            try:
-                offset = timezone.utcoffset(naive).total_seconds() / 60 / 60
-            except (pytz.NonExistentTimeError, pytz.AmbiguousTimeError):
-                return False
-            return offset == reading.reading_datetime_offset
-
-        for tz in ('America/New_York', 'America/Chicago',
-                   'America/Boise', 'America/Los_Angeles'):
-            if check_timezone(tz, reading):
-                timezone_name = tz
-                break
-        else:
-            for tz in pytz.common_timezones:
-                if check_timezone(tz, reading):
-                    timezone_name = tz
-                    break
-            else:
-                timezone_name = "Unknown"
+        timezone_name = get_timezone_name(
+            reading.reading_datetime_offset, reading.reading_datetime_utc)
 
         return {
             'Glucose': {
@@ -220,32 +198,15 @@ class APIPartner(models.Model):
             "%Y-%m-%dT%H:%M:%SZ"
         )
 
-        def check_timezone(tz_name, reading):
-            timezone = pytz.timezone(tz_name)
-            naive = reading.reading_datetime_utc.replace(tzinfo=None)
-            try:
-                offset = timezone.utcoffset(naive).total_seconds() / 60 / 60
-            except (pytz.NonExistentTimeError, pytz.AmbiguousTimeError):
-                return False
-            return offset == reading.reading_datetime_offset
         # Handle offset = 0 as a special case where we
         # look up the patient's timezone and substitute or,
         # failing that, use a default of central time.
         if reading.reading_datetime_offset == 0:
             timezone_name = 'America/Chicago'
         else:
-            for tz in ('America/New_York', 'America/Chicago',
-                       'America/Boise', 'America/Los_Angeles'):
-                if check_timezone(tz, reading):
-                    timezone_name = tz
-                    break
-            else:
-                for tz in pytz.common_timezones:
-                    if check_timezone(tz, reading):
-                        timezone_name = tz
-                        break
-                else:
-                    timezone_name = "Unknown"
+            timezone_name = get_timezone_name(
+                reading.reading_datetime_offset,
+                reading.reading_datetime_utc)
 
         return {
             'Glucose': {
@@ -274,10 +235,7 @@ class APIPartner(models.Model):
         """Forward readings from a patient to the partner."""
         assert self in patient.patient_profile.partners.all()
         if self.forward_readings:
-            readings = patient.glucose_readings.all()
-            readings.update(commit_attempts=0, committed=False)
-            for reading in readings:
-                self.send_glucose_reading(reading)
+            PartnerForwarder(self).reforward(patient.glucose_readings.all())
 
     def generate_reading_data(self, reading):
         """Generates the data that should be sent to remote server."""
@@ -443,80 +401,11 @@ class APIPartner(models.Model):
             return
         if self not in attempt.reading.patient.patient_profile.partners.all():
             raise Exception('Attempting to send reading to wrong partner.')
-        log = APILogRecord(
-            is_inbound=False,
-            datetime=utcnow(),
-            url=self.get_url('push_data'),
-            action_type='push_data',
-            for_partner=self,
-            reading=attempt.reading)
-        reading_data = self.generate_reading_data(attempt.reading)
-        encoded_data = json.dumps(reading_data)
-        log.data = encoded_data
-        # Send the reading
-        from genesishealth.apps.gdrives.models import \
-            GDriveTransmissionLogEntry
-        try:
-            attempt.reading.log_entry
-        except GDriveTransmissionLogEntry.DoesNotExist:
-            pass
-        else:
-            attempt.reading.log_entry.sent_to_api = True
-            attempt.reading.log_entry.save()
-        attempt.attempts += 1
-        push_location = self.get_url('push_data')
-        request = Request(push_location)
-        if self.api_version == "2.1":
-            request.add_header("x-api-key", self.outgoing_api_key)
-        base64string = base64.standard_b64encode(
-            "%s:%s" % (self.outgoing_username,
-                       self.outgoing_password)
-        )
-        request.add_header("Authorization",
-                           "Basic %s" % base64string)
-        request.add_header("Content-type",
-                           "application/json")
-        context = ssl._create_unverified_context()
-        try:
-            response = urlopen(
-                request, encoded_data, 10, context=context)
-        except HTTPError as e:
-            log.status = 'connection_error'
-            log.response = str(e.read())
-        except URLError as e:
-            log.status = 'connection_error'
-            log.response = e.reason
-        except Exception as e:
-            log.status = 'connection_error'
-            log.response = str(e)
-        else:
-            response_contents = response.read()
-            log.response = response_contents
-            # Interpret response
-            try:
-                decoded_response = json.loads(response_contents)
-            except ValueError:
-                log.status = 'json_error'
-            else:
-                if decoded_response.get('success'):
-                    log.status = 'complete'
-                    attempt.committed = True
-                    try:
-                        attempt.reading.log_entry
-                    except GDriveTransmissionLogEntry.DoesNotExist:
-                        pass
-                    else:
-                        attempt.reading.log_entry.received_by_api = True
-                        attempt.reading.log_entry.save()
-                else:
-                    log.status = 'returned_error'
-        attempt.save()
-        log.save()
+        PartnerForwarder(self).send([attempt])
 
     def send_queued_attempts(self):
         """Sends out all queued attempts."""
-        for attempt in self.get_queued_attempts():
-            forward_reading_to_partner.delay(self.pk, attempt.pk)
+        forward_queued_readings.delay(self.pk)
 
     def send_wellness_document(self, for_date):
         filename, doc = self.make_wellness_document(for_date)
@@ -1,16 +1,38 @@
+import logging
+
 from celery.schedules import crontab
 from celery.task import periodic_task, task
 
 from django.core.management import call_command
 
+logger = logging.getLogger('api')
+
 
 @task
 def migrate_readings(patient_ids):
-    from genesishealth.apps.accounts.models import PatientProfile
-    users = PatientProfile.objects.get_users().filter(pk__in=patient_ids)
-    for user in users:
-        for partner in user.patient_profile.partners.all():
-            partner.forward_patient_readings(user)
+    from genesishealth.apps.api.forwarding import PartnerForwarder
+    from genesishealth.apps.api.models import APIPartner
+    from genesishealth.apps.readings.models import GlucoseReading
+    partners = APIPartner.objects.filter(
+        patients__user__in=patient_ids, forward_readings=True).distinct()
+    for partner in partners:
+        readings = GlucoseReading.objects.filter(
+            patient__in=patient_ids,
+            patient__patient_profile__partners=partner)
+
+        def progress(last_id, processed, committed):
+            logger.info(
+                'Forwarded %d readings to %s (%d committed), up to reading '
+                '%d.', processed, partner, committed, last_id)
+        PartnerForwarder(partner).reforward(readings, progress=progress)
+
+
+@task
+def forward_queued_readings(partner_id):
+    from genesishealth.apps.api.forwarding import PartnerForwarder
+    from genesishealth.apps.api.models import APIPartner
+    partner = APIPartner.objects.get(pk=partner_id)
+    PartnerForwarder(partner).send_queued()
 
 
 @periodic_task(run_every=crontab(hour=0, minute=0))
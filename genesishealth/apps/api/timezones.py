@@ -0,0 +1,98 @@
+"""Naming the timezone of a reading's UTC offset for partner payloads.
+
+A reading only records its offset from UTC in hours, so partners are sent
+the first zone, US zones before the rest of pytz.common_timezones, whose
+offset matches at the reading's time, the UTC time being looked up as
+though it were local.  Searching the zones in order is slow when the match
+is far down the list, so the result is cached per offset and UTC date.  A
+date is only cached when none of the zones searched up to the match changes
+to or from the offset within two days of it; readings on other dates are
+searched individually, so every reading gets the zone the full search would
+give.
+"""
+from bisect import bisect_left
+from datetime import datetime, time, timedelta
+from functools import lru_cache
+
+import pytz
+
+PREFERRED_TIMEZONES = (
+    'America/New_York', 'America/Chicago', 'America/Boise',
+    'America/Los_Angeles')
+UNKNOWN_TIMEZONE = 'Unknown'
+TRANSITION_MARGIN = timedelta(days=2)
+
+
+def get_offset(zone, naive):
+    """The zone's offset in hours at the naive local time, or None if that
+    time does not exist or is ambiguous in the zone."""
+    try:
+        return zone.utcoffset(naive).total_seconds() / 60 / 60
+    except (pytz.NonExistentTimeError, pytz.AmbiguousTimeError):
+        return None
+
+
+class TimezoneResolver(object):
+    def __init__(self, names=None, cache_size=4096):
+        if names is None:
+            names = PREFERRED_TIMEZONES + tuple(pytz.common_timezones)
+        # A zone already checked cannot match later in the search.
+        self.names = list(dict.fromkeys(names))
+        self.zones = [pytz.timezone(name) for name in self.names]
+        self.resolve_date = lru_cache(maxsize=cache_size)(self._resolve_date)
+
+    def search(self, offset, naive):
+        for name, zone in zip(self.names, self.zones):
+            if get_offset(zone, naive) == offset:
+                return name
+        return UNKNOWN_TIMEZONE
+
+    def get_offsets_near(self, zone, day):
+        """The offsets, in hours, the zone has within TRANSITION_MARGIN of
+        the day, or None if it does not change offset then."""
+        transitions = getattr(zone, '_utc_transition_times', None)
+        if not transitions:
+            return None
+        start = datetime.combine(day, time()) - TRANSITION_MARGIN
+        end = start + timedelta(days=1) + 2 * TRANSITION_MARGIN
+        i = bisect_left(transitions, start, 1)
+        j = bisect_left(transitions, end, i)
+        if i == j:
+            return None
+        return set(
+            info[0].total_seconds() / 60 / 60
+            for info in zone._transition_info[i - 1:j])
+
+    def _resolve_date(self, offset, day):
+        """Returns the zone matching the offset throughout the day, or None
+        if it may depend on the time of day."""
+        naive = datetime.combine(day, time(12))
+        for name, zone in zip(self.names, self.zones):
+            offsets = self.get_offsets_near(zone, day)
+            if offsets is not None:
+                if offset in offsets:
+                    return None
+                # The zone cannot match at any time of the day.
+                continue
+            if get_offset(zone, naive) == offset:
+                return name
+        return UNKNOWN_TIMEZONE
+
+    def get_timezone_name(self, offset, reading_datetime_utc):
+        naive = reading_datetime_utc.replace(tzinfo=None)
+        name = self.resolve_date(offset, naive.date())
+        if name is None:
+            name = self.search(offset, naive)
+        return name
+
+
+_resolver = None
+
+
+def get_timezone_name(offset, reading_datetime_utc):
+    """Returns the name of the timezone for a reading's offset, in hours,
+    or 'Unknown'."""
+    global _resolver
+    if _resolver is None:
+        _resolver = TimezoneResolver()
+    return _resolver.get_timezone_name(offset, reading_datetime_utc)
@@ -0,0 +1,23 @@
+from django.db import migrations, models
+from django.db.models.functions import Lower
+
+
+def populate_meid_lower(apps, schema_editor):
+    GDrive = apps.get_model("gdrives", "GDrive")
+    GDrive.objects.update(meid_lower=Lower('meid'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gdrives', '0061_auto_20200601_0444'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gdrive',
+            name='meid_lower',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=16),
+        ),
+        migrations.RunPython(populate_meid_lower, migrations.RunPython.noop),
+    ]
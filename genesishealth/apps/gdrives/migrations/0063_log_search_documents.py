@@ -0,0 +1,72 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+# The documents hold the columns the log tables search (see
+# genesishealth.apps.logs.views.reading); existing rows are filled in by the
+# rebuild_search_documents command.
+SEARCH_DOCUMENT_TRIGGERS = """
+CREATE FUNCTION gdrives_transmission_search_document() RETURNS trigger AS $$
+BEGIN
+    NEW.search_document := lower(concat_ws(' ',
+        NEW.reading_server, NEW.decrypted_content, NEW.processing_succeeded,
+        NEW.success_sent_to_client, NEW.error));
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER gdrives_transmission_search_document
+    BEFORE INSERT OR UPDATE ON gdrives_gdrivetransmissionlogentry
+    FOR EACH ROW EXECUTE PROCEDURE gdrives_transmission_search_document();
+
+CREATE FUNCTION gdrives_log_search_document() RETURNS trigger AS $$
+BEGIN
+    NEW.search_document := lower(concat_ws(' ',
+        NEW.date_created, NEW.meid, NEW.status));
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER gdrives_log_search_document
+    BEFORE INSERT OR UPDATE ON gdrives_gdrivelogentry
+    FOR EACH ROW EXECUTE PROCEDURE gdrives_log_search_document();
+"""
+
+DROP_SEARCH_DOCUMENT_TRIGGERS = """
+DROP TRIGGER gdrives_transmission_search_document
+    ON gdrives_gdrivetransmissionlogentry;
+DROP FUNCTION gdrives_transmission_search_document();
+DROP TRIGGER gdrives_log_search_document ON gdrives_gdrivelogentry;
+DROP FUNCTION gdrives_log_search_document();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gdrives', '0062_gdrive_meid_lower'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='gdrivetransmissionlogentry',
+            name='search_document',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='gdrivelogentry',
+            name='search_document',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.RunSQL(
+            SEARCH_DOCUMENT_TRIGGERS, DROP_SEARCH_DOCUMENT_TRIGGERS),
+        migrations.AddIndex(
+            model_name='gdrivetransmissionlogentry',
+            index=GinIndex(fields=['search_document'], name='gdrives_transmission_search', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='gdrivelogentry',
+            index=GinIndex(fields=['search_document'], name='gdrives_log_search', opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations
+
+# concat_ws writes booleans as t/f, while the icontains search the documents
+# replace matched true/false; cast them to text first.  Existing rows keep
+# the old document until the rebuild_search_documents command is run.
+SEARCH_DOCUMENT_FUNCTION = """
+CREATE OR REPLACE FUNCTION gdrives_transmission_search_document()
+RETURNS trigger AS $$
+BEGIN
+    NEW.search_document := lower(concat_ws(' ',
+        NEW.reading_server, NEW.decrypted_content,
+        NEW.processing_succeeded::text, NEW.success_sent_to_client::text,
+        NEW.error));
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+OLD_SEARCH_DOCUMENT_FUNCTION = """
+CREATE OR REPLACE FUNCTION gdrives_transmission_search_document()
+RETURNS trigger AS $$
+BEGIN
+    NEW.search_document := lower(concat_ws(' ',
+        NEW.reading_server, NEW.decrypted_content, NEW.processing_succeeded,
+        NEW.success_sent_to_client, NEW.error));
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gdrives', '0063_log_search_documents'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            SEARCH_DOCUMENT_FUNCTION, OLD_SEARCH_DOCUMENT_FUNCTION),
+    ]
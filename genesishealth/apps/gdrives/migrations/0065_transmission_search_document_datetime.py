@@ -0,0 +1,60 @@
+from django.db import migrations
+from django.db.models import F, Max
+
+# The transmission log table's Date column is searchable too, so its value
+# goes in the document, written as the icontains search on it matched it.
+SEARCH_DOCUMENT_FUNCTION = """
+CREATE OR REPLACE FUNCTION gdrives_transmission_search_document()
+RETURNS trigger AS $$
+BEGIN
+    NEW.search_document := lower(concat_ws(' ',
+        NEW.datetime::text, NEW.reading_server, NEW.decrypted_content,
+        NEW.processing_succeeded::text, NEW.success_sent_to_client::text,
+        NEW.error));
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+OLD_SEARCH_DOCUMENT_FUNCTION = """
+CREATE OR REPLACE FUNCTION gdrives_transmission_search_document()
+RETURNS trigger AS $$
+BEGIN
+    NEW.search_document := lower(concat_ws(' ',
+        NEW.reading_server, NEW.decrypted_content,
+        NEW.processing_succeeded::text, NEW.success_sent_to_client::text,
+        NEW.error));
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+CHUNK_SIZE = 10000
+
+
+def rebuild_search_documents(apps, schema_editor):
+    # As the rebuild_search_documents command does; the migration is not
+    # atomic, so each chunk is committed on its own.
+    GDriveTransmissionLogEntry = apps.get_model(
+        'gdrives', 'GDriveTransmissionLogEntry')
+    entries = GDriveTransmissionLogEntry.objects.using(
+        schema_editor.connection.alias)
+    max_pk = entries.aggregate(max_pk=Max('pk'))['max_pk'] or 0
+    for start in range(0, max_pk, CHUNK_SIZE):
+        entries.filter(pk__gt=start, pk__lte=start + CHUNK_SIZE).update(
+            search_document=F('search_document'))
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('gdrives', '0064_log_search_document_booleans'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            SEARCH_DOCUMENT_FUNCTION, OLD_SEARCH_DOCUMENT_FUNCTION),
+        migrations.RunPython(
+            rebuild_search_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('gdrives', '0065_transmission_search_document_datetime'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gdrivetransmissionlogentry',
+            name='spool_position',
+            field=models.CharField(editable=False, max_length=64, null=True),
+        ),
+        AddIndexConcurrently(
+            model_name='gdrivetransmissionlogentry',
+            index=models.Index(fields=['reading_server', 'spool_position'], name='gdrives_transmission_spool'),
+        ),
+    ]
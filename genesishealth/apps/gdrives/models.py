@@ -1,10 +1,12 @@
 import logging
-import json
 import datetime
 import pytz
 
+from ast import literal_eval
+
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 from django.db.models import Q
 from django.utils.timezone import now
@@ -12,6 +14,7 @@ from django.utils.timezone import now
 from genesishealth.apps.api.models import APIPartner
 from genesishealth.apps.dropdowns.models import DeviceProblem, MeterDisposition
 from genesishealth.apps.utils.func import utcnow
+from genesishealth.external.middleman.parse import Transmission
 
 
 logger = logging.getLogger('gdrives')
@@ -107,6 +110,9 @@ class GDrive(models.Model):
         limit_choices_to={'groups__name': 'Professional'}
     )
     meid = models.CharField(max_length=16, unique=True)
+    # Lowercase copy of meid, so case-insensitive lookups can use an index.
+    meid_lower = models.CharField(
+        max_length=16, db_index=True, editable=False, default='')
     device_type = models.CharField(blank=True, max_length=100,
                                    default="glucose")
     device_id = models.CharField(
@@ -340,6 +346,10 @@ class GDrive(models.Model):
                 reading.patient = self.patient
                 reading.save()
                 recovered_count += 1
+            if recovered_count:
+                from genesishealth.apps.readings.models import (
+                    DailyReadingRollup)
+                DailyReadingRollup.rebuild([self.patient.pk])
         return recovered_count
 
     def register(self, patient: User) -> None:
@@ -382,6 +392,8 @@ class GDrive(models.Model):
                 self.patient.patient_profile.get_group():
             self.group = self.patient.patient_profile.get_group()
 
+        self.meid_lower = self.meid.lower()
+
         super(GDrive, self).save(*args, **kwargs)
 
     def send_http_reading(self, **kwargs):
@@ -521,13 +533,50 @@ class GDriveTransmissionLogEntry(models.Model):
     received_by_api = models.BooleanField(default=False)
     hide_from_qa_log = models.BooleanField(default=False)
     hide_from_orphaned_log = models.BooleanField(default=False)
+    # Lowercased searchable columns of the transmission log table,
+    # maintained by a database trigger.
+    search_document = models.TextField(default='', editable=False)
+    # Where drain_reading_spool read the transmission from, so a replayed
+    # transmission is not logged twice.
+    spool_position = models.CharField(
+        max_length=64, null=True, editable=False)
 
     objects = GDriveTransmissionLogEntryManager()
 
+    class Meta:
+        indexes = [
+            GinIndex(
+                fields=['search_document'],
+                name='gdrives_transmission_search',
+                opclasses=['gin_trgm_ops']),
+            models.Index(
+                fields=['reading_server', 'spool_position'],
+                name='gdrives_transmission_spool'),
+        ]
+
+    @classmethod
+    def for_transmission(cls, transmission, **kwargs):
+        """Creates an (unsaved) entry for an already decrypted
+        transmission."""
+        entry = cls(content=transmission.content, **kwargs)
+        entry._transmission = transmission
+        if transmission.verified:
+            entry.decrypted_content = str(transmission.fields)
+        return entry
+
+    def __init__(self, *args, **kwargs):
+        super(GDriveTransmissionLogEntry, self).__init__(*args, **kwargs)
+        self._transmission = None
+        self._data = None
+
     def _get_value(self, field_name):
-        if not hasattr(self, '__data'):
-            self.__data = json.loads(self.decrypted_content.replace("'", '"'))
-        return self.__data[field_name]
+        if self._data is None:
+            if self._transmission is not None:
+                self._data = self._transmission.fields
+            else:
+                # decrypted_content is the repr of the decrypted fields.
+                self._data = literal_eval(self.decrypted_content)
+        return self._data[field_name]
 
     def determine_info(self):
         do_save = False
@@ -615,12 +664,20 @@ class GDriveTransmissionLogEntry(models.Model):
         if self.reading is not None:
             return self.reading.patient
 
+    def get_transmission(self):
+        """Returns the decrypted transmission, decrypting the content only
+        if it hasn't been already."""
+        if self._transmission is None:
+            self._transmission = Transmission.decrypt(
+                self.content, settings.GDRIVE_DECRYPTION_KEY)
+        return self._transmission
+
     def recover(self):
         """Retries the data in the transmission log to create a reading."""
         from genesishealth.apps.readings.models import GlucoseReading
         success, decrypted_data, error_message, reading, patient = \
             GlucoseReading.process_reading(
-                self.content, log_results=False)
+                self.get_transmission(), log_results=False)
         if success:
             self.reading = reading
             self.recovered = True
@@ -668,6 +725,17 @@ class GDriveLogEntry(models.Model):
     hide_from_control_log = models.BooleanField(default=False)
     reading_server = models.ForeignKey(
         'monitoring.ReadingServer', null=True, related_name='log_entries', on_delete=models.SET_NULL)
+    # Lowercased searchable columns of the device log table, maintained by a
+    # database trigger.
+    search_document = models.TextField(default='', editable=False)
+
+    class Meta:
+        indexes = [
+            GinIndex(
+                fields=['search_document'],
+                name='gdrives_log_search',
+                opclasses=['gin_trgm_ops'])
+        ]
 
     def device_exists(self):
         return self.device and 'Yes' or 'No'
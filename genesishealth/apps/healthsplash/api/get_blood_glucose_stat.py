@@ -3,10 +3,7 @@ from typing import Optional, Any, Dict, Union
 
 import numpy
 from django.contrib.auth.models import User
-from django.db.models import QuerySet
 from django.utils.timezone import now
-from matplotlib import pyplot
-from matplotlib.dates import YearLocator, DateFormatter, DayLocator
 from pronym_api.models import ApiAccountMember
 from pronym_api.views.actions import ApiProcessingFailure, ResourceAction, ResourceT
 from pronym_api.views.api_view import ResourceApiView, HttpMethod
@@ -17,6 +14,9 @@ from genesishealth.apps.gdrives.models import GDrive
 from genesishealth.apps.healthsplash.models import BloodGlucoseGraph
 from genesishealth.apps.readings.models import GlucoseReading
 
+# The windows, in days, the endpoint reports on.
+WINDOWS = (7, 14, 28, 90)
+
 
 class GetBloodGlucoseStatAction(ResourceAction[User]):
     def execute(
@@ -44,41 +44,48 @@ class GetBloodGlucoseStatAction(ResourceAction[User]):
             'product_type': 'Glucose Monitor',
             'product_name': 'GHT Glucose Meter'
         }
-        for i in (7, 14, 28, 90):
-            output[f'glucose_{i}_days'] = self.__get_reading_data_for_period(user, i)
-        cutoff = now() - timedelta(days=90)
-        readings_90: 'QuerySet[GlucoseReading]' = user.glucose_readings.filter(
-            reading_datetime_utc__gt=cutoff).order_by('reading_datetime_utc')
-        reading: GlucoseReading
+        current_time = now()
+        # One query for the longest window; the shorter ones are slices of it.
+        readings = list(user.glucose_readings.filter(
+            reading_datetime_utc__gt=current_time - timedelta(days=max(WINDOWS))
+        ).order_by('reading_datetime_utc').values_list(
+            'id', 'reading_datetime_utc', 'device_id', 'glucose_value', 'measure_type'))
+        timestamps = numpy.array([reading[1].timestamp() for reading in readings], dtype=float)
+        values = numpy.array([reading[3] for reading in readings], dtype=int)
+        graphs = BloodGlucoseGraph.objects.for_windows(user, WINDOWS, current_time)
+        for i in WINDOWS:
+            cutoff = (current_time - timedelta(days=i)).timestamp()
+            output[f'glucose_{i}_days'] = self.__get_reading_data_for_period(
+                values[numpy.searchsorted(timestamps, cutoff, side='right'):], graphs[i])
+        meid = device.meid if device else None
+        measure_types = dict(GlucoseReading.MEASURE_TYPES)
         output['readings'] = [
             {
-                'id': reading.id,
-                'datetime': str(reading.reading_datetime_utc),
-                'meid': device.meid if reading.device else None,
-                'glucose_value': reading.glucose_value,
+                'id': reading_id,
+                'datetime': str(reading_datetime),
+                'meid': meid if device_id else None,
+                'glucose_value': glucose_value,
                 'survey_response': [
                     {
                         'question': 'Was this reading pre-meal, post-meal, or normal?',
-                        'answer': reading.get_measure_type_display()
+                        'answer': measure_types.get(measure_type, measure_type)
                     }
                 ]
             }
-            for reading in readings_90
+            for reading_id, reading_datetime, device_id, glucose_value, measure_type in readings
         ]
         return output
 
     @staticmethod
-    def __get_reading_data_for_period(user: User, days: int) -> Dict[str, Any]:
-        average = user.patient_profile.get_average_glucose_level(days)
-        cutoff = now() - timedelta(days=days)
-        readings = user.glucose_readings.filter(reading_datetime_utc__gt=cutoff).order_by('glucose_value')
-        graph = BloodGlucoseGraph.for_readings(readings, cutoff.date(), now().date())
-        if len(readings) == 0:
+    def __get_reading_data_for_period(values: numpy.ndarray, graph: BloodGlucoseGraph) -> Dict[str, Any]:
+        if len(values) == 0:
+            average = None
             max_reading = None
             min_reading = None
         else:
-            min_reading = readings[0].glucose_value
-            max_reading = readings.order_by('-glucose_value')[0].glucose_value
+            average = float(values.mean())
+            min_reading = int(values.min())
+            max_reading = int(values.max())
         return {
             'average': average,
             'max': max_reading,
@@ -0,0 +1,117 @@
+"""Compares the healthsplash blood glucose stat endpoint with the version that
+queried each window separately and built a model instance per reading, for a
+patient with many readings.
+
+The readings are added to an existing patient inside a transaction that is
+rolled back afterwards.  Both versions are run once before timing, so the
+graphs they share are already rendered."""
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+
+from genesishealth.apps.healthsplash.api.get_blood_glucose_stat import (
+    WINDOWS, GetBloodGlucoseStatAction)
+from genesishealth.apps.healthsplash.models import BloodGlucoseGraph
+from genesishealth.apps.readings.models import GlucoseReading
+
+
+class LegacyGetBloodGlucoseStatAction(GetBloodGlucoseStatAction):
+    def execute(self, request, account_member, resource):
+        user = resource
+        device = user.patient_profile.get_device()
+        output = {'id': resource.id}
+        graphs = BloodGlucoseGraph.objects.for_windows(user, WINDOWS)
+        for i in WINDOWS:
+            average = user.patient_profile.get_average_glucose_level(i)
+            cutoff = now() - timedelta(days=i)
+            readings = user.glucose_readings.filter(
+                reading_datetime_utc__gt=cutoff).order_by('glucose_value')
+            if len(readings) == 0:
+                max_reading = None
+                min_reading = None
+            else:
+                min_reading = readings[0].glucose_value
+                max_reading = readings.order_by(
+                    '-glucose_value')[0].glucose_value
+            output[f'glucose_{i}_days'] = {
+                'average': average,
+                'max': max_reading,
+                'min': min_reading,
+                'line_graph': graphs[i].get_secure_url()
+            }
+        cutoff = now() - timedelta(days=90)
+        output['readings'] = [
+            {
+                'id': reading.id,
+                'datetime': str(reading.reading_datetime_utc),
+                'meid': device.meid if reading.device else None,
+                'glucose_value': reading.glucose_value,
+                'survey_response': [
+                    {
+                        'question': 'Was this reading pre-meal, post-meal, or normal?',
+                        'answer': reading.get_measure_type_display()
+                    }
+                ]
+            }
+            for reading in user.glucose_readings.filter(
+                reading_datetime_utc__gt=cutoff).order_by('reading_datetime_utc')
+        ]
+        return output
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the healthsplash blood glucose stat endpoint.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('patient', type=int, help='Patient user id.')
+        parser.add_argument(
+            '--readings', type=int, default=5000,
+            help='Readings to add over the last 90 days.')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(
+                pk=options['patient'], patient_profile__isnull=False)
+        except User.DoesNotExist:
+            raise CommandError('No patient with id %s.' % options['patient'])
+        with transaction.atomic():
+            self.add_readings(user, options['readings'])
+            for name, action in (
+                    ('original', LegacyGetBloodGlucoseStatAction()),
+                    ('vectorized', GetBloodGlucoseStatAction())):
+                action.execute({}, None, user)
+                timings = []
+                for i in range(options['repeat']):
+                    with CaptureQueriesContext(connection) as queries:
+                        start = time.perf_counter()
+                        output = action.execute({}, None, user)
+                        timings.append(time.perf_counter() - start)
+                self.stdout.write(
+                    '%s: %d readings, best %.3fs, mean %.3fs, %d queries' % (
+                        name, len(output['readings']), min(timings),
+                        sum(timings) / len(timings), len(queries)))
+            transaction.set_rollback(True)
+
+    def add_readings(self, user, count):
+        device = user.patient_profile.get_device()
+        current_time = now()
+        measure_types = [
+            measure_type for measure_type, _ in
+            GlucoseReading.PUBLIC_MEASURE_TYPES]
+        GlucoseReading.objects.bulk_create([
+            GlucoseReading(
+                patient=user,
+                device=device,
+                reading_datetime_utc=current_time - timedelta(
+                    seconds=random.randint(0, 90 * 24 * 60 * 60)),
+                glucose_value=random.randint(40, 400),
+                measure_type=random.choice(measure_types),
+                raw_data='benchmark')
+            for i in range(count)], batch_size=1000)
@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('healthsplash', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bloodglucosegraph',
+            name='fingerprint',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='bloodglucosegraph',
+            name='last_used',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='bloodglucosegraph',
+            name='patient',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='blood_glucose_graphs', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='bloodglucosegraph',
+            name='window_days',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='bloodglucosegraph',
+            unique_together={('patient', 'window_days', 'fingerprint')},
+        ),
+    ]
@@ -1,68 +1,180 @@
-from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 from io import BytesIO
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 
 import numpy
 from django.conf import settings
-from django.core.files import File
-from django.db import models
-from django.db.models import QuerySet
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, Max, Q
 from django.urls import reverse
-from matplotlib import pyplot
+from django.utils.timezone import now
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.dates import MonthLocator, DateFormatter, DayLocator
+from matplotlib.figure import Figure
 
-from genesishealth.apps.readings.models import GlucoseReading
+_render_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_render_executor() -> Optional[ThreadPoolExecutor]:
+    """The pool graphs are rendered in, or None to render in the calling
+    thread (settings.BLOOD_GLUCOSE_GRAPH_RENDER_WORKERS)."""
+    global _render_executor
+    if _render_executor is None and settings.BLOOD_GLUCOSE_GRAPH_RENDER_WORKERS > 0:
+        _render_executor = ThreadPoolExecutor(
+            max_workers=settings.BLOOD_GLUCOSE_GRAPH_RENDER_WORKERS,
+            thread_name_prefix='blood-glucose-graph')
+    return _render_executor
+
+
+def render_graph(points: Sequence[Tuple[datetime, int]], start_date: date, end_date: date) -> bytes:
+    """Renders a line graph of (datetime, value) points as a PNG.
+
+    Each graph gets its own Figure and Agg canvas rather than going through pyplot, whose global
+    state is not thread safe and keeps every figure open until it is closed."""
+    date_format = "%m-%d-%y"
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    ax.plot(
+        [numpy.datetime64(reading_datetime) for reading_datetime, _ in points],
+        [value for _, value in points],
+        'ko:'
+    )
+    # Add a day to the end date, so we include all the readings from that day.
+    ax.set_xlim(numpy.datetime64(start_date), numpy.datetime64(end_date + timedelta(days=1)))
+    ax.set_title(f"Blood Glucose - {start_date.strftime(date_format)} - {end_date.strftime(date_format)}")
+    ax.set_ylabel("Blood Sugar - mg/dL")
+    ax.set_xlabel("Date")
+    x_axis = ax.xaxis
+    # Depending on our interval, use different ticks.
+    interval_days = int((end_date - start_date).total_seconds() // 60 // 60 // 24)
+    if interval_days >= 30:
+        x_axis.set_major_locator(MonthLocator())
+        x_axis.set_major_formatter(DateFormatter("%m-%Y"))
+        x_axis.set_minor_locator(DayLocator())
+    else:
+        day_interval: int
+        if interval_days <= 7:
+            day_interval = 1
+        else:
+            day_interval = interval_days // 7
+        x_axis.set_major_locator(DayLocator(bymonthday=range(1, 32, day_interval)))
+        x_axis.set_major_formatter(DateFormatter("%m-%d"))
+        x_axis.set_minor_locator(DayLocator())
+    fig.autofmt_xdate()
+    buf = BytesIO()
+    fig.savefig(buf, format='png')
+    return buf.getvalue()
+
+
+class BloodGlucoseGraphManager(models.Manager):
+    def for_windows(
+            self,
+            patient: User,
+            windows: Iterable[int],
+            current_time: Optional[datetime] = None
+    ) -> Dict[int, 'BloodGlucoseGraph']:
+        """Returns a graph of the patient's readings over each of the last `windows` days.
+
+        A graph is reused for as long as the window's dates, reading count and latest reading
+        stay the same; only the windows that changed are rendered again."""
+        if current_time is None:
+            current_time = now()
+        windows = sorted(set(windows))
+        cutoffs = dict((days, current_time - timedelta(days=days)) for days in windows)
+        aggregates = {}
+        for days, cutoff in cutoffs.items():
+            in_window = Q(reading_datetime_utc__gt=cutoff)
+            aggregates[f'count_{days}'] = Count('pk', filter=in_window)
+            aggregates[f'latest_{days}'] = Max('pk', filter=in_window)
+        stats = patient.glucose_readings.aggregate(**aggregates)
+        fingerprints = dict(
+            (days, '{}:{}:{}:{}'.format(
+                cutoff.date(), current_time.date(), stats[f'count_{days}'], stats[f'latest_{days}']))
+            for days, cutoff in cutoffs.items())
+
+        graphs = {}
+        for graph in self.filter(
+                patient=patient, window_days__in=windows, fingerprint__in=fingerprints.values()):
+            if fingerprints[graph.window_days] == graph.fingerprint:
+                graphs[graph.window_days] = graph
+        if graphs:
+            self.filter(pk__in=[graph.pk for graph in graphs.values()]).update(last_used=current_time)
+
+        missing = [days for days in windows if days not in graphs]
+        if missing:
+            # The longest window holds the readings of all the others.
+            points = list(patient.glucose_readings.filter(
+                reading_datetime_utc__gt=cutoffs[missing[-1]]
+            ).order_by('reading_datetime_utc').values_list('reading_datetime_utc', 'glucose_value'))
+            jobs = [(
+                [point for point in points if point[0] > cutoffs[days]],
+                cutoffs[days].date(),
+                current_time.date()) for days in missing]
+            executor = get_render_executor()
+            if executor is not None and len(jobs) > 1:
+                images = list(executor.map(lambda job: render_graph(*job), jobs))
+            else:
+                images = [render_graph(*job) for job in jobs]
+            for days, image in zip(missing, images):
+                graphs[days] = self.store(patient, days, fingerprints[days], image, current_time)
+        return graphs
+
+    def store(
+            self,
+            patient: User,
+            window_days: int,
+            fingerprint: str,
+            image: bytes,
+            current_time: datetime
+    ) -> 'BloodGlucoseGraph':
+        graph = self.model(
+            patient=patient, window_days=window_days, fingerprint=fingerprint, last_used=current_time)
+        try:
+            with transaction.atomic():
+                graph.image.save(f'{patient.pk}-{window_days}.png', ContentFile(image))
+        except IntegrityError:
+            # Another request rendered the same graph first.
+            graph.image.delete(save=False)
+            return self.get(patient=patient, window_days=window_days, fingerprint=fingerprint)
+        return graph
+
+    def sweep_stale(self, batch_size: int = 500) -> int:
+        """Deletes graphs, and their images, that have not been used for
+        settings.BLOOD_GLUCOSE_GRAPH_MAX_AGE_DAYS days.  Returns the number deleted."""
+        cutoff = now() - timedelta(days=settings.BLOOD_GLUCOSE_GRAPH_MAX_AGE_DAYS)
+        stale = self.filter(
+            Q(last_used__lt=cutoff) | Q(last_used__isnull=True, datetime_added__lt=cutoff))
+        deleted = 0
+        while True:
+            batch: List[BloodGlucoseGraph] = list(stale.order_by('pk')[:batch_size])
+            if not batch:
+                break
+            for graph in batch:
+                graph.image.delete(save=False)
+            self.filter(pk__in=[graph.pk for graph in batch]).delete()
+            deleted += len(batch)
+        return deleted
 
 
 class BloodGlucoseGraph(models.Model):
     """A stored image of a line graph for a period of readings."""
     datetime_added = models.DateTimeField(auto_now_add=True)
     image = models.ImageField(upload_to="blood_glucose_graph/")
+    # Set for the graphs BloodGlucoseGraph.objects.for_windows reuses.
+    patient = models.ForeignKey(
+        User, null=True, related_name='blood_glucose_graphs', on_delete=models.CASCADE)
+    window_days = models.PositiveIntegerField(null=True)
+    fingerprint = models.CharField(max_length=100, blank=True)
+    last_used = models.DateTimeField(null=True)
 
-    @classmethod
-    def for_readings(
-            cls,
-            readings: 'QuerySet[GlucoseReading]',
-            start_date: date,
-            end_date: date
-    ) -> 'BloodGlucoseGraph':
-        """Create a graph for the given set of readings, for the given period of time."""
-        date_format = "%m-%d-%y"
-        fig, ax = pyplot.subplots()
-        sorted_readings = readings.order_by('reading_datetime_utc')
-        ax.plot(
-            [numpy.datetime64(reading.reading_datetime_utc) for reading in sorted_readings],
-            [reading.glucose_value for reading in sorted_readings],
-            'ko:'
-        )
-        # Add a day to the end date, so we include all the readings from that day.
-        ax.set_xlim(numpy.datetime64(start_date), numpy.datetime64(end_date + timedelta(days=1)))
-        pyplot.title(f"Blood Glucose - {start_date.strftime(date_format)} - {end_date.strftime(date_format)}")
-        pyplot.ylabel("Blood Sugar - mg/dL")
-        pyplot.xlabel("Date")
-        x_axis = ax.xaxis
-        # Depending on our interval, use different ticks.
-        interval_days = int((end_date - start_date).total_seconds() // 60 // 60 // 24)
-        if interval_days >= 30:
-            x_axis.set_major_locator(MonthLocator())
-            x_axis.set_major_formatter(DateFormatter("%m-%Y"))
-            x_axis.set_minor_locator(DayLocator())
-        else:
-            day_interval: int
-            if interval_days <= 7:
-                day_interval = 1
-            else:
-                day_interval = interval_days // 7
-            x_axis.set_major_locator(DayLocator(bymonthday=range(1, 32, day_interval)))
-            x_axis.set_major_formatter(DateFormatter("%m-%d"))
-            x_axis.set_minor_locator(DayLocator())
-        fig.autofmt_xdate()
-        buf = BytesIO()
-        pyplot.savefig(buf)
+    objects = BloodGlucoseGraphManager()
 
-        graph: BloodGlucoseGraph = BloodGlucoseGraph.objects.create()
-        graph.image.save(f'{graph.pk}.png', File(buf))
-
-        return graph
+    class Meta:
+        unique_together = ('patient', 'window_days', 'fingerprint')
 
     def get_secure_url(self) -> str:
         path = reverse('healthsplash:blood-glucose-graph', args=[self.pk])
@@ -0,0 +1,13 @@
+import logging
+
+from celery.schedules import crontab
+from celery.task import periodic_task
+
+logger = logging.getLogger(__name__)
+
+
+@periodic_task(run_every=crontab(hour=3, minute=15))
+def sweep_stale_blood_glucose_graphs():
+    from genesishealth.apps.healthsplash.models import BloodGlucoseGraph
+    deleted = BloodGlucoseGraph.objects.sweep_stale()
+    logger.info('Deleted %d stale blood glucose graphs.', deleted)
@@ -10,12 +10,15 @@ from genesishealth.apps.gdrives.models import (
 from genesishealth.apps.utils.class_views import (
     GenesisTableView, AttributeTableColumn)
 from genesishealth.apps.utils.request import admin_user
+from genesishealth.apps.utils.table_search import SearchDocumentBackend
 
 admin_test = user_passes_test(admin_user)
 
 
 class LogTableView(GenesisTableView):
-    fake_count = True
+    estimated_count = True
+    keyset_pagination = True
+    search_backend = SearchDocumentBackend()
 
     def create_columns(self):
         return [
@@ -45,13 +48,18 @@ class LogTableView(GenesisTableView):
         return 'Device Log'
 
     def get_queryset(self):
+        # Whole hours keep the query the same between requests, so paging
+        # can use the keys KeysetPaginator cached.
+        cutoff = now().replace(minute=0, second=0, microsecond=0)
         return GDriveLogEntry.objects.filter(
-            date_created__gt=now() - timedelta(days=365))
+            date_created__gt=cutoff - timedelta(days=365))
 logs = login_required(admin_test(LogTableView.as_view()))
 
 
 class TransmissionLogTableView(GenesisTableView):
-    fake_count = True
+    estimated_count = True
+    keyset_pagination = True
+    search_backend = SearchDocumentBackend()
 
     def create_columns(self):
         return [
@@ -0,0 +1,79 @@
+"""Times NursingQueueService.populate against a synthetic dataset.
+
+The patients, readings and queue entries are created inside a transaction
+that is rolled back afterwards."""
+import random
+import time
+
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+
+from genesishealth.apps.accounts.models import Contact, PatientProfile
+from genesishealth.apps.nursing.models import NursingGroup
+from genesishealth.apps.nursing_queue.service import NursingQueueService
+from genesishealth.apps.readings.models import GlucoseReading
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks populating the nursing queue on synthetic patients.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=50000)
+        parser.add_argument('--readings-per-patient', type=int, default=10)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            start = time.perf_counter()
+            self.create_dataset(options)
+            self.stdout.write('Created %d patients in %.2fs.' % (
+                options['patients'], time.perf_counter() - start))
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                added = NursingQueueService().populate()
+                elapsed = time.perf_counter() - start
+            self.stdout.write(
+                'Populated the queue in %.2fs with %d queries: %s' % (
+                    elapsed, len(queries), added))
+            transaction.set_rollback(True)
+
+    def create_dataset(self, options):
+        batch_size = options['batch_size']
+        count = options['patients']
+        prefix = 'nq-benchmark-%d' % random.randint(0, 10 ** 9)
+        nursing_group = NursingGroup.objects.create(
+            name=prefix, address='', city='', zip='', state='')
+        users = User.objects.bulk_create(
+            [User(username='%s-%d' % (prefix, i)) for i in range(count)],
+            batch_size=batch_size)
+        contacts = Contact.objects.bulk_create(
+            [Contact() for _ in range(count)], batch_size=batch_size)
+        profiles = []
+        for i, (user, contact) in enumerate(zip(users, contacts)):
+            profile = PatientProfile(
+                user=user, contact=contact, nursing_group=nursing_group)
+            # Some patients override the defaults.
+            if i % 10 == 0:
+                profile.reading_too_high_threshold = 180
+                profile.not_enough_recent_readings_interval = 14
+            profiles.append(profile)
+        PatientProfile.objects.bulk_create(profiles, batch_size=batch_size)
+        current_time = now()
+        readings = []
+        for user in users:
+            for _ in range(options['readings_per_patient']):
+                readings.append(GlucoseReading(
+                    patient=user,
+                    reading_datetime_utc=current_time - timedelta(
+                        seconds=random.randint(0, 14 * 24 * 60 * 60)),
+                    glucose_value=random.randint(40, 300),
+                    raw_data=''))
+                if len(readings) >= batch_size:
+                    GlucoseReading.objects.bulk_create(readings)
+                    readings = []
+        GlucoseReading.objects.bulk_create(readings)
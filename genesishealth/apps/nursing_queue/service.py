@@ -1,109 +1,157 @@
 from datetime import timedelta
 
+from django.conf import settings
+from django.db.models import (
+    Case, Count, DateTimeField, DurationField, ExpressionWrapper, F,
+    IntegerField, Q, Value, When)
+from django.db.models.functions import Coalesce
 from django.utils.timezone import now
 
 from genesishealth.apps.accounts.models import PatientProfile
-from genesishealth.apps.nursing.models import NursingGroup
 from genesishealth.apps.nursing_queue.models import NursingQueueEntry
+from genesishealth.apps.readings.models import GlucoseReading
+
+
+# Annotation name -> (field on the patient, company and group, default
+# setting).  The first of the patient's, their company's and the company's
+# group's values that is set wins, as in the PatientProfile getters.
+THRESHOLDS = {
+    'too_high_interval': (
+        'reading_too_high_interval', 'DEFAULT_READINGS_TOO_HIGH_INTERVAL'),
+    'too_high_threshold': (
+        'reading_too_high_threshold', 'DEFAULT_READINGS_TOO_HIGH_THRESHOLD'),
+    'too_high_limit': (
+        'reading_too_high_limit', 'DEFAULT_READINGS_TOO_HIGH_LIMIT'),
+    'too_low_interval': (
+        'reading_too_low_interval', 'DEFAULT_READINGS_TOO_LOW_INTERVAL'),
+    'too_low_threshold': (
+        'reading_too_low_threshold', 'DEFAULT_READINGS_TOO_LOW_THRESHOLD'),
+    'too_low_limit': (
+        'reading_too_low_limit', 'DEFAULT_READINGS_TOO_LOW_LIMIT'),
+    'not_enough_interval': (
+        'not_enough_recent_readings_interval',
+        'DEFAULT_NOT_ENOUGH_RECENT_READINGS_INTERVAL'),
+    'not_enough_minimum': (
+        'not_enough_recent_readings_minimum',
+        'DEFAULT_NOT_ENOUGH_RECENT_READINGS_MINIMUM'),
+}
+
+
+def get_threshold_annotations(prefix=''):
+    """Returns the effective thresholds as annotations, for a queryset on
+    PatientProfile or, with a prefix, on a model related to one."""
+    annotations = {}
+    for name, (field_name, setting_name) in THRESHOLDS.items():
+        annotations[name] = Coalesce(
+            F(prefix + field_name),
+            F(prefix + 'company__' + field_name),
+            F(prefix + 'company__group__' + field_name),
+            Value(getattr(settings, setting_name)),
+            output_field=IntegerField())
+    return annotations
 
 
 class NursingQueueService:
     """A service for populating the nursing queue for nurses, based
     on the behavior of patients in their watch list."""
-    def populate(self):
-        for patient in PatientProfile.objects.filter(
-                account_status=PatientProfile.ACCOUNT_STATUS_ACTIVE):
-            self._populate_queue_entries_for_patient(patient)
+    def populate(self) -> dict:
+        """Adds queue entries for every active patient with a nursing group.
+        Thresholds, reading counts and recent entries are each looked up for
+        all patients in one query.  Returns the number of entries added of
+        each type."""
+        current_time = now()
+        patients = self.get_patients()
+        thresholds = dict(
+            (row['pk'], row)
+            for row in patients.values('pk', *THRESHOLDS))
+        if not thresholds:
+            return {}
+        counts = self.get_reading_counts(
+            patients, thresholds.values(), current_time)
+        # Patients already notified of something in the past week.
+        existing = set(NursingQueueEntry.objects.filter(
+            patient__in=patients.values('pk'),
+            datetime_added__gt=current_time - timedelta(days=7)
+        ).values_list('patient_id', 'entry_type'))
+
+        due_date = (current_time + timedelta(days=7)).date()
+        entries = []
+        for patient_id, row in thresholds.items():
+            patient_counts = counts.get(patient_id, {})
+            for entry_type, triggered in (
+                    (NursingQueueEntry.ENTRY_TYPE_READINGS_TOO_HIGH,
+                     patient_counts.get('too_high', 0) >=
+                     row['too_high_limit']),
+                    (NursingQueueEntry.ENTRY_TYPE_READINGS_TOO_LOW,
+                     patient_counts.get('too_low', 0) >=
+                     row['too_low_limit']),
+                    (NursingQueueEntry.ENTRY_TYPE_NOT_ENOUGH_RECENT_READINGS,
+                     patient_counts.get('recent', 0) <
+                     row['not_enough_minimum'])):
+                if triggered and (patient_id, entry_type) not in existing:
+                    entries.append(NursingQueueEntry(
+                        patient_id=patient_id,
+                        entry_type=entry_type,
+                        datetime_added=current_time,
+                        due_date=due_date))
+        NursingQueueEntry.objects.bulk_create(entries)
+        added = {}
+        for entry in entries:
+            added[entry.entry_type] = added.get(entry.entry_type, 0) + 1
+        return added
 
-    def _populate_queue_entries_for_patient(self, patient: PatientProfile) -> None:
-        """Populate all queue entries for the given patient."""
-        nursing_group = patient.get_nursing_group()
-        if nursing_group is None:
-            return
-        print(f"Checking {patient}")
-        self._check_if_readings_too_high(patient)
-        self._check_if_readings_too_low(patient)
-        self._check_if_not_enough_readings(patient)
+    def get_patients(self):
+        """Active patients with a nursing group, annotated with their
+        effective thresholds."""
+        # Same precedence as PatientProfile.get_nursing_group.
+        nursing_group = Case(
+            When(nursing_group__isnull=False, then=F('nursing_group')),
+            When(company__isnull=False, then=F('company__nursing_group')),
+            default=F('group__nursing_group'),
+            output_field=IntegerField())
+        return PatientProfile.objects.filter(
+            account_status=PatientProfile.ACCOUNT_STATUS_ACTIVE
+        ).annotate(
+            effective_nursing_group=nursing_group
+        ).filter(
+            effective_nursing_group__isnull=False
+        ).annotate(**get_threshold_annotations())
 
-    def _check_if_readings_too_high(
-            self,
-            patient: PatientProfile
-    ) -> None:
-        # See if we have already made such a notification in the past
-        # week for the patient.
-        existing_entries = NursingQueueEntry.objects.filter(
-            patient=patient,
-            entry_type=NursingQueueEntry.ENTRY_TYPE_READINGS_TOO_HIGH,
-            datetime_added__gt=now() - timedelta(days=7)
-        )
-        # Abort if we do
-        if len(existing_entries) > 0:
-            return
-        interval = patient.get_readings_too_high_interval()
-        cutoff = now() - timedelta(days=interval)
-        too_high_threshold = patient.get_readings_too_high_threshold()
-        too_high_limit = patient.get_readings_too_high_limit()
-        readings = patient.user.glucose_readings.filter(
-            reading_datetime_utc__gt=cutoff,
-            glucose_value__gte=too_high_threshold
-        )
-        if len(readings) >= too_high_limit:
-            NursingQueueEntry.objects.create(
-                patient=patient,
-                entry_type=NursingQueueEntry.ENTRY_TYPE_READINGS_TOO_HIGH,
-                due_date=(now() + timedelta(days=7)).date()
-            )
+    def get_reading_counts(self, patients, thresholds, current_time):
+        """Counts each patient's high, low and recent readings over their
+        own intervals in one grouped query.  Returns a dict of patient
+        profile id to counts; patients without readings are left out."""
+        longest = max(
+            max(row['too_high_interval'], row['too_low_interval'],
+                row['not_enough_interval'])
+            for row in thresholds)
+        prefix = 'patient__patient_profile__'
 
-    def _check_if_readings_too_low(
-            self,
-            patient: PatientProfile
-    ) -> None:
-        # See if we have already made such a notification in the past
-        # week for the patient.
-        existing_entries = NursingQueueEntry.objects.filter(
-            patient=patient,
-            entry_type=NursingQueueEntry.ENTRY_TYPE_READINGS_TOO_LOW,
-            datetime_added__gt=now() - timedelta(days=7)
-        )
-        # Abort if we do
-        if len(existing_entries) > 0:
-            return
-        interval = patient.get_readings_too_low_interval()
-        cutoff = now() - timedelta(days=interval)
-        too_low_threshold = patient.get_readings_too_low_threshold()
-        too_low_limit = patient.get_readings_too_low_limit()
-        readings = patient.user.glucose_readings.filter(
-            reading_datetime_utc__gt=cutoff,
-            glucose_value__lte=too_low_threshold
-        )
-        if len(readings) >= too_low_limit:
-            NursingQueueEntry.objects.create(
-                patient=patient,
-                entry_type=NursingQueueEntry.ENTRY_TYPE_READINGS_TOO_LOW,
-                due_date=(now() + timedelta(days=7)).date()
-            )
+        def cutoff(interval_name):
+            return ExpressionWrapper(
+                Value(current_time, output_field=DateTimeField()) -
+                ExpressionWrapper(
+                    F(interval_name) *
+                    Value(timedelta(days=1), output_field=DurationField()),
+                    output_field=DurationField()),
+                output_field=DateTimeField())
 
-    def _check_if_not_enough_readings(
-            self,
-            patient: PatientProfile
-    ) -> None:
-        # See if we have already made such a notification in the past
-        # week for the patient.
-        existing_entries = NursingQueueEntry.objects.filter(
-            patient=patient,
-            entry_type=NursingQueueEntry.ENTRY_TYPE_NOT_ENOUGH_RECENT_READINGS,
-            datetime_added__gt=now() - timedelta(days=7)
-        )
-        # Abort if we do
-        if len(existing_entries) > 0:
-            return
-        interval = patient.get_not_enough_recent_readings_interval()
-        cutoff = now() - timedelta(days=interval)
-        limit = patient.get_not_enough_recent_readings_minimum()
-        readings = patient.user.glucose_readings.filter(reading_datetime_utc__gt=cutoff)
-        if len(readings) < limit:
-            NursingQueueEntry.objects.create(
-                patient=patient,
-                entry_type=NursingQueueEntry.ENTRY_TYPE_NOT_ENOUGH_RECENT_READINGS,
-                due_date=(now() + timedelta(days=7)).date()
-            )
+        rows = GlucoseReading.objects.filter(
+            patient__patient_profile__in=patients.values('pk'),
+            reading_datetime_utc__gt=current_time - timedelta(days=longest)
+        ).annotate(
+            **get_threshold_annotations(prefix)
+        ).values(
+            'patient__patient_profile'
+        ).annotate(
+            too_high=Count('pk', filter=Q(
+                reading_datetime_utc__gt=cutoff('too_high_interval'),
+                glucose_value__gte=F('too_high_threshold'))),
+            too_low=Count('pk', filter=Q(
+                reading_datetime_utc__gt=cutoff('too_low_interval'),
+                glucose_value__lte=F('too_low_threshold'))),
+            recent=Count('pk', filter=Q(
+                reading_datetime_utc__gt=cutoff('not_enough_interval')))
+        ).order_by()
+        return dict(
+            (row['patient__patient_profile'], row) for row in rows)
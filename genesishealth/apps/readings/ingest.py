@@ -0,0 +1,163 @@
+"""Concurrent TCP ingest for reading_spy.
+
+The serial reading_spy loop handles one device at a time and holds the
+connection open while the reading is processed.  `IngestServer` accepts many
+connections at once on an asyncio loop, acknowledges each device as soon as
+its transmission is saved as a GDriveTransmissionLogEntry, and processes the
+reading afterwards on a bounded thread pool.  With a spool, devices are
+acknowledged once the transmission is on disk and nothing touches the
+database here.
+"""
+import asyncio
+import traceback
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+
+
+def reset_broken_connection():
+    """Closes this thread's database connection if an error left it
+    unusable.  Unlike close_old_connections, healthy connections stay open
+    between readings."""
+    if connection.connection is not None and connection.errors_occurred:
+        if connection.is_usable():
+            connection.errors_occurred = False
+        else:
+            connection.close()
+
+
+class IngestServer(object):
+    def __init__(self, command, workers, max_pending, timeout):
+        """`command` is the reading_spy command, which provides the
+        create_log_entry/process_entry/forward steps and logging.
+
+        At most `max_pending` connections and unprocessed readings are in
+        flight; beyond that new connections wait (up to `timeout` seconds)
+        for a slot, which pushes back on devices instead of queueing work
+        without bound."""
+        self.command = command
+        self.timeout = timeout
+        self.max_pending = max_pending
+        # Recording is kept on its own pool so a backlog of processing never
+        # delays acknowledging devices.
+        self.record_executor = ThreadPoolExecutor(
+            max_workers=max(1, workers // 2))
+        self.process_executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = None
+
+    def run(self, sock):
+        """Serves connections on the (bound and listening) socket until
+        interrupted."""
+        try:
+            asyncio.run(self.serve(sock))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.command.log('waiting for pending readings to finish')
+            self.record_executor.shutdown(wait=True)
+            self.process_executor.shutdown(wait=True)
+
+    async def serve(self, sock):
+        self.slots = asyncio.Semaphore(self.max_pending)
+        server = await asyncio.start_server(
+            self.handle_connection, sock=sock)
+        self.command.log('accepting up to %d pending readings' % (
+            self.max_pending))
+        async with server:
+            await server.serve_forever()
+
+    async def read_content(self, reader):
+        """Reads until a full transmission arrives, the device closes the
+        connection or the timeout runs out, whichever comes first."""
+        loop = asyncio.get_running_loop()
+        length = settings.GDRIVE_READING_DATA_LENGTH
+        deadline = loop.time() + self.timeout
+        data = b''
+        while len(data) < length:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                chunk = await asyncio.wait_for(
+                    reader.read(length - len(data)), remaining)
+            except asyncio.TimeoutError:
+                break
+            if not chunk:
+                break
+            data += chunk
+        return data.decode('ascii')
+
+    async def send_to_client(self, writer, message):
+        self.command.log('sending to client: %s' % message)
+        writer.write(message.encode('ascii'))
+        await asyncio.wait_for(writer.drain(), self.timeout)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.command.log('server busy; dropping connection')
+            writer.close()
+            return
+        loop = asyncio.get_running_loop()
+        scheduled = False
+        try:
+            content = await self.read_content(reader)
+            if len(content) == 0:
+                return
+            if self.command.spool is not None:
+                # drain_reading_spool does the rest.
+                reply = await loop.run_in_executor(
+                    self.record_executor, self.command.spool_content,
+                    content)
+                if reply is not None:
+                    await self.send_to_client(writer, reply)
+                return
+            log_entry, transmission = await loop.run_in_executor(
+                self.record_executor, self.record, content)
+            if transmission.verified:
+                # The transmission is durably recorded, so the device can be
+                # told it was received without waiting for processing.
+                future = loop.run_in_executor(
+                    self.process_executor, self.process,
+                    log_entry, transmission)
+                future.add_done_callback(lambda f: self.slots.release())
+                scheduled = True
+                await self.send_to_client(writer, 'success')
+            else:
+                if len(content) == settings.GDRIVE_READING_DATA_LENGTH:
+                    await self.send_to_client(writer, 'fail')
+                loop.run_in_executor(
+                    self.record_executor, self.command.forward, content)
+        except (asyncio.TimeoutError, ConnectionError, UnicodeDecodeError):
+            self.command.log(
+                'connection failed: %s' % traceback.format_exc())
+        except Exception:
+            self.command.log(
+                'unexpected ingest error: %s' % traceback.format_exc())
+        finally:
+            writer.close()
+            if not scheduled:
+                self.slots.release()
+
+    def record(self, content):
+        reset_broken_connection()
+        log_entry, transmission = self.command.create_log_entry(content)
+        log_entry.save()
+        return log_entry, transmission
+
+    def process(self, log_entry, transmission):
+        reset_broken_connection()
+        try:
+            self.command.process_entry(log_entry, transmission)
+            # The device was acknowledged before processing, whatever the
+            # outcome.
+            log_entry.success_sent_to_client = True
+            log_entry.save()
+        except Exception:
+            self.command.log(
+                'failed to save processed reading: %s' %
+                traceback.format_exc())
+        self.command.forward(transmission.content)
@@ -0,0 +1,65 @@
+"""Fills in GlucoseReading.fingerprint for readings saved before it existed.
+
+Duplicate detection only sees readings with a fingerprint, so this should be
+run after migrating.  It is safe to run while readings are coming in and to
+restart; readings are handled in primary key order, so where historical
+duplicates share a fingerprint the first one saved keeps it."""
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, transaction
+
+from genesishealth.apps.readings.models import GlucoseReading
+
+
+class Command(BaseCommand):
+    help = 'Populates fingerprints for existing glucose readings.'
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        last_pk = 0
+        updated = skipped = 0
+        while True:
+            chunk = list(GlucoseReading.objects.filter(
+                pk__gt=last_pk, fingerprint__isnull=True
+            ).order_by('pk').only('pk', 'raw_data')[:options['chunk_size']])
+            if not chunk:
+                break
+            last_pk = chunk[-1].pk
+            readings = {}
+            for reading in chunk:
+                fingerprint = GlucoseReading.get_fingerprint_from_raw_data(
+                    reading.raw_data)
+                if fingerprint is None or fingerprint in readings:
+                    skipped += 1
+                    continue
+                reading.fingerprint = fingerprint
+                readings[fingerprint] = reading
+            existing = set(GlucoseReading.objects.filter(
+                fingerprint__in=readings).values_list(
+                'fingerprint', flat=True))
+            to_update = [reading for fingerprint, reading in readings.items()
+                         if fingerprint not in existing]
+            skipped += len(readings) - len(to_update)
+            try:
+                with transaction.atomic():
+                    GlucoseReading.objects.bulk_update(
+                        to_update, ['fingerprint'])
+                updated += len(to_update)
+            except IntegrityError:
+                # A new reading took one of these fingerprints in the
+                # meantime.
+                for reading in to_update:
+                    try:
+                        with transaction.atomic():
+                            GlucoseReading.objects.filter(
+                                pk=reading.pk).update(
+                                fingerprint=reading.fingerprint)
+                        updated += 1
+                    except IntegrityError:
+                        skipped += 1
+            self.stdout.write(
+                'Up to reading %d: %d fingerprinted, %d skipped.' % (
+                    last_pk, updated, skipped))
+        self.stdout.write('Done: %d fingerprinted, %d skipped.' % (
+            updated, skipped))
@@ -0,0 +1,131 @@
+"""Processes transmissions spooled by reading_spy --spool into the database.
+
+Each batch of readings is saved with GlucoseReading.process_readings_batch,
+and progress is checkpointed once the batch's log entries are saved.  Log
+entries record the spool position they were read from, so after a crash the
+transmissions of the replayed batch that were already logged are skipped
+rather than logged and forwarded again.  A transmission that fails is parked
+in the spool's dead letter file, and the drain moves on."""
+import socket
+import time
+import traceback
+
+from datetime import datetime
+
+import pytz
+from django.conf import settings
+
+from genesishealth.apps.gdrives.models import GDriveTransmissionLogEntry
+from genesishealth.apps.readings.models import GlucoseReading
+from genesishealth.apps.readings.management.commands.reading_spy import (
+    Command as ReadingSpyCommand)
+from genesishealth.apps.readings.spool import ReadingSpool
+from genesishealth.apps.utils.func import utcnow
+
+
+def get_spool_position(record):
+    return '%d:%d' % record.position
+
+
+class Command(ReadingSpyCommand):
+    help = 'Processes transmissions written to the spool by reading_spy.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int,
+            default=settings.GDRIVE_SPOOL_DRAIN_BATCH_SIZE)
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Seconds to wait when the spool is empty.')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once the spool is drained.')
+
+    def handle(self, *args, **options):
+        self.server_name = socket.gethostname()
+        self.spool = ReadingSpool(settings.GDRIVE_SPOOL_DIRECTORY)
+        position = self.spool.get_checkpoint()
+        self.log('draining %s from %s' % (
+            settings.GDRIVE_SPOOL_DIRECTORY, position))
+        while True:
+            records = self.spool.read(position, options['batch_size'])
+            if not records:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+            start = time.perf_counter()
+            self.drain_records(records)
+            position = records[-1].next_position
+            self.log(
+                'drained %d transmissions in %.3fs; checkpoint %s; '
+                'oldest was received %.1fs ago' % (
+                    len(records), time.perf_counter() - start, position,
+                    time.time() - records[0].received))
+
+    def drain_records(self, records):
+        logged = set(GDriveTransmissionLogEntry.objects.filter(
+            reading_server=self.server_name,
+            spool_position__in=[get_spool_position(r) for r in records]
+        ).values_list('spool_position', flat=True))
+        entries = {}
+        for record in records:
+            if get_spool_position(record) in logged:
+                continue
+            try:
+                log_entry, transmission = self.create_log_entry(
+                    record.content)
+            except Exception:
+                self.park(record)
+                continue
+            log_entry.spool_position = get_spool_position(record)
+            entries[record.position] = (log_entry, transmission)
+        verified = [(record,) + entries[record.position]
+                    for record in records
+                    if record.position in entries and
+                    entries[record.position][1].verified]
+        try:
+            batch_results = GlucoseReading.process_readings_batch(
+                [transmission for _, _, transmission in verified],
+                self.server_name)
+        except Exception:
+            self.log('batch failed, processing readings one at a time: %s' %
+                     traceback.format_exc())
+            batch_results = [None] * len(verified)
+        for (record, log_entry, transmission), results in zip(
+                verified, batch_results):
+            try:
+                if results is None:
+                    self.process_entry(log_entry, transmission)
+                else:
+                    self.apply_results(log_entry, results)
+            except Exception:
+                self.park(record)
+                del entries[record.position]
+                continue
+            # reading_spy acknowledged it once it was spooled.
+            log_entry.success_sent_to_client = True
+        for record in records:
+            if record.position in entries:
+                log_entry, _ = entries[record.position]
+                try:
+                    self.save_log_entry(record, log_entry)
+                except Exception:
+                    self.park(record)
+        self.spool.set_checkpoint(records[-1].next_position)
+
+    def park(self, record):
+        error = traceback.format_exc()
+        self.log('parking transmission at %s: %s' % (record.position, error))
+        self.spool.park(record, error)
+
+    def save_log_entry(self, record, log_entry):
+        log_entry.save()
+        # Record when the transmission arrived rather than when it was
+        # drained.
+        received = pytz.utc.localize(
+            datetime.utcfromtimestamp(record.received))
+        if (utcnow() - received).total_seconds() > 1:
+            GDriveTransmissionLogEntry.objects.filter(
+                pk=log_entry.pk).update(datetime=received)
+        self.forward(record.content)
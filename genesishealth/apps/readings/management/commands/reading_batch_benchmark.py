@@ -0,0 +1,84 @@
+"""Compares saving readings one at a time with process_readings_batch.
+
+Both runs happen inside transactions that are rolled back, and Celery tasks
+run eagerly so post processing is included in the timings."""
+import time
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from genesishealth import celery_app
+from genesishealth.apps.gdrives.models import GDrive
+from genesishealth.apps.readings.models import GlucoseReading
+from genesishealth.apps.utils.func import utcnow
+from genesishealth.external.middleman.parse import Transmission
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks single and batched reading processing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000)
+        parser.add_argument(
+            '--batch-size', type=int,
+            default=settings.GDRIVE_SPOOL_DRAIN_BATCH_SIZE)
+        parser.add_argument(
+            '--meid', action='append', dest='meids',
+            help='Device to generate readings for.  Defaults to all '
+                 'scalability devices.')
+
+    def handle(self, *args, **options):
+        if options['meids']:
+            devices = list(GDrive.objects.filter(meid__in=options['meids']))
+        else:
+            devices = list(GDrive.objects.filter(is_scalability_device=True))
+        if not devices:
+            raise CommandError('No devices to generate readings for.')
+        start = utcnow()
+        transmissions = []
+        for i in range(options['count']):
+            raw_reading, _ = GlucoseReading.generate_raw_reading_for_device(
+                devices[i % len(devices)],
+                reading_datetime=start - timedelta(seconds=i))
+            transmissions.append(Transmission.decrypt(
+                raw_reading.decode('ascii'), settings.GDRIVE_DECRYPTION_KEY))
+        self.stdout.write('Generated %d readings for %d devices.' % (
+            len(transmissions), len(devices)))
+
+        def single():
+            return [GlucoseReading.process_reading(t, log_results=True)
+                    for t in transmissions]
+
+        def batched():
+            results = []
+            size = options['batch_size']
+            for i in range(0, len(transmissions), size):
+                results.extend(GlucoseReading.process_readings_batch(
+                    transmissions[i:i + size]))
+            return results
+
+        always_eager = celery_app.conf.task_always_eager
+        celery_app.conf.task_always_eager = True
+        try:
+            self.run('one at a time', single)
+            self.run('batches of %d' % options['batch_size'], batched)
+        finally:
+            celery_app.conf.task_always_eager = always_eager
+
+    def run(self, name, func):
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                results = func()
+                elapsed = time.perf_counter() - start
+            transaction.set_rollback(True)
+        saved = sum(1 for r in results if r is not None and r[0])
+        self.stdout.write(
+            '%s: saved %d of %d readings in %.2fs (%.1f readings/second, '
+            '%d queries)' % (
+                name, saved, len(results), elapsed, len(results) / elapsed,
+                len(queries)))
@@ -0,0 +1,94 @@
+"""Replays synthetic readings against a reading server to measure ingest
+throughput and device-visible latency."""
+import asyncio
+import time
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from genesishealth.apps.gdrives.models import GDrive
+from genesishealth.apps.readings.models import GlucoseReading
+from genesishealth.apps.utils.func import utcnow
+
+
+class Command(BaseCommand):
+    help = 'Sends synthetic readings to a reading server concurrently.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='localhost')
+        parser.add_argument(
+            '--port', type=int, default=settings.GDRIVE_READING_PORT)
+        parser.add_argument('--count', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument(
+            '--meid', action='append', dest='meids',
+            help='Device to send readings for.  Defaults to all scalability '
+                 'devices.')
+        parser.add_argument('--timeout', type=float, default=40)
+
+    def handle(self, *args, **options):
+        if options['meids']:
+            devices = list(GDrive.objects.filter(meid__in=options['meids']))
+        else:
+            devices = list(GDrive.objects.filter(is_scalability_device=True))
+        if not devices:
+            raise CommandError('No devices to send readings for.')
+        start = utcnow()
+        readings = []
+        for i in range(options['count']):
+            # Distinct timestamps so no reading is rejected as a duplicate.
+            raw_reading, _ = GlucoseReading.generate_raw_reading_for_device(
+                devices[i % len(devices)],
+                reading_datetime=start - timedelta(seconds=i))
+            readings.append(raw_reading)
+        self.stdout.write('Generated %d readings for %d devices.' % (
+            len(readings), len(devices)))
+        results, elapsed = asyncio.run(self.send_all(readings, options))
+        self.report(results, elapsed)
+
+    async def send_all(self, readings, options):
+        semaphore = asyncio.Semaphore(options['concurrency'])
+
+        async def send(reading):
+            async with semaphore:
+                return await self.send_reading(reading, options)
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*map(send, readings))
+        return results, time.perf_counter() - start
+
+    async def send_reading(self, reading, options):
+        """Returns (response, seconds until the response arrived)."""
+        start = time.perf_counter()
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(options['host'], options['port']),
+                options['timeout'])
+            writer.write(reading)
+            await writer.drain()
+            response = await asyncio.wait_for(
+                reader.read(7), options['timeout'])
+            writer.close()
+        except (OSError, asyncio.TimeoutError) as e:
+            response = e.__class__.__name__.encode('ascii')
+        return response.decode('ascii'), time.perf_counter() - start
+
+    def report(self, results, elapsed):
+        latencies = sorted(latency for _, latency in results)
+        outcomes = {}
+        for response, _ in results:
+            outcomes[response] = outcomes.get(response, 0) + 1
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1,
+                                 int(len(latencies) * p))]
+
+        self.stdout.write('Sent %d readings in %.2fs (%.1f readings/second)' % (
+            len(results), elapsed, len(results) / elapsed))
+        for response, count in sorted(outcomes.items()):
+            self.stdout.write('  %s: %d' % (response or '(no response)', count))
+        self.stdout.write(
+            'Latency p50 %.3fs, p95 %.3fs, max %.3fs' % (
+                percentile(0.5), percentile(0.95), latencies[-1]))
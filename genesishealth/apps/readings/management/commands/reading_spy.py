@@ -9,9 +9,12 @@ from django.core.management.base import BaseCommand
 from django.conf import settings
 from django.utils.timezone import now
 
-from genesishealth.external.middleman.parse import verified
+from genesishealth.external.middleman.parse import Transmission
 from genesishealth.apps.gdrives.models import GDriveTransmissionLogEntry
+from genesishealth.apps.readings.ingest import IngestServer
 from genesishealth.apps.readings.models import GlucoseReading
+from genesishealth.apps.readings.resolution import resolution_cache
+from genesishealth.apps.readings.spool import ReadingSpool
 from genesishealth.apps.readings.tasks import forward_reading
 
 
@@ -19,6 +22,24 @@ class Command(BaseCommand):
     args = ''
     help = 'Processes readings coming in over stdin and sends them to 0MQ'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrent', action='store_true',
+            help='Handle many device connections at once, acknowledging '
+                 'each reading as soon as it is recorded.')
+        parser.add_argument(
+            '--workers', type=int, default=settings.GDRIVE_INGEST_WORKERS,
+            help='Number of threads processing readings in concurrent mode.')
+        parser.add_argument(
+            '--max-pending', type=int,
+            default=settings.GDRIVE_INGEST_MAX_PENDING,
+            help='Number of connections/readings that may be in flight '
+                 'before new connections have to wait.')
+        parser.add_argument(
+            '--spool', action='store_true',
+            help='Write transmissions to the spool and acknowledge them once '
+                 'they are on disk.  drain_reading_spool processes them.')
+
     def log(self, message):
         try:
             encoded_message = str(message)
@@ -53,112 +74,174 @@ class Command(BaseCommand):
                 break
 
         self.serv.listen(settings.GDRIVE_TCP_SIMULTANEOUS_CONNECTIONS)
-        self.loop()
+        if kwargs['spool']:
+            self.spool = ReadingSpool(settings.GDRIVE_SPOOL_DIRECTORY)
+        else:
+            self.spool = None
+        if kwargs['concurrent']:
+            server = IngestServer(
+                self, workers=kwargs['workers'],
+                max_pending=kwargs['max_pending'],
+                timeout=settings.GDRIVE_READING_TIMEOUT)
+            server.run(self.serv)
+        else:
+            self.loop()
 
     def send_to_client(self, connection, message):
         self.log('sending to client: %s' % message)
         connection.send(message.encode('ascii'))
 
+    def create_log_entry(self, content):
+        """Decrypts the content and builds an (unsaved) log entry for it.
+        Returns the entry and the transmission."""
+        self.log("**************BEGINNING OF READING**************")
+        self.log('received content: %s' % content)
+        self.log('remote: read %d bytes\n' % len(content))
+        if len(content) == settings.GDRIVE_READING_DATA_LENGTH:
+            # Decrypt once; the result is shared by verification,
+            # processing and the log entry.
+            transmission = Transmission.decrypt(
+                content, settings.GDRIVE_DECRYPTION_KEY)
+        else:
+            transmission = Transmission(content)
+        # Log it.
+        log_entry = GDriveTransmissionLogEntry.for_transmission(
+            transmission, reading_server=self.server_name,
+            success_sent_to_client=False, processing_succeeded=False)
+        if len(content) == settings.GDRIVE_READING_DATA_LENGTH:
+            self.log(
+                'remote: pid: %d, buffer size: %d, content: %s...' %
+                    (os.getpid(), len(content), content[:75]))
+            if transmission.verified:
+                self.log('reading verified, processing...')
+            else:
+                msg = ('local: decryption or checksum failure; '
+                       'sending failure to client')
+                self.log(msg)
+                log_entry.error = msg
+                log_entry.resolution = \
+                    GDriveTransmissionLogEntry.RESOLUTION_INVALID
+        else:
+            log_entry.resolution = \
+                GDriveTransmissionLogEntry.RESOLUTION_INVALID
+        return log_entry, transmission
+
+    def process_entry(self, log_entry, transmission):
+        """Processes a verified transmission, recording the outcome on the
+        (unsaved) log entry.  Returns the message for the client."""
+        try:
+            results = GlucoseReading.process_reading(
+                transmission, self.server_name)
+        except Exception:
+            tb = traceback.format_exc()
+            log_entry.error = tb
+            log_entry.resolution = \
+                GDriveTransmissionLogEntry\
+                .RESOLUTION_PROCESSING_FAILED
+            self.log(
+                'invalid reading or other error; sending '
+                'failures: %s' % tb)
+            return 'fail'
+        self.apply_results(log_entry, results)
+        return 'success'
+
+    def apply_results(self, log_entry, results):
+        """Records the outcome of GlucoseReading.process_reading on the
+        (unsaved) log entry."""
+        success, decrypted_data, error_message,\
+            reading, patient = results
+        self.log(
+            'local: reading successfully parsed and saved.'
+        )
+        log_entry.processing_succeeded = success
+        log_entry.success_sent_to_client = True
+        log_entry.error = error_message
+        log_entry.meid = decrypted_data.get('meid')
+        log_entry.reading = reading
+        if patient:
+            log_entry.associated_patient_profile = \
+                patient.patient_profile
+        if success:
+            log_entry.resolution = \
+                GDriveTransmissionLogEntry.RESOLUTION_VALID
+        else:
+            error_messages = {
+                'Duplicate reading.':
+                    GDriveTransmissionLogEntry
+                    .RESOLUTION_DUPLICATE,
+                'Invalid device.':
+                    GDriveTransmissionLogEntry
+                    .RESOLUTION_UNKNOWN_DEVICE,
+                'Invalid measure type.':
+                    GDriveTransmissionLogEntry
+                    .RESOLUTION_INVALID_MEASURE,
+                'Device not associated with patient.':
+                    GDriveTransmissionLogEntry
+                    .RESOLUTION_NO_PATIENT
+            }
+            # Strip off message from error message.
+            clean_error_message = re.sub(
+                "Reading processing failed with error: ",
+                "",
+                error_message)
+            # Append the right text.
+            log_entry.resolution = error_messages.get(
+                clean_error_message,
+                GDriveTransmissionLogEntry
+                .RESOLUTION_UNRESOLVED)
+        self.log('Message: %s' % error_message)
+        self.log('Resolved as: %s' % log_entry.resolution)
+        self.log('decrypted data: %s' % decrypted_data)
+        self.log('resolution cache: %s' % resolution_cache.format_stats())
+
+    def spool_content(self, content):
+        """Verifies the transmission and writes it to the spool.  Returns
+        the message for the client, if any."""
+        self.log('received content: %s' % content)
+        if len(content) == settings.GDRIVE_READING_DATA_LENGTH:
+            transmission = Transmission.decrypt(
+                content, settings.GDRIVE_DECRYPTION_KEY)
+        else:
+            transmission = Transmission(content)
+        # Invalid transmissions are spooled too, so they get logged.
+        position = self.spool.append(content)
+        self.log('spooled %d bytes at %s' % (len(content), position))
+        if transmission.verified:
+            return 'success'
+        if len(content) == settings.GDRIVE_READING_DATA_LENGTH:
+            return 'fail'
+
+    def forward(self, content):
+        self.log('Forwarding reading')
+        try:
+            forward_reading.delay(content)
+        except socket.error:
+            self.log(
+                "Could not connect to MQ server to forward reading.")
+        else:
+            self.log("Successfully sent task to forward reading.")
+        self.log("**************END OF READING**************\n\n\n")
+
     def loop(self):
         while True:
             # Check for new connections.
             conn, addr = self.serv.accept()
             content = conn.recv(settings.GDRIVE_READING_DATA_LENGTH).decode('ascii')
+            if len(content) > 0 and self.spool is not None:
+                reply = self.spool_content(content)
+                if reply is not None:
+                    self.send_to_client(conn, reply)
+                conn.close()
+                continue
             if len(content) > 0:
-                self.log("**************BEGINNING OF READING**************")
-                self.log('received content: %s' % content)
-                self.log('remote: read %d bytes\n' % len(content))
-                # Log it.
-                log_entry = GDriveTransmissionLogEntry(
-                    content=content, reading_server=self.server_name,
-                    success_sent_to_client=False, processing_succeeded=False)
-                if len(content) == settings.GDRIVE_READING_DATA_LENGTH:
-                    self.log(
-                        'remote: pid: %d, buffer size: %d, content: %s...' %
-                            (os.getpid(), len(content), content[:75]))
-                    if verified(content, settings.GDRIVE_DECRYPTION_KEY):
-                        self.log('reading verified, processing...')
-                        try:
-                            results = GlucoseReading.process_reading(
-                                content, self.server_name)
-                            success, decrypted_data, error_message,\
-                                reading, patient = results
-                        except Exception:
-                            tb = traceback.format_exc()
-                            log_entry.error = tb
-                            log_entry.resolution = \
-                                GDriveTransmissionLogEntry\
-                                .RESOLUTION_PROCESSING_FAILED
-                            self.log(
-                                'invalid reading or other error; sending '
-                                'failures: %s' % tb)
-                            self.send_to_client(conn, 'fail')
-                        else:
-                            self.log(
-                                'local: reading successfully parsed and saved.'
-                            )
-                            log_entry.processing_succeeded = success
-                            log_entry.decrypted_content = decrypted_data
-                            log_entry.success_sent_to_client = True
-                            log_entry.error = error_message
-                            log_entry.meid = decrypted_data.get('meid')
-                            log_entry.reading = reading
-                            if patient:
-                                log_entry.associated_patient_profile = \
-                                    patient.patient_profile
-                            if success:
-                                log_entry.resolution = \
-                                    GDriveTransmissionLogEntry.RESOLUTION_VALID
-                            else:
-                                error_messages = {
-                                    'Duplicate reading.':
-                                        GDriveTransmissionLogEntry
-                                        .RESOLUTION_DUPLICATE,
-                                    'Invalid device.':
-                                        GDriveTransmissionLogEntry
-                                        .RESOLUTION_UNKNOWN_DEVICE,
-                                    'Invalid measure type.':
-                                        GDriveTransmissionLogEntry
-                                        .RESOLUTION_INVALID_MEASURE,
-                                    'Device not associated with patient.':
-                                        GDriveTransmissionLogEntry
-                                        .RESOLUTION_NO_PATIENT
-                                }
-                                # Strip off message from error message.
-                                clean_error_message = re.sub(
-                                    "Reading processing failed with error: ",
-                                    "",
-                                    error_message)
-                                # Append the right text.
-                                log_entry.resolution = error_messages.get(
-                                    clean_error_message,
-                                    GDriveTransmissionLogEntry
-                                    .RESOLUTION_UNRESOLVED)
-                            self.log('Message: %s' % error_message)
-                            self.log('Resolved as: %s' % log_entry.resolution)
-                            self.log('decrypted data: %s' % decrypted_data)
-                            self.send_to_client(conn, 'success')
-                    else:
-                        msg = ('local: decryption or checksum failure; '
-                               'sending failure to client')
-                        self.log(msg)
-                        log_entry.error = msg
-                        log_entry.resolution = \
-                            GDriveTransmissionLogEntry.RESOLUTION_INVALID
-                        self.send_to_client(conn, 'fail')
-                else:
-                    log_entry.resolution = \
-                        GDriveTransmissionLogEntry.RESOLUTION_INVALID
+                log_entry, transmission = self.create_log_entry(content)
+                if transmission.verified:
+                    self.send_to_client(
+                        conn, self.process_entry(log_entry, transmission))
+                elif len(content) == settings.GDRIVE_READING_DATA_LENGTH:
+                    self.send_to_client(conn, 'fail')
                 log_entry.save()
             conn.close()
             if len(content) > 0:
-                self.log('Forwarding reading')
-                try:
-                    forward_reading.delay(content)
-                except socket.error:
-                    self.log(
-                        "Could not connect to MQ server to forward reading.")
-                else:
-                    self.log("Successfully sent task to forward reading.")
-                self.log("**************END OF READING**************\n\n\n")
+                self.forward(content)
             time.sleep(0.05)
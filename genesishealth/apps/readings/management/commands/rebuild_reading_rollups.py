@@ -0,0 +1,45 @@
+"""Checks DailyReadingRollup against the readings and rebuilds the rollups of
+patients that don't match, e.g. after readings were edited or deleted."""
+from django.core.management.base import BaseCommand
+
+from genesishealth.apps.readings.models import (
+    DailyReadingRollup, GlucoseReading)
+
+
+class Command(BaseCommand):
+    help = 'Checks daily reading rollups and rebuilds any that are wrong.'
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument('--dry-run', dest='dry-run', action='store_true')
+        parser.add_argument(
+            '--patient', type=int, action='append', dest='patient_ids',
+            help='Only check this patient.  Defaults to all patients.')
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        patient_ids = options['patient_ids']
+        if not patient_ids:
+            patient_ids = set(GlucoseReading.objects.filter(
+                patient__isnull=False).values_list(
+                'patient_id', flat=True).distinct())
+            patient_ids.update(DailyReadingRollup.objects.values_list(
+                'patient_id', flat=True).distinct())
+            patient_ids = sorted(patient_ids)
+        chunk_size = options['chunk_size']
+        mismatched = set()
+        for start in range(0, len(patient_ids), chunk_size):
+            chunk = patient_ids[start:start + chunk_size]
+            for patient_id, day, measure_type in \
+                    DailyReadingRollup.find_mismatches(chunk):
+                self.stdout.write('Patient %s, %s, %s does not match.' % (
+                    patient_id, day, measure_type))
+                mismatched.add(patient_id)
+        self.stdout.write('Checked %d patients; %d have mismatched rollups.' % (
+            len(patient_ids), len(mismatched)))
+        if mismatched and not options['dry-run']:
+            mismatched = sorted(mismatched)
+            for start in range(0, len(mismatched), chunk_size):
+                DailyReadingRollup.rebuild(
+                    mismatched[start:start + chunk_size])
+            self.stdout.write('Rebuilt rollups for %d patients.' % (
+                len(mismatched)))
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('readings', '0005_auto_20200601_0444'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='glucosereading',
+            name='fingerprint',
+            field=models.CharField(editable=False, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('readings', '0006_glucosereading_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyReadingRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('measure_type', models.CharField(choices=[('normal', 'Normal'), ('before_meal', 'Before meal'), ('after_meal', 'After meal'), ('test_mode', 'TEST mode')], max_length=100)),
+                ('count', models.PositiveIntegerField()),
+                ('total', models.BigIntegerField()),
+                ('minimum', models.IntegerField()),
+                ('maximum', models.IntegerField()),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_reading_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('patient', 'day', 'measure_type')},
+            },
+        ),
+        migrations.RunSQL(
+            """
+            INSERT INTO readings_dailyreadingrollup
+                (patient_id, day, measure_type, count, total, minimum,
+                 maximum)
+            SELECT
+                patient_id,
+                (reading_datetime_utc AT TIME ZONE 'UTC')::date,
+                measure_type,
+                COUNT(*),
+                SUM(glucose_value),
+                MIN(glucose_value),
+                MAX(glucose_value)
+            FROM readings_glucosereading
+            WHERE patient_id IS NOT NULL
+            GROUP BY 1, 2, 3
+            """,
+            migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,44 @@
+from django.db import migrations, models
+
+# Django 3.0's AddIndexConcurrently only builds plain indexes, so the unique
+# index is built concurrently by hand and then attached as the constraint,
+# which only takes a brief lock on readings_glucosereading.
+CREATE_INDEX_SQL = """
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS
+    readings_glucosereading_fingerprint_uniq
+    ON readings_glucosereading (fingerprint)
+"""
+ADD_CONSTRAINT_SQL = """
+ALTER TABLE readings_glucosereading
+    ADD CONSTRAINT readings_glucosereading_fingerprint_uniq
+    UNIQUE USING INDEX readings_glucosereading_fingerprint_uniq
+"""
+DROP_CONSTRAINT_SQL = """
+ALTER TABLE readings_glucosereading
+    DROP CONSTRAINT IF EXISTS readings_glucosereading_fingerprint_uniq
+"""
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('readings', '0007_dailyreadingrollup'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    CREATE_INDEX_SQL, migrations.RunSQL.noop),
+                migrations.RunSQL(ADD_CONSTRAINT_SQL, DROP_CONSTRAINT_SQL),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='glucosereading',
+                    name='fingerprint',
+                    field=models.CharField(editable=False, max_length=64, null=True, unique=True),
+                ),
+            ],
+        ),
+    ]
@@ -1,20 +1,25 @@
+import hashlib
 import json
 import logging
 import random
 import socket
 
-from datetime import datetime, timedelta
+from ast import literal_eval
+from datetime import datetime, time, timedelta
 
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Q
 from django.template.loader import render_to_string
-from django.utils.timezone import get_default_timezone, now
+from django.utils.timezone import (
+    get_default_timezone, is_naive, make_aware, now)
 
 from genesishealth.apps.alerts.models import PatientAlert
 from genesishealth.apps.gdrives.models import GDrive, GDriveLogEntry
-from genesishealth.apps.monitoring.models import ReadingServer
-from genesishealth.apps.readings.tasks import post_processing
+from genesishealth.apps.readings.resolution import resolution_cache
+from genesishealth.apps.readings.tasks import (
+    post_processing, post_processing_batch)
 from genesishealth.apps.utils.encrypt import encrypt
 from genesishealth.apps.utils.func import utcnow
 from genesishealth.external.middleman import parse
@@ -84,6 +89,13 @@ class GlucoseReading(ModelWithNotes):
         User, models.SET_NULL, related_name="+", null=True)
     raw_data = models.TextField()
     offset_adjusted = models.BooleanField(default=False)
+    # Identifies the device reading, so duplicates can be found by index.
+    fingerprint = models.CharField(
+        max_length=64, null=True, unique=True, editable=False)
+
+    FINGERPRINT_FIELDS = (
+        'meid', 'year', 'month', 'day', 'hour', 'minute', 'second', 'value1',
+        'value4')
 
     @classmethod
     def adjust_faulty_offset_datetime(cls, dt, timezone):
@@ -283,45 +295,38 @@ class GlucoseReading(ModelWithNotes):
             pass
 
     @classmethod
-    def process_reading(cls, data, server_name=None, log_results=True):
-        """Parses a decrypted reading and saves a reading.
-        Returns a three-tuple: (success(True/False), decrypted data, error
-        (if applicable)."""
-        def log(status, **kwargs):
-            if log_results:
-                try:
-                    reading_server = ReadingServer.objects.get(
-                        log_alias=server_name)
-                except ReadingServer.DoesNotExist:
-                    reading_server = None
-                kwargs.setdefault('reading_server', reading_server)
-                GDriveLogEntry.objects.create(status=status, **kwargs)
-
-        def justplain(d):
-            d2 = dict()
-            for k, v in d.items():
-                d2[k.lower()] = v['plain']
-            return d2
+    def get_fingerprint(cls, clean):
+        """Takes the decrypted fields of a transmission and returns a digest
+        of the device, time, value and measure type it reports."""
+        parts = [str(clean.get(field, '')).strip().lower()
+                 for field in cls.FINGERPRINT_FIELDS]
+        return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
 
-        def parse_date_time(year, month, day, hour=0, minute=0, second=0):
-            return datetime(
-                int(year), int(month), int(day),
-                int(hour), int(minute), int(second))
+    @classmethod
+    def get_fingerprint_from_raw_data(cls, raw_data):
+        """Returns the fingerprint for a saved reading's raw data, or None
+        if it didn't come from a device."""
+        try:
+            clean = literal_eval(raw_data)
+        except (ValueError, SyntaxError):
+            return None
+        if not isinstance(clean, dict):
+            return None
+        return cls.get_fingerprint(clean)
 
-        # Decrypt data.
+    @classmethod
+    def parse_reading_data(cls, clean):
+        """Takes the decrypted fields of a transmission and returns the
+        reading's raw data along with a dict of its values."""
         reading_data = {}
-        decrypted = parse.parse_and_decrypt(
-            data, settings.GDRIVE_DECRYPTION_KEY)
-        # Update decrypted data to plain text.
-        clean = justplain(decrypted)
         # Pull out data.
         raw_data = str(clean)
         # Hour and timezone are separated
         hour, offset = map(int, clean['hour'].split(','))
         # Calculate local time of reading
-        reading_datetime = parse_date_time(
-            clean['year'], clean['month'], clean['day'],
-            hour, clean['minute'], clean['second'])
+        reading_datetime = datetime(
+            int(clean['year']), int(clean['month']), int(clean['day']),
+            hour, int(clean['minute']), int(clean['second']))
 
         # Unapply offset to get utc time
         reading_data['reading_datetime_utc'] = pytz.utc.normalize(
@@ -335,6 +340,33 @@ class GlucoseReading(ModelWithNotes):
         # Determine measure type
         reading_data['measure_type'] = cls.parse_measure_type(
             int(clean['value4']))
+        reading_data['fingerprint'] = cls.get_fingerprint(clean)
+        return raw_data, reading_data
+
+    @classmethod
+    def process_reading(cls, data, server_name=None, log_results=True):
+        """Parses a reading and saves it.  `data` is either the raw
+        transmission content or an already decrypted
+        `parse.Transmission`.
+        Returns a five-tuple: (success(True/False), decrypted data, error
+        (if applicable), reading, patient)."""
+        def log(status, **kwargs):
+            if log_results:
+                kwargs.setdefault(
+                    'reading_server',
+                    resolution_cache.get_reading_server(server_name))
+                GDriveLogEntry.objects.create(status=status, **kwargs)
+
+        # Decrypt data, unless the caller already has.
+        if isinstance(data, parse.Transmission):
+            transmission = data
+        else:
+            transmission = parse.Transmission.decrypt(
+                data, settings.GDRIVE_DECRYPTION_KEY)
+        if not transmission.verified:
+            raise ValueError('Reading failed decryption or checksum.')
+        clean = transmission.fields
+        raw_data, reading_data = cls.parse_reading_data(clean)
 
         # Get patient and device
         meid = clean.get('meid')
@@ -343,10 +375,7 @@ class GlucoseReading(ModelWithNotes):
             'device': None,
         })
         if meid:
-            try:
-                reading_data['device'] = GDrive.objects.get(meid__iexact=meid)
-            except GDrive.DoesNotExist:
-                pass
+            reading_data['device'] = resolution_cache.get_device(meid)
         if reading_data['device']:
             reading_data['patient'] = reading_data['device'].patient
 
@@ -369,8 +398,9 @@ class GlucoseReading(ModelWithNotes):
 
         try:
             # Make sure reading is unique.
-            assert GlucoseReading.objects.filter(
-                raw_data=raw_data).count() == 0, 'Duplicate reading.'
+            assert not GlucoseReading.objects.filter(
+                fingerprint=reading_data['fingerprint']
+            ).exists(), 'Duplicate reading.'
             # Validate measure_type
             assert reading_data['measure_type'] is not None, 'Invalid measure type.' # noqa
         except AssertionError as e:
@@ -395,7 +425,18 @@ class GlucoseReading(ModelWithNotes):
                 reading_data['offset_adjusted'] = True
         # Save the reading.
         try:
-            reading = GlucoseReading.objects.create(**reading_data)
+            with transaction.atomic():
+                reading = GlucoseReading.objects.create(**reading_data)
+        except IntegrityError as e:
+            if GlucoseReading.objects.filter(
+                    fingerprint=reading_data['fingerprint']).exists():
+                # Another worker saved the same reading first.
+                msg = 'Reading processing failed with error: ' \
+                    'Duplicate reading.'
+            else:
+                msg = 'Reading creation failed with error: %s' % e
+            log(msg, **log_kwargs)
+            return (False, clean, msg, None, None)
         except Exception as e:
             msg = 'Reading creation failed with error: %s' % e
             log(msg, **log_kwargs)
@@ -408,6 +449,128 @@ class GlucoseReading(ModelWithNotes):
         post_processing.delay(reading.pk)
         return (True, clean, '', reading, reading_data['device'].patient)
 
+    @classmethod
+    def process_readings_batch(cls, transmissions, server_name=None,
+                               log_results=True):
+        """Parses and saves a batch of decrypted `parse.Transmission`s in a
+        single transaction.
+
+        Devices, duplicates, alerts and the reading server are looked up
+        once for the whole batch, readings and log entries are inserted with
+        bulk_create and post processing is queued as a single task.
+
+        Returns a list aligned with `transmissions` holding the same
+        five-tuples as process_reading, or None for a transmission that
+        could not be parsed; the caller should pass those to process_reading
+        so the failure is reported the usual way.  If saving the batch fails
+        (e.g. with an IntegrityError because another worker saved one of the
+        readings first) nothing is saved and the exception propagates."""
+        results = [None] * len(transmissions)
+        parsed = []
+        for index, transmission in enumerate(transmissions):
+            if not transmission.verified:
+                continue
+            clean = transmission.fields
+            try:
+                raw_data, reading_data = cls.parse_reading_data(clean)
+            except (KeyError, ValueError, AttributeError):
+                continue
+            parsed.append((index, clean, raw_data, reading_data))
+        if not parsed:
+            return results
+
+        devices = resolution_cache.get_devices(
+            clean['meid'] for _, clean, _, _ in parsed if clean.get('meid'))
+        seen = set(GlucoseReading.objects.filter(
+            fingerprint__in=[reading_data['fingerprint']
+                             for _, _, _, reading_data in parsed]
+        ).values_list('fingerprint', flat=True))
+        if log_results:
+            reading_server = resolution_cache.get_reading_server(server_name)
+
+        log_entries = []
+        new_readings = []
+        for index, clean, raw_data, reading_data in parsed:
+            meid = clean.get('meid')
+            device = devices.get(meid.lower()) if meid else None
+            reading_data['device'] = device
+            reading_data['patient'] = device.patient if device else None
+            log_kwargs = {
+                'meid': meid,
+                'device': device,
+                'reading_datetime_utc': reading_data['reading_datetime_utc'],
+                'glucose_value': reading_data['glucose_value'],
+                'raw_data': raw_data,
+                'successful': False
+            }
+            if device is None:
+                error = 'Invalid device.'
+            elif reading_data['fingerprint'] in seen:
+                error = 'Duplicate reading.'
+            elif reading_data['measure_type'] is None:
+                error = 'Invalid measure type.'
+            else:
+                error = None
+            if error is not None:
+                msg = 'Reading processing failed with error: %s' % error
+                log_entries.append(GDriveLogEntry(status=msg, **log_kwargs))
+                results[index] = (False, clean, msg, None, None)
+                continue
+            seen.add(reading_data['fingerprint'])
+            reading_data['raw_data'] = raw_data
+            patient = reading_data['patient']
+            if patient:
+                if (reading_data['reading_datetime_offset'] == 0 and
+                        patient.patient_profile.timezone):
+                    reading_data['reading_datetime_utc'] = cls\
+                        .adjust_faulty_offset_datetime(
+                            reading_data['reading_datetime_utc'],
+                            patient.patient_profile.timezone
+                    )
+                    log_kwargs['reading_datetime_utc'] = reading_data[
+                        'reading_datetime_utc']
+                    reading_data['offset_adjusted'] = True
+                # Alerts are triggered below, once the reading is saved.
+                reading_data['alert_sent'] = True
+            reading = GlucoseReading(**reading_data)
+            new_readings.append(reading)
+            log_kwargs['successful'] = True
+            log_kwargs['reading'] = reading
+            log_entries.append(GDriveLogEntry(status='Success', **log_kwargs))
+            results[index] = (True, clean, '', reading, patient)
+
+        with transaction.atomic():
+            GlucoseReading.objects.bulk_create(new_readings)
+            if log_results:
+                for entry in log_entries:
+                    entry.reading_server = reading_server
+                    # The readings only got their keys from bulk_create;
+                    # assigning again copies them to reading_id.
+                    entry.reading = entry.reading
+                GDriveLogEntry.objects.bulk_create(log_entries)
+            patient_ids = set(
+                r.patient_id for r in new_readings if r.patient_id)
+            alerts = {}
+            for alert in PatientAlert.objects.filter(
+                    patient__in=patient_ids, active=True,
+                    type=PatientAlert.READING_RECEIVED):
+                alerts.setdefault(alert.patient_id, []).append(alert)
+            for reading in new_readings:
+                patient_alerts = alerts.get(reading.patient_id, [])
+                if reading.patient_id:
+                    alert_logger.info(
+                        'Trigger alerts: %s' % repr(patient_alerts))
+                for a in patient_alerts:
+                    # Avoid fetching the patient again for every alert.
+                    a.patient = reading.patient
+                    a.trigger(
+                        time=reading.reading_datetime.strftime(
+                            '%m/%d/%Y %I:%M %p'),
+                        value=reading.glucose_value)
+        if new_readings:
+            post_processing_batch.delay([r.pk for r in new_readings])
+        return results
+
     def __str__(self) -> str:
         from genesishealth.apps.accounts.models import PatientProfile
         try:
@@ -501,6 +664,8 @@ class GlucoseReading(ModelWithNotes):
         self.manually_changed_time = now()
         self.manually_changed_by = user
         self.save()
+        if self.patient_id:
+            DailyReadingRollup.rebuild([self.patient_id])
 
     def trigger_alerts(self):
         if self.patient:
@@ -537,3 +702,196 @@ class GlucoseReadingNote(models.Model):
     visible_to_patient = models.BooleanField(default=True, editable=False)
     entry = models.ForeignKey(
         GlucoseReading, editable=False, related_name='notes', on_delete=models.CASCADE)
+
+
+class DailyReadingRollup(models.Model):
+    """Totals of a patient's readings of one measure type on one (UTC) day.
+
+    Rows are added to as readings are post processed.  Readings changed or
+    deleted afterwards are picked up by `rebuild`; see the
+    rebuild_reading_rollups command."""
+    class Meta:
+        unique_together = ('patient', 'day', 'measure_type')
+
+    patient = models.ForeignKey(
+        User, related_name='daily_reading_rollups', on_delete=models.CASCADE)
+    day = models.DateField()
+    measure_type = models.CharField(
+        choices=GlucoseReading.MEASURE_TYPES, max_length=100)
+    count = models.PositiveIntegerField()
+    total = models.BigIntegerField()
+    minimum = models.IntegerField()
+    maximum = models.IntegerField()
+
+    AGGREGATE_SQL = """
+        SELECT
+            patient_id,
+            (reading_datetime_utc AT TIME ZONE 'UTC')::date,
+            measure_type,
+            COUNT(*),
+            SUM(glucose_value),
+            MIN(glucose_value),
+            MAX(glucose_value)
+        FROM {readings}
+        WHERE patient_id = ANY(%s)
+        GROUP BY 1, 2, 3
+    """
+
+    @classmethod
+    def add_readings(cls, readings):
+        """Adds newly saved readings to their patients' rollups."""
+        totals = {}
+        for reading in readings:
+            if reading.patient_id is None:
+                continue
+            key = (reading.patient_id,
+                   reading.reading_datetime_utc.astimezone(pytz.utc).date(),
+                   reading.measure_type)
+            value = reading.glucose_value
+            if key in totals:
+                count, total, minimum, maximum = totals[key]
+                totals[key] = (count + 1, total + value, min(minimum, value),
+                               max(maximum, value))
+            else:
+                totals[key] = (1, value, value, value)
+        if not totals:
+            return
+        params = []
+        for key, values in totals.items():
+            params.extend(key + values)
+        query = """
+            INSERT INTO {table}
+                (patient_id, day, measure_type, count, total, minimum,
+                 maximum)
+            VALUES {values}
+            ON CONFLICT (patient_id, day, measure_type) DO UPDATE SET
+                count = {table}.count + EXCLUDED.count,
+                total = {table}.total + EXCLUDED.total,
+                minimum = LEAST({table}.minimum, EXCLUDED.minimum),
+                maximum = GREATEST({table}.maximum, EXCLUDED.maximum)
+        """.format(
+            table=cls._meta.db_table,
+            values=', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(totals)))
+        with connection.cursor() as cursor:
+            cursor.execute(query, params)
+
+    @classmethod
+    def rebuild(cls, patient_ids):
+        """Recomputes the patients' rollups from their readings."""
+        patient_ids = list(patient_ids)
+        query = """
+            INSERT INTO {table}
+                (patient_id, day, measure_type, count, total, minimum,
+                 maximum)
+        """.format(table=cls._meta.db_table) + cls.AGGREGATE_SQL.format(
+            readings=GlucoseReading._meta.db_table)
+        with transaction.atomic():
+            cls.objects.filter(patient_id__in=patient_ids).delete()
+            with connection.cursor() as cursor:
+                cursor.execute(query, [patient_ids])
+
+    @classmethod
+    def find_mismatches(cls, patient_ids):
+        """Returns (patient id, day, measure type) for every rollup of the
+        patients that doesn't match their readings."""
+        query = """
+            SELECT
+                COALESCE(expected.patient_id, actual.patient_id),
+                COALESCE(expected.day, actual.day),
+                COALESCE(expected.measure_type, actual.measure_type)
+            FROM ({aggregate}) AS expected
+                (patient_id, day, measure_type, count, total, minimum,
+                 maximum)
+            FULL OUTER JOIN (
+                SELECT patient_id, day, measure_type, count, total, minimum,
+                       maximum
+                FROM {table}
+                WHERE patient_id = ANY(%s)
+            ) AS actual
+                ON expected.patient_id = actual.patient_id
+                AND expected.day = actual.day
+                AND expected.measure_type = actual.measure_type
+            WHERE expected.count IS DISTINCT FROM actual.count
+                OR expected.total IS DISTINCT FROM actual.total
+                OR expected.minimum IS DISTINCT FROM actual.minimum
+                OR expected.maximum IS DISTINCT FROM actual.maximum
+        """.format(
+            aggregate=cls.AGGREGATE_SQL.format(
+                readings=GlucoseReading._meta.db_table),
+            table=cls._meta.db_table)
+        patient_ids = list(patient_ids)
+        with connection.cursor() as cursor:
+            cursor.execute(query, [patient_ids, patient_ids])
+            return cursor.fetchall()
+
+    @classmethod
+    def summarize(cls, patient_id, start, end, measure_type=None):
+        """Summarizes a patient's readings taken from `start` up to, but not
+        including, `end`.  Whole days are read from the rollups and only the
+        partial days at either end from the readings.
+
+        Returns a dict with the count, total, minimum and maximum glucose
+        value and the set of (UTC) days with readings."""
+        start = cls._as_datetime(start)
+        end = cls._as_datetime(end)
+        full_start = cls._start_of_day(start)
+        if full_start < start:
+            full_start += timedelta(days=1)
+        full_end = cls._start_of_day(end)
+        summary = {
+            'count': 0,
+            'total': 0,
+            'minimum': None,
+            'maximum': None,
+            'days': set(),
+        }
+
+        def add(day, count, total, minimum, maximum):
+            summary['count'] += count
+            summary['total'] += total
+            if summary['minimum'] is None or minimum < summary['minimum']:
+                summary['minimum'] = minimum
+            if summary['maximum'] is None or maximum > summary['maximum']:
+                summary['maximum'] = maximum
+            summary['days'].add(day)
+
+        readings = GlucoseReading.objects.filter(patient_id=patient_id)
+        if full_start < full_end:
+            rollups = cls.objects.filter(
+                patient_id=patient_id, day__gte=full_start.date(),
+                day__lt=full_end.date())
+            if measure_type:
+                rollups = rollups.filter(measure_type=measure_type)
+            for row in rollups.values_list(
+                    'day', 'count', 'total', 'minimum', 'maximum'):
+                add(*row)
+            readings = readings.filter(
+                Q(reading_datetime_utc__gte=start,
+                  reading_datetime_utc__lt=full_start) |
+                Q(reading_datetime_utc__gte=full_end,
+                  reading_datetime_utc__lt=end))
+        else:
+            readings = readings.filter(
+                reading_datetime_utc__gte=start, reading_datetime_utc__lt=end)
+        if measure_type:
+            readings = readings.filter(measure_type=measure_type)
+        for reading_datetime, value in readings.values_list(
+                'reading_datetime_utc', 'glucose_value'):
+            add(reading_datetime.astimezone(pytz.utc).date(),
+                1, value, value, value)
+        return summary
+
+    @staticmethod
+    def _as_datetime(value):
+        """Converts a date or naive datetime the way filtering a
+        DateTimeField on it would."""
+        if not isinstance(value, datetime):
+            value = datetime.combine(value, time())
+        if is_naive(value):
+            value = make_aware(value, get_default_timezone())
+        return value
+
+    @staticmethod
+    def _start_of_day(value):
+        return value.astimezone(pytz.utc).replace(
+            hour=0, minute=0, second=0, microsecond=0)
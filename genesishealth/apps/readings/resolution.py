@@ -0,0 +1,147 @@
+"""A process-local cache of the lookups the ingest path makes for every
+reading: the device for an MEID (with its patient and patient profile, for
+the timezone) and the ReadingServer for the log alias.
+
+Entries expire after settings.GDRIVE_RESOLUTION_CACHE_TTL seconds.  Saving a
+device, patient profile or reading server invalidates the matching entries
+in the process that saved it; other processes pick the change up once the
+entry expires, so the TTL bounds how stale a lookup can be.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from genesishealth.apps.gdrives.models import GDrive
+from genesishealth.apps.monitoring.models import ReadingServer
+
+
+class ResolutionCache(object):
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # Keyed by lowercase MEID; None records an unknown device.
+        self._devices = {}
+        self._servers = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _get(self, store, key):
+        """Returns (found, value)."""
+        with self._lock:
+            entry = store.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return True, entry[1]
+            self.misses += 1
+            return False, None
+
+    def _set(self, store, key, value):
+        if self.ttl > 0:
+            with self._lock:
+                store[key] = (time.monotonic() + self.ttl, value)
+
+    def _discard(self, store, matches):
+        with self._lock:
+            for key in [key for key, (_, value) in store.items()
+                        if matches(key, value)]:
+                del store[key]
+                self.invalidations += 1
+
+    def load_devices(self, meids):
+        devices = GDrive.objects.filter(
+            meid_lower__in=meids).select_related('patient__patient_profile')
+        return dict((device.meid_lower, device) for device in devices)
+
+    def get_device(self, meid):
+        """Returns the device with the MEID (in any case), or None."""
+        return self.get_devices([meid])[meid.lower()]
+
+    def get_devices(self, meids):
+        """Returns a dict of lowercase MEID to device (or None), looking up
+        uncached devices in one query."""
+        devices = {}
+        missing = []
+        for key in set(meid.lower() for meid in meids):
+            found, device = self._get(self._devices, key)
+            if found:
+                devices[key] = device
+            else:
+                missing.append(key)
+        if missing:
+            loaded = self.load_devices(missing)
+            for key in missing:
+                devices[key] = loaded.get(key)
+                self._set(self._devices, key, devices[key])
+        return devices
+
+    def get_reading_server(self, log_alias):
+        found, server = self._get(self._servers, log_alias)
+        if not found:
+            server = ReadingServer.objects.filter(log_alias=log_alias).first()
+            self._set(self._servers, log_alias, server)
+        return server
+
+    def invalidate_device(self, device):
+        # Matching on pk as well catches a changed MEID.
+        self._discard(self._devices, lambda key, value: (
+            key == device.meid.lower() or
+            (value is not None and value.pk == device.pk)))
+
+    def invalidate_patient(self, user_id):
+        self._discard(self._devices, lambda key, value: (
+            value is not None and value.patient_id == user_id))
+
+    def invalidate_reading_server(self, server):
+        self._discard(self._servers, lambda key, value: (
+            key == server.log_alias or
+            (value is not None and value.pk == server.pk)))
+
+    def clear(self):
+        with self._lock:
+            self._devices.clear()
+            self._servers.clear()
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'invalidations': self.invalidations,
+                'devices': len(self._devices),
+                'servers': len(self._servers),
+            }
+
+    def format_stats(self):
+        stats = self.get_stats()
+        hit_rate = stats['hit_rate']
+        return '%d hits, %d misses (%s), %d invalidations, %d devices' % (
+            stats['hits'], stats['misses'],
+            'n/a' if hit_rate is None else '%.1f%%' % (hit_rate * 100),
+            stats['invalidations'], stats['devices'])
+
+
+resolution_cache = ResolutionCache(settings.GDRIVE_RESOLUTION_CACHE_TTL)
+
+
+@receiver(post_save, sender=GDrive)
+@receiver(post_delete, sender=GDrive)
+def invalidate_device(sender, instance, **kwargs):
+    resolution_cache.invalidate_device(instance)
+
+
+@receiver(post_save, sender='accounts.PatientProfile')
+@receiver(post_delete, sender='accounts.PatientProfile')
+def invalidate_patient_profile(sender, instance, **kwargs):
+    resolution_cache.invalidate_patient(instance.user_id)
+
+
+@receiver(post_save, sender=ReadingServer)
+@receiver(post_delete, sender=ReadingServer)
+def invalidate_reading_server(sender, instance, **kwargs):
+    resolution_cache.invalidate_reading_server(instance)
@@ -0,0 +1,236 @@
+"""An append-only, on-disk spool of raw transmissions.
+
+reading_spy appends each transmission to the spool and acknowledges the
+device once it is on disk; the drain_reading_spool command processes spooled
+transmissions into the database in batches.  This keeps database latency out
+of the ingest path, and a crash in either process replays from the last
+checkpoint instead of losing readings.
+
+Transmissions are written to numbered segment files.  Each record is a
+header (payload length, CRC32 of the payload, time received) followed by the
+payload.  Positions are (segment, offset) tuples, which order naturally.
+Concurrent appends share fsyncs: a writer waiting for durability syncs every
+record written so far, so under load one fsync covers many transmissions.
+"""
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+
+HEADER = struct.Struct('>IId')
+SEGMENT_SUFFIX = '.seg'
+CHECKPOINT_NAME = 'checkpoint'
+DEAD_LETTER_NAME = 'dead-letter'
+
+
+class SpoolRecord(object):
+    def __init__(self, position, next_position, content, received):
+        self.position = position
+        self.next_position = next_position
+        self.content = content
+        self.received = received
+
+
+class ReadingSpool(object):
+    def __init__(self, directory, segment_size=64 * 1024 * 1024):
+        self.directory = directory
+        self.segment_size = segment_size
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._file = None
+        self._segment = None
+        self._written = None
+        self._synced = None
+
+    # Writing
+
+    def _segment_path(self, segment):
+        return os.path.join(
+            self.directory, '%012d%s' % (segment, SEGMENT_SUFFIX))
+
+    def get_segments(self):
+        return sorted(
+            int(name[:-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX))
+
+    def _open_for_append(self):
+        segments = self.get_segments()
+        segment = segments[-1] if segments else 0
+        path = self._segment_path(segment)
+        # Drop any record torn by a crash mid-write.
+        end = self._valid_end(segment)
+        with open(path, 'ab') as f:
+            f.truncate(end)
+        self._file = open(path, 'ab')
+        self._segment = segment
+        self._written = self._synced = (segment, end)
+
+    def _rotate(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._segment += 1
+        self._file = open(self._segment_path(self._segment), 'ab')
+        self._written = (self._segment, 0)
+        self._fsync_directory()
+
+    def _fsync_directory(self):
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def append(self, content, received=None):
+        """Writes a transmission to the spool and returns once it is on
+        disk.  Returns the position it was written at."""
+        if isinstance(content, str):
+            content = content.encode('ascii')
+        if received is None:
+            received = time.time()
+        record = HEADER.pack(
+            len(content), zlib.crc32(content), received) + content
+        with self._lock:
+            if self._file is None:
+                self._open_for_append()
+            elif self._written[1] >= self.segment_size:
+                self._rotate()
+            position = self._written
+            self._file.write(record)
+            self._written = (self._segment, position[1] + len(record))
+            end = self._written
+        self._sync(end)
+        return position
+
+    def _sync(self, end):
+        with self._sync_lock:
+            if self._synced >= end:
+                # Another writer's fsync already covered this record.
+                return
+            with self._lock:
+                self._file.flush()
+                target = self._written
+                fileno = self._file.fileno()
+            os.fsync(fileno)
+            self._synced = target
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    # Reading
+
+    def _valid_end(self, segment):
+        end = (segment, 0)
+        for record in self._read_segment(segment, 0):
+            end = record.next_position
+        return end[1]
+
+    def _read_segment(self, segment, offset):
+        path = self._segment_path(segment)
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    return
+                length, crc, received = HEADER.unpack(header)
+                content = f.read(length)
+                if len(content) < length or zlib.crc32(content) != crc:
+                    # A partially written record; nothing after it is valid.
+                    return
+                next_offset = offset + HEADER.size + length
+                yield SpoolRecord(
+                    (segment, offset), (segment, next_offset),
+                    content.decode('ascii'), received)
+                offset = next_offset
+
+    def read(self, position, limit):
+        """Returns up to `limit` records starting at `position`."""
+        records = []
+        segment, offset = position
+        for current in self.get_segments():
+            if current < segment:
+                continue
+            if current > segment:
+                offset = 0
+            for record in self._read_segment(current, offset):
+                records.append(record)
+                if len(records) >= limit:
+                    return records
+        return records
+
+    # Checkpoints
+
+    def get_checkpoint(self):
+        """Returns the position up to which the spool has been processed."""
+        path = os.path.join(self.directory, CHECKPOINT_NAME)
+        try:
+            with open(path) as f:
+                segment, offset = f.read().split()
+        except FileNotFoundError:
+            segments = self.get_segments()
+            return (segments[0] if segments else 0, 0)
+        return int(segment), int(offset)
+
+    def set_checkpoint(self, position):
+        """Atomically records progress and removes segments that have been
+        fully processed."""
+        path = os.path.join(self.directory, CHECKPOINT_NAME)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write('%d %d' % position)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self._fsync_directory()
+        for segment in self.get_segments():
+            if segment < position[0]:
+                os.remove(self._segment_path(segment))
+
+    # Dead letters
+
+    def park(self, record, error):
+        """Sets aside a record that could not be processed, with the error,
+        so the drain can move past it."""
+        path = os.path.join(self.directory, DEAD_LETTER_NAME)
+        with open(path, 'a') as f:
+            f.write(json.dumps({
+                'position': record.position,
+                'received': record.received,
+                'content': record.content,
+                'error': error,
+            }) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def get_parked(self):
+        """Returns the parked records as dicts, oldest first."""
+        path = os.path.join(self.directory, DEAD_LETTER_NAME)
+        try:
+            with open(path) as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def get_backlog(self, position=None):
+        """Returns the number of bytes spooled after `position` (the
+        checkpoint by default)."""
+        if position is None:
+            position = self.get_checkpoint()
+        total = 0
+        for segment in self.get_segments():
+            if segment < position[0]:
+                continue
+            size = os.path.getsize(self._segment_path(segment))
+            total += size - (position[1] if segment == position[0] else 0)
+        return total
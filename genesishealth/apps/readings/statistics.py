@@ -0,0 +1,85 @@
+"""The reading figures shown on the patient report pages (average, spread,
+counts by measure type and by target range), computed with one aggregate
+query per set of readings instead of a query per figure."""
+from django.db.models import Avg, Count, Max, Min, Q, StdDev
+
+from genesishealth.apps.readings.models import GlucoseReading
+
+
+def get_target_buckets(targets):
+    """Buckets for a HealthInformation's (or professional's) targets."""
+    return {
+        'low': Q(glucose_value__lt=targets.premeal_glucose_goal_minimum),
+        'high': Q(glucose_value__gt=targets.postmeal_glucose_goal_maximum),
+        'hypo': Q(glucose_value__lt=targets.safe_zone_minimum),
+        'hyper': Q(glucose_value__gt=targets.safe_zone_maximum),
+        'in_range': Q(
+            glucose_value__gte=targets.premeal_glucose_goal_minimum,
+            glucose_value__lte=targets.postmeal_glucose_goal_maximum),
+    }
+
+
+def get_goal_buckets(bottom, top, targets):
+    """Buckets for a goal range, as the trend report counts them: readings
+    above the goal first, then below it, so a reading is in only one of
+    above, below and within.  Hyper and hypo readings are the above and
+    below readings outside the safe zone."""
+    above = Q(glucose_value__gt=top)
+    below = Q(glucose_value__lt=bottom, glucose_value__lte=top)
+    return {
+        'above': above,
+        'below': below,
+        'within': Q(glucose_value__gte=bottom, glucose_value__lte=top),
+        'hyper': above & Q(glucose_value__gt=targets.safe_zone_maximum),
+        'hypo': below & Q(glucose_value__lt=targets.safe_zone_minimum),
+    }
+
+
+def _get_aggregates(buckets, condition=None, prefix=''):
+    def count(query=None):
+        if condition is not None:
+            query = condition if query is None else condition & query
+        return Count('pk', filter=query)
+
+    aggregates = {
+        'count': count(),
+        'glucose_value__avg': Avg('glucose_value', filter=condition),
+        'glucose_value__max': Max('glucose_value', filter=condition),
+        'glucose_value__min': Min('glucose_value', filter=condition),
+        'glucose_value__count': Count('glucose_value', filter=condition),
+        'glucose_value__stddev': StdDev('glucose_value', filter=condition),
+        'premeal_count': count(
+            Q(measure_type=GlucoseReading.MEASURE_TYPE_BEFORE)),
+        'postmeal_count': count(
+            Q(measure_type=GlucoseReading.MEASURE_TYPE_AFTER)),
+    }
+    for name, query in buckets.items():
+        aggregates['{}_count'.format(name)] = count(query)
+    return dict(
+        (prefix + name, aggregate) for name, aggregate in aggregates.items())
+
+
+def get_reading_statistics(readings, buckets=None):
+    """Returns the count, glucose_value__avg, __max, __min, __count and
+    __stddev, premeal_count, postmeal_count and a <name>_count for each
+    bucket of a GlucoseReading queryset."""
+    return readings.aggregate(**_get_aggregates(buckets or {}))
+
+
+def get_grouped_reading_statistics(readings, groups, buckets=None):
+    """Returns get_reading_statistics for each group of readings, given as
+    a dict of key to Q, still in one query."""
+    aggregates = {}
+    prefixes = {}
+    for index, (key, condition) in enumerate(groups.items()):
+        prefixes[key] = 'group{}_'.format(index)
+        aggregates.update(_get_aggregates(
+            buckets or {}, condition, prefixes[key]))
+    if not aggregates:
+        return {}
+    values = readings.aggregate(**aggregates)
+    return dict(
+        (key, dict((name[len(prefix):], value)
+                   for name, value in values.items()
+                   if name.startswith(prefix)))
+        for key, prefix in prefixes.items())
@@ -8,43 +8,104 @@ from celery.task import periodic_task
 from celery.schedules import crontab
 
 
+def forward_to_partners(readings):
+    """Queues forward attempts for the readings' partners, and has each
+    partner's queue sent in the background.  TEST mode readings are not
+    forwarded."""
+    from genesishealth.apps.api.models import (
+        APIPartner, APIReadingForwardAttempt)
+    from genesishealth.apps.api.tasks import forward_queued_readings
+    from genesishealth.apps.readings.models import GlucoseReading
+    if settings.SKIP_FORWARD_READINGS:
+        return
+    readings = [
+        reading for reading in readings
+        if reading.patient_id and
+        reading.measure_type != GlucoseReading.MEASURE_TYPE_TEST]
+    if not readings:
+        return
+    partner_ids = {}
+    for partner_id, patient_id in APIPartner.objects.filter(
+            forward_readings=True,
+            patients__user__in=set(r.patient_id for r in readings)
+    ).values_list('pk', 'patients__user'):
+        partner_ids.setdefault(patient_id, []).append(partner_id)
+    attempts = []
+    for reading in readings:
+        for partner_id in partner_ids.get(reading.patient_id, ()):
+            attempts.append(APIReadingForwardAttempt(
+                partner_id=partner_id, reading=reading))
+    APIReadingForwardAttempt.objects.bulk_create(
+        attempts, ignore_conflicts=True)
+    for partner_id in set(attempt.partner_id for attempt in attempts):
+        forward_queued_readings.delay(partner_id)
+
+
+def needs_qa_log(reading):
+    from genesishealth.apps.gdrives.models import GDrive
+    return reading.device.status in (
+        GDrive.DEVICE_STATUS_NEW, GDrive.DEVICE_STATUS_REPAIRABLE,
+        GDrive.DEVICE_STATUS_REWORKED)
+
+
 @task
 def post_processing(reading_id):
     from genesishealth.apps.logs.models import QALogEntry
-    from genesishealth.apps.gdrives.models import GDrive
-    from genesishealth.apps.readings.models import GlucoseReading
+    from genesishealth.apps.readings.models import (
+        DailyReadingRollup, GlucoseReading)
     reading = GlucoseReading.objects.get(pk=reading_id)
     # Update the patient's last glucose value
     if reading.patient:
         reading.patient.patient_profile.last_reading = reading
         reading.patient.patient_profile.save()
-        partners = reading.patient.patient_profile.partners.filter(
-            forward_readings=True)
-        map(lambda x: x.queue_and_send_reading(reading), partners)
+        DailyReadingRollup.add_readings([reading])
     else:
-        if reading.device.status in (
-                GDrive.DEVICE_STATUS_NEW, GDrive.DEVICE_STATUS_REPAIRABLE,
-                GDrive.DEVICE_STATUS_REWORKED):
+        if needs_qa_log(reading):
             QALogEntry.objects.create(
                 meid=reading.device.meid,
                 reading_datetime=reading.reading_datetime_utc,
                 glucose_value=reading.glucose_value)
     reading.device.last_reading = reading
     reading.device.save()
+    forward_to_partners([reading])
 
 
 @task
-def forward_reading_to_partner(partner_id, attempt_id):
-    from genesishealth.apps.api.models import (
-        APIPartner, APIReadingForwardAttempt)
-    from genesishealth.apps.readings.models import GlucoseReading
-    attempt = APIReadingForwardAttempt.objects.get(pk=attempt_id)
-    reading = attempt.reading
-    if reading.measure_type == GlucoseReading.MEASURE_TYPE_TEST:
-        return
-    partner = APIPartner.objects.get(pk=partner_id)
-    assert partner in reading.patient.patient_profile.partners.all()
-    partner.send_glucose_reading(attempt)
+def post_processing_batch(reading_ids):
+    """Does the work of post_processing for many readings, saving each
+    patient profile and device once."""
+    from genesishealth.apps.logs.models import QALogEntry
+    from genesishealth.apps.readings.models import (
+        DailyReadingRollup, GlucoseReading)
+    from genesishealth.apps.reports.analytics import invalidate_patients
+    readings = list(GlucoseReading.objects.filter(
+        pk__in=reading_ids).select_related(
+        'patient__patient_profile', 'device').order_by('pk'))
+    profiles = {}
+    devices = {}
+    qa_entries = []
+    for reading in readings:
+        # Later readings win, as they would if processed one at a time.
+        if reading.patient:
+            profile = reading.patient.patient_profile
+            profile.last_reading = reading
+            profiles[profile.pk] = profile
+        elif needs_qa_log(reading):
+            qa_entries.append(QALogEntry(
+                meid=reading.device.meid,
+                reading_datetime=reading.reading_datetime_utc,
+                glucose_value=reading.glucose_value))
+        reading.device.last_reading = reading
+        devices[reading.device.pk] = reading.device
+    for profile in profiles.values():
+        profile.save()
+    for device in devices.values():
+        device.save()
+    QALogEntry.objects.bulk_create(qa_entries)
+    DailyReadingRollup.add_readings(readings)
+    # bulk_create sends no post_save, so the dashboards are cleared here.
+    invalidate_patients(r.patient_id for r in readings if r.patient_id)
+    forward_to_partners(readings)
 
 
 @task
@@ -0,0 +1,218 @@
+"""Reading statistics across all of a professional's patients, for the
+compliance and target range dashboards and the patient queries on the
+professional's patient list.
+
+Each statistic is one grouped query over the professional's patients'
+readings, with the professional's targets for those patients loaded in one
+more.  The dashboard figures are cached per professional and window; a
+patient's new, changed or deleted readings and a professional's changed
+targets clear the entries of the professionals concerned, and the timeout
+bounds how far the window can slide before the figures are refreshed.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import Avg, Count, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.timezone import now
+
+from genesishealth.apps.accounts.models import PatientProfile
+from genesishealth.apps.health_information.models import (
+    HealthProfessionalTargets)
+from genesishealth.apps.readings.models import GlucoseReading
+
+DASHBOARD_WINDOWS = (1, 7, 14, 30, 60, 90)
+DASHBOARDS = ('range', 'compliance')
+
+
+def get_cache_key(professional_id, dashboard, days):
+    return 'professional-analytics:%s:%s:%s' % (
+        professional_id, dashboard, days)
+
+
+def invalidate_professionals(professional_ids):
+    cache.delete_many([
+        get_cache_key(professional_id, dashboard, days)
+        for professional_id in professional_ids
+        for dashboard in DASHBOARDS
+        for days in DASHBOARD_WINDOWS])
+
+
+def invalidate_patients(patient_ids):
+    """Clears the cached dashboards of every professional who has one of
+    the patients."""
+    patient_ids = set(patient_ids)
+    if not patient_ids:
+        return
+    # Professionals see their own patients and those of their nursing
+    # group (see ProfessionalProfile.get_patients).
+    nursing_group_ids = PatientProfile.objects.filter(
+        user__in=patient_ids, population_nursing_group__isnull=False
+    ).values('population_nursing_group')
+    professional_ids = User.objects.filter(
+        Q(professional_profile__patients__user__in=patient_ids) |
+        Q(professional_profile__nursing_group__in=nursing_group_ids)
+    ).values_list('pk', flat=True).distinct()
+    invalidate_professionals(professional_ids)
+
+
+class ProfessionalAnalytics(object):
+    def __init__(self, professional):
+        self.professional = professional
+        self.profile = professional.professional_profile
+
+    def get_readings(self, days):
+        end = now()
+        return GlucoseReading.objects.filter(
+            patient__in=self.profile.get_patients(),
+            reading_datetime_utc__range=(end - timedelta(days=days), end))
+
+    def get_patient_statistics(self, days):
+        """Returns {patient id: (reading count, average value)} for the
+        patients with readings in the last `days` days."""
+        rows = self.get_readings(days).order_by().values(
+            'patient').annotate(
+            count=Count('pk'), average=Avg('glucose_value'))
+        return dict(
+            (row['patient'], (row['count'], row['average'])) for row in rows)
+
+    def get_targets(self, patient_ids):
+        """Returns the professional's targets for each patient.  Patients
+        without targets get the default ones, unsaved."""
+        targets = dict(
+            (t.patient_id, t) for t in HealthProfessionalTargets.objects.filter(
+                professional=self.professional, patient__in=patient_ids))
+        for patient_id in patient_ids:
+            if patient_id not in targets:
+                targets[patient_id] = HealthProfessionalTargets(
+                    professional=self.professional, patient_id=patient_id)
+        return targets
+
+    def get_cached(self, dashboard, days, calculate):
+        key = get_cache_key(self.professional.pk, dashboard, days)
+        c = cache.get(key)
+        if c is None:
+            c = calculate(days)
+            cache.set(key, c, settings.PROFESSIONAL_ANALYTICS_CACHE_TIMEOUT)
+        return c
+
+    def get_range_statistics(self, days):
+        return self.get_cached('range', days, self.calculate_range_statistics)
+
+    def get_compliance_statistics(self, days):
+        return self.get_cached(
+            'compliance', days, self.calculate_compliance_statistics)
+
+    def calculate_range_statistics(self, days):
+        """Buckets the patients with readings in the window by their average
+        reading; patients without readings are in none of the buckets."""
+        patient_ids = set(
+            self.profile.get_patients().values_list('pk', flat=True))
+        statistics = self.get_patient_statistics(days)
+        targets = self.get_targets(list(statistics))
+        c = {
+            'days': days,
+            'total': len(patient_ids),
+            'below_range_ids': set(),
+            'above_range_ids': set(),
+            'in_range_ids': set(),
+        }
+        for patient_id, (count, average) in statistics.items():
+            target = targets[patient_id]
+            if average < target.premeal_glucose_goal_minimum:
+                c['below_range_ids'].add(patient_id)
+            elif average > target.postmeal_glucose_goal_maximum:
+                c['above_range_ids'].add(patient_id)
+            else:
+                c['in_range_ids'].add(patient_id)
+        c['num_below_range'] = len(c['below_range_ids'])
+        c['num_above_range'] = len(c['above_range_ids'])
+        c['num_in_range'] = len(c['in_range_ids'])
+        for f in ('in', 'below', 'above'):
+            key = 'percent_{0}_range'.format(f)
+            num_key = 'num_{0}_range'.format(f)
+            if c['total'] == 0:
+                c[key] = 0
+            else:
+                c[key] = c[num_key] * 100. / c['total']
+        return c
+
+    def calculate_compliance_statistics(self, days):
+        """Buckets the patients by their readings per day over the window
+        against their compliance goal, which is a number of daily tests."""
+        patient_ids = set(
+            self.profile.get_patients().values_list('pk', flat=True))
+        statistics = self.get_patient_statistics(days)
+        targets = self.get_targets(list(statistics))
+        c = {
+            'days': days,
+            'total': len(patient_ids),
+            'in_compliance_ids': set(),
+            'out_of_compliance_ids': set(),
+            'no_readings_ids': patient_ids - set(statistics),
+        }
+        for patient_id, (count, average) in statistics.items():
+            if count >= targets[patient_id].compliance_goal * days:
+                c['in_compliance_ids'].add(patient_id)
+            else:
+                c['out_of_compliance_ids'].add(patient_id)
+        for cat in ('in_compliance', 'no_readings', 'out_of_compliance'):
+            num_key = 'num_{0}'.format(cat)
+            percent_key = 'percent_{0}'.format(cat)
+            c[num_key] = len(c['{0}_ids'.format(cat)])
+            if c['total'] == 0:
+                c[percent_key] = 0
+            else:
+                c[percent_key] = c[num_key] * 100. / c['total']
+        return c
+
+    def get_patient_ids_by_reading_count(
+            self, for_days, minimum_count, value_filter=None):
+        """Returns the ids of the patients with more than `minimum_count`
+        readings (matching value_filter) since `for_days` days ago, as a
+        queryset to filter with."""
+        readings = GlucoseReading.objects.filter(
+            patient__in=self.profile.get_patients(),
+            reading_datetime_utc__gt=now() - timedelta(days=for_days))
+        if value_filter is not None:
+            readings = readings.filter(value_filter)
+        return readings.order_by().values('patient').annotate(
+            count=Count('pk')).filter(
+            count__gt=minimum_count).values('patient')
+
+    def get_patients_with_fewer_than_x_readings(self, reading_number, for_days):
+        patients = self.profile.get_patients()
+        if reading_number <= 0:
+            return patients.none()
+        return patients.exclude(id__in=self.get_patient_ids_by_reading_count(
+            for_days, reading_number - 1))
+
+    def get_patients_with_x_or_more_high_readings(
+            self, reading_number, glucose_value, for_days):
+        return self.profile.get_patients().filter(
+            id__in=self.get_patient_ids_by_reading_count(
+                for_days, reading_number,
+                Q(glucose_value__gte=glucose_value)))
+
+    def get_patients_with_x_or_more_low_readings(
+            self, reading_number, glucose_value, for_days):
+        return self.profile.get_patients().filter(
+            id__in=self.get_patient_ids_by_reading_count(
+                for_days, reading_number,
+                Q(glucose_value__lte=glucose_value)))
+
+
+@receiver(post_save, sender=GlucoseReading)
+@receiver(post_delete, sender=GlucoseReading)
+def invalidate_reading_patient(sender, instance, **kwargs):
+    if instance.patient_id:
+        invalidate_patients([instance.patient_id])
+
+
+@receiver(post_save, sender=HealthProfessionalTargets)
+@receiver(post_delete, sender=HealthProfessionalTargets)
+def invalidate_targets_professional(sender, instance, **kwargs):
+    invalidate_professionals([instance.professional_id])
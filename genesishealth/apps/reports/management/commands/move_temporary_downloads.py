@@ -0,0 +1,37 @@
+"""Moves the content of downloads saved before TemporaryDownload.content_file
+existed out of the database and into file storage.
+
+Expired downloads are left for sweep_expired_downloads to delete.  Safe to
+restart; downloads are moved in primary key order."""
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils.timezone import now
+
+from genesishealth.apps.reports.models import TemporaryDownload
+
+
+class Command(BaseCommand):
+    help = 'Moves temporary download content from the database to files.'
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        last_pk = 0
+        moved = 0
+        while True:
+            pks = list(TemporaryDownload.objects.filter(
+                Q(valid_until__isnull=True) | Q(valid_until__gte=now()),
+                pk__gt=last_pk
+            ).exclude(content='').order_by('pk').values_list(
+                'pk', flat=True)[:options['batch_size']])
+            if not pks:
+                break
+            last_pk = pks[-1]
+            for download in TemporaryDownload.objects.filter(pk__in=pks):
+                download.store_content(download.content)
+                download.save(update_fields=['content', 'content_file', 'size'])
+                moved += 1
+            self.stdout.write('Up to download %d: %d moved.' % (
+                last_pk, moved))
+        self.stdout.write('Done: %d moved.' % moved)
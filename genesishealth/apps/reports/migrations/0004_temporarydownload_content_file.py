@@ -0,0 +1,22 @@
+from django.db import migrations, models
+import genesishealth.apps.reports.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0003_auto_20171010_1319'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='temporarydownload',
+            name='content',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='temporarydownload',
+            name='content_file',
+            field=models.FileField(blank=True, null=True, storage=genesishealth.apps.reports.storage.TemporaryDownloadStorage(), upload_to='%Y/%m/'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations, models
+import genesishealth.apps.reports.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0004_temporarydownload_content_file'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='temporarydownload',
+            name='content_file',
+            field=models.FileField(blank=True, null=True, storage=genesishealth.apps.reports.storage.TemporaryDownloadStorage(), upload_to=''),
+        ),
+        migrations.AddField(
+            model_name='temporarydownload',
+            name='size',
+            field=models.BigIntegerField(null=True),
+        ),
+    ]
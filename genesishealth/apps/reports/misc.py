@@ -1,7 +1,9 @@
+from bisect import bisect_left, bisect_right
 from datetime import time, timedelta, datetime, date
 
+import numpy
+
 from django.template.loader import render_to_string
-from django.db.models import Avg, StdDev
 from django.conf import settings
 
 from genesishealth.apps.readings.models import GlucoseReading
@@ -58,6 +60,11 @@ class LogbookDay:
 
     ENTRY_TYPES = ('glucose_readings',)
 
+    # The columns LogbookPeriod needs to render each entry type.
+    ENTRY_FIELDS = {
+        'glucose_readings': ('patient', 'measure_type', 'reading_datetime_utc', 'glucose_value'),
+    }
+
     @classmethod
     def calculate_stats(cls, days, patient):
         """This class method receives a list of LogbookDays and then parses various stats from them.
@@ -72,45 +79,75 @@ class LogbookDay:
 
         period_defs = cls.PERIOD_DEFINITIONS[period_type]
 
-        count = 0
-        for period in period_defs:
-            # Get all the readings into a query set so we can do some analysis.
-            reading_ids = []
+        minimum = patient.healthinformation.premeal_glucose_goal_minimum
+        maximum = patient.healthinformation.postmeal_glucose_goal_maximum
+
+        # The days already hold the readings that count, so the stats are worked out from them
+        # rather than queried again.  Readings are keyed by id in case two days share one.
+        for count in range(len(period_defs)):
+            readings = {}
             for day in days:
                 for entry in day.periods[count].entries:
                     if isinstance(entry, GlucoseReading):
-                        reading_ids.append(entry.id)
-            readings = GlucoseReading.objects.filter(id__in=reading_ids)
+                        readings[entry.id] = entry.glucose_value
+            values = numpy.array(list(readings.values()))
 
-            aggregates = readings.aggregate(Avg('glucose_value'), StdDev('glucose_value'))
-            readings_in_range = readings.filter(
-                glucose_value__range=(patient.healthinformation.premeal_glucose_goal_minimum,
-                    patient.healthinformation.postmeal_glucose_goal_maximum))
+            if len(values) == 0: # No div by 0!
+                stats['glucose_average'].append(None)
+                stats['percent_in_target'].append(0)
+                stats['standard_deviation'].append(None)
+                stats['number_of_readings'].append(0)
+                continue
 
-            if readings.count() == 0: # No div by 0!
-                percent_in_target = 0
-            else:
-                percent_in_target = float(readings_in_range.count()) / readings.count() * 100
+            in_target = numpy.count_nonzero((values >= minimum) & (values <= maximum))
+            percent_in_target = float(in_target) / len(values) * 100
 
-            stats['glucose_average'].append(aggregates['glucose_value__avg'])
+            stats['glucose_average'].append(float(values.mean()))
             stats['percent_in_target'].append(percent_in_target)
-            stats['standard_deviation'].append(aggregates['glucose_value__stddev'])
-            stats['number_of_readings'].append(readings.count())
-
-            count += 1
+            # Population standard deviation, like the database's StdDev.
+            stats['standard_deviation'].append(float(values.std()))
+            stats['number_of_readings'].append(len(values))
 
         return stats        
 
     @classmethod
     def generate_logbook_days(cls, patient, start_date, end_date, display_type, cap_entries=settings.MAX_LOGBOOK_ENTRIES):
         """Generates all of the logbook days and fills them with the patient's data.
-        cap_entries=<digit> will cap the number of entries per period at <digit>"""
+        cap_entries=<digit> will cap the number of entries per period at <digit>
+
+        Each entry type is fetched for the whole range in one query and then handed out to
+        the days it falls in."""
         out_type = cls.DISPLAY_TYPES_TO_PERIOD_TYPES[display_type]
         days = []
         for i in range((end_date - start_date).days + 1):
-            days.append(cls(patient, end_date - timedelta(days=i), out_type, cap_entries))
+            days.append(cls(patient, end_date - timedelta(days=i), out_type, cap_entries, entries=[]))
+        if not days:
+            return days
+
+        ranges = [day.get_entry_range() for day in days]
+        for i in LogbookDay.ENTRY_TYPES:
+            items = cls.get_entries(patient, i, min(r[0] for r in ranges), max(r[1] for r in ranges))
+            times = [get_datetime(item) for item in items]
+            for day, (start, end) in zip(days, ranges):
+                for item in items[bisect_left(times, start):bisect_right(times, end)]:
+                    day.add_entry(item, cap_entries)
+
+        for day in days:
+            day.sort()
         return days
 
+    @classmethod
+    def get_entries(cls, patient, entry_type, start, end):
+        """Gets the patient's entries of the given type between start and end, in order."""
+        obj_manager = getattr(patient, entry_type)
+        datetime_field = get_datetime_field_from_model(obj_manager.model)
+        kwargs = {'%s__range' % datetime_field: (start, end)}
+        items = obj_manager.filter(**kwargs).order_by(datetime_field, 'pk')
+        if entry_type in cls.ENTRY_FIELDS:
+            items = items.only(*cls.ENTRY_FIELDS[entry_type])
+        # The period template shows whether each entry has notes.
+        return list(items.prefetch_related('notes'))
+
     @classmethod
     def get_period_info(cls, period_type, timezone):
         """This gets the name, start time, and end time (calculated) for all of the periods in
@@ -135,7 +172,8 @@ class LogbookDay:
             count += 1
         return period_info
 
-    def __init__(self, patient, day, period_type, cap_entries=None):
+    def __init__(self, patient, day, period_type, cap_entries=None, entries=None):
+        """entries, if given, are added instead of querying for the day's entries."""
         self.patient = patient
         self.timezone = self.patient.patient_profile.timezone
         # Convert date to datetime for comparison later.
@@ -150,21 +188,24 @@ class LogbookDay:
         self.periods = [LogbookPeriod(self.day, self.period_type, i['name'])\
                          for i in LogbookDay.PERIOD_DEFINITIONS[self.period_type]]
 
-        start_date = self.day + timedelta(hours=self.day_start)
-        end_date = start_date + timedelta(days=1) - timedelta(microseconds=1)
-        
-        for i in LogbookDay.ENTRY_TYPES:
-            obj_manager = getattr(self.patient, i)
-            datetime_field = get_datetime_field_from_model(obj_manager.model)
-            # Figure out what the start of each day is ... e.g. some are 12AM - 12AM, others are 5AM-5AM
-            # Query must be adjusted accordingly.
-            kwargs = {'%s__range' % datetime_field: (start_date, end_date)}
-            items = obj_manager.filter(**kwargs)
-            for r in items:
-                self.add_entry(r, cap_entries)
+        if entries is None:
+            start_date, end_date = self.get_entry_range()
+            entries = []
+            for i in LogbookDay.ENTRY_TYPES:
+                entries.extend(self.get_entries(self.patient, i, start_date, end_date))
+        for r in entries:
+            self.add_entry(r, cap_entries)
 
         self.sort()
 
+    def get_entry_range(self):
+        """The first and last datetime of this day's entries."""
+        # Figure out what the start of each day is ... e.g. some are 12AM - 12AM, others are 5AM-5AM
+        # Query must be adjusted accordingly.
+        start_date = self.day + timedelta(hours=self.day_start)
+        end_date = start_date + timedelta(days=1) - timedelta(microseconds=1)
+        return start_date, end_date
+
     def __str__(self) -> str:
         return '%s logbook day for %s' % (self.day, self.patient)
 
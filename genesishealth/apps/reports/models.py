@@ -1,13 +1,21 @@
+import gzip
+import hashlib
+import io
+import tempfile
+
 from datetime import timedelta
 
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.files import File
 from django.core.mail import EmailMessage
 from django.urls import reverse
 from django.db import models
 from django.template.loader import render_to_string
 from django.utils.timezone import now
 
+from genesishealth.apps.reports.storage import TemporaryDownloadStorage
+
 
 def tomorrow_dt():
     return now() + timedelta(days=1)
@@ -17,24 +25,166 @@ def thirty_days_dt():
     return now() + timedelta(days=30)
 
 
+class _DigestWriter(io.RawIOBase):
+    """Passes bytes through to another file, hashing and counting them."""
+    def __init__(self, f):
+        self.f = f
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.digest.update(b)
+        self.size += len(b)
+        self.f.write(b)
+        return len(b)
+
+
+class TemporaryDownloadManager(models.Manager):
+    def sweep_expired(self, batch_size=500):
+        """Deletes expired downloads, and their files once no other download
+        uses them.  Returns the number of downloads and files deleted.
+
+        A file written or reused in the last TEMPORARY_DOWNLOAD_FILE_GRACE
+        seconds may be about to belong to a download that is being created,
+        so it is kept, along with the expired downloads that use it, until
+        a later sweep."""
+        storage = self.model._meta.get_field('content_file').storage
+        grace_cutoff = now() - timedelta(
+            seconds=settings.TEMPORARY_DOWNLOAD_FILE_GRACE)
+        downloads = files = 0
+        last_pk = 0
+        while True:
+            batch = list(self.filter(
+                valid_until__lt=now(), pk__gt=last_pk
+            ).order_by('pk').values_list('pk', 'content_file')[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            names = set(name for _, name in batch if name)
+            recent = set(
+                name for name in names
+                if storage.exists(name) and
+                storage.get_modified_time(name) >= grace_cutoff)
+            expired = [pk for pk, name in batch if name not in recent]
+            self.filter(pk__in=expired).delete()
+            downloads += len(expired)
+            names -= recent
+            in_use = set(self.filter(content_file__in=names).values_list(
+                'content_file', flat=True))
+            for name in names - in_use:
+                storage.delete(name)
+                files += 1
+        return downloads, files
+
+
 class TemporaryDownload(models.Model):
     for_user = models.ForeignKey(User, related_name='temporary_downloads', on_delete=models.CASCADE)
     datetime_added = models.DateTimeField(auto_now_add=True)
     valid_until = models.DateTimeField(
         null=True, default=thirty_days_dt)
-    content = models.TextField()
+    # Content set here is moved to content_file on save; only downloads
+    # from before content_file existed still keep it in the database.
+    content = models.TextField(blank=True, default='')
+    # Gzipped and named after its hash, so identical downloads share a file.
+    content_file = models.FileField(
+        storage=TemporaryDownloadStorage(), null=True, blank=True)
+    # Of the uncompressed content, in bytes.
+    size = models.BigIntegerField(null=True)
     content_type = models.CharField(max_length=255)
     filename = models.CharField(max_length=255)
 
+    objects = TemporaryDownloadManager()
+
+    @classmethod
+    def create_from_stream(cls, write, **kwargs):
+        """Creates a download whose content is written by calling write with
+        a text file, so it never has to be held in memory."""
+        download = cls(**kwargs)
+        download.write_content(write)
+        download.save()
+        return download
+
+    def save(self, *args, **kwargs):
+        if self.content and not self.content_file:
+            self.store_content(self.content)
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {
+                    'content', 'content_file', 'size'}
+        super(TemporaryDownload, self).save(*args, **kwargs)
+
+    def store_content(self, content):
+        """Moves text content into content_file, without saving."""
+        self.write_content(lambda text: text.write(content))
+        self.content = ''
+
+    def write_content(self, write):
+        """Sets content_file to what write writes to the text file it is
+        called with, without saving."""
+        with tempfile.TemporaryFile() as tmp:
+            # mtime=0 keeps the output the same for the same content.
+            with gzip.GzipFile(fileobj=tmp, mode='wb', mtime=0) as compressed:
+                writer = _DigestWriter(compressed)
+                # newline='' leaves line endings (e.g. csv's \r\n) alone.
+                text = io.TextIOWrapper(
+                    io.BufferedWriter(writer), encoding='utf-8', newline='')
+                write(text)
+                text.flush()
+                text.detach()
+            digest = writer.digest.hexdigest()
+            name = '{}/{}/{}.gz'.format(digest[:2], digest[2:4], digest)
+            storage = self.content_file.storage
+            # Touching a file this download shares keeps the sweeper from
+            # deleting it before the download is saved.
+            try:
+                storage.touch(name)
+            except FileNotFoundError:
+                name = storage.save(name, File(tmp))
+        self.content_file.name = name
+        self.size = writer.size
+
     def get_absolute_url(self):
         return "{}://{}{}".format(
             settings.HTTP_PROTOCOL,
             settings.SITE_URL,
             self.get_url())
 
+    def get_size(self):
+        if self.size is not None:
+            return self.size
+        return sum(len(chunk) for chunk in self.iter_content())
+
     def get_url(self):
         return reverse('reports:temp-download', args=[self.id])
 
+    def iter_content(self, start=0, end=None, chunk_size=64 * 1024):
+        """Yields the content's bytes from start up to end."""
+        if self.content_file:
+            f = self.content_file.open('rb')
+            source = gzip.GzipFile(fileobj=f)
+        else:
+            f = None
+            source = io.BytesIO(self.content.encode('utf-8'))
+        try:
+            # Seeking in a gzip file decompresses up to start.
+            source.seek(start)
+            position = start
+            while end is None or position < end:
+                if end is None:
+                    chunk = source.read(chunk_size)
+                else:
+                    chunk = source.read(min(chunk_size, end - position))
+                if not chunk:
+                    break
+                position += len(chunk)
+                yield chunk
+        finally:
+            source.close()
+            if f is not None:
+                f.close()
+
     def send_email(self, extra_message=None):
         ctx = {
             "extra_message": extra_message,
@@ -49,3 +199,7 @@ class TemporaryDownload(models.Model):
             [settings.DEFAULT_FROM_EMAIL],
             [self.for_user.email])
         eml.send()
+
+
+# Registers the receivers that clear the professional dashboard caches.
+from genesishealth.apps.reports import analytics  # noqa
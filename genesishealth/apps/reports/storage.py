@@ -0,0 +1,19 @@
+import os
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class TemporaryDownloadStorage(FileSystemStorage):
+    """Stores download content under settings.TEMPORARY_DOWNLOAD_ROOT, which
+    has no URL; downloads are only served through the temp_download view."""
+    def __init__(self):
+        super(TemporaryDownloadStorage, self).__init__(
+            location=settings.TEMPORARY_DOWNLOAD_ROOT)
+
+    def touch(self, name):
+        """Marks the file as just written.  Raises FileNotFoundError if it
+        no longer exists."""
+        os.utime(self.path(name))
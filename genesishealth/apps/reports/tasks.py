@@ -1,4 +1,9 @@
-from celery.task import task
+import logging
+
+from celery.schedules import crontab
+from celery.task import periodic_task, task
+
+logger = logging.getLogger(__name__)
 
 
 def get_report_class(report_name):
@@ -33,12 +38,25 @@ def trigger_report(report):
     report.trigger_delayed()
 
 
-@task
-def run_report_async(report_name, user_id, form_data, form_config):
+@task(bind=True)
+def run_report_async(self, report_name, user_id, form_data, form_config):
     from django.contrib.auth.models import User
     user = User.objects.get(id=user_id)
     report_class = get_report_class(report_name)
     if report_class is None:
         raise Exception("Invalid report name {0}".format(report_name))
     report = report_class(**form_config)
-    report.create_download_from_raw_data(form_data, user)
+
+    def progress(rows):
+        logger.info('%s for user %s: %d rows written.', report_name,
+                    user_id, rows)
+        self.update_state(state='PROGRESS', meta={'rows': rows})
+
+    report.create_download_from_raw_data(form_data, user, progress)
+
+
+@periodic_task(run_every=crontab(hour=2, minute=45))
+def sweep_expired_downloads():
+    from genesishealth.apps.reports.models import TemporaryDownload
+    downloads, files = TemporaryDownload.objects.sweep_expired()
+    logger.info('Deleted %d expired downloads and %d files.', downloads, files)
@@ -13,6 +13,8 @@ from django.urls import reverse
 from genesishealth.apps.accounts.models import PatientProfile
 from genesishealth.apps.readings.models import (
     GlucoseReading, GlucoseReadingNote)
+from genesishealth.apps.readings.statistics import (
+    get_goal_buckets, get_reading_statistics)
 from genesishealth.apps.reports.forms import (
     ReportForm, DisplayLogbookForm, GlucoseReadingEntryForm)
 from genesishealth.apps.reports.misc import (
@@ -264,15 +266,17 @@ def trend_report_average_data(request, patient_id):
         glucose_goal = (
             patient.healthinformation.premeal_glucose_goal_minimum,
             patient.healthinformation.postmeal_glucose_goal_maximum)
-    total_readings = readings.count()
     bottom, top = glucose_goal
+    statistics = get_reading_statistics(
+        readings, get_goal_buckets(bottom, top, patient.healthinformation))
+    total_readings = statistics['count']
 
     chart_data = {
-        "above_count": 0,
-        "below_count": 0,
-        "within_count": 0,
-        "hypo_count": 0,
-        "hyper_count": 0,
+        "above_count": statistics['above_count'],
+        "below_count": statistics['below_count'],
+        "within_count": statistics['within_count'],
+        "hypo_count": statistics['hypo_count'],
+        "hyper_count": statistics['hyper_count'],
         "glucose_goal": "%s-%s" % (bottom, top),
         "patient_name": patient.get_full_name(),
         "date_range": "%s - %s" % (
@@ -286,18 +290,6 @@ def trend_report_average_data(request, patient_id):
             request.user.professional_profile.parent_group,
             request.user.username)
 
-    for r in readings:
-        if r.glucose_value > top:
-            chart_data["above_count"] += 1
-            if r.glucose_value > patient.healthinformation.safe_zone_maximum:
-                chart_data['hyper_count'] += 1
-        elif r.glucose_value < bottom:
-            chart_data["below_count"] += 1
-            if r.glucose_value < patient.healthinformation.safe_zone_minimum:
-                chart_data['hypo_count'] += 1
-        elif bottom <= r.glucose_value <= top:
-            chart_data["within_count"] += 1
-
     chart_data["above_percentage"] = "%.2f" % (total_readings != 0 and ((
         float(chart_data["above_count"]) / float(total_readings)) * 100) or 0)
     chart_data["below_percentage"] = "%.2f" % (total_readings != 0 and ((
@@ -1,3 +1,5 @@
+import re
+
 from datetime import date, datetime, time, timedelta
 from itertools import groupby
 
@@ -5,16 +7,17 @@ from django.conf import settings
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.models import User
 from django.urls import reverse
-from django.db.models import Avg, Count, Max, Min, StdDev
+from django.db.models import Q
 from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.utils.decorators import method_decorator
 from django.utils.timezone import now
 
 from genesishealth.apps.accounts.models import PatientProfile
-from genesishealth.apps.health_information.models import (
-    HealthProfessionalTargets)
 from genesishealth.apps.readings.models import GlucoseReading
+from genesishealth.apps.readings.statistics import (
+    get_grouped_reading_statistics, get_reading_statistics,
+    get_target_buckets)
 from genesishealth.apps.reports.forms import (
     DisplayLogbookForm, SingleChartControlForm)
 from genesishealth.apps.reports.misc import LogbookDay
@@ -29,81 +32,33 @@ from genesishealth.apps.utils.wkhtmltopdf import wkhtmltopdf
 
 from wkhtmltopdf.views import PDFTemplateResponse, PDFTemplateView
 
+from ..analytics import DASHBOARD_WINDOWS, ProfessionalAnalytics
 from ..models import TemporaryDownload
 
+BYTE_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
 
-def get_range_statistics(user, days):
-    c = {'days': days}
-
-    range_queryset = GlucoseReading.objects.select_related('patient')
-    range_queryset = range_queryset.filter(
-        patient__in=user.professional_profile.get_patients())
-    range_queryset = range_queryset.filter(
-        reading_datetime_utc__range=(now() - timedelta(days=days), now()))
-    range_queryset = range_queryset.annotate(
-        readings_last_period=Count('id')).annotate(
-        average_value=Avg('glucose_value'))
-
-    total_patients = user.professional_profile.get_patients().count()
-
-    c['num_below_range'] = 0
-    c['num_above_range'] = 0
-    for reading in range_queryset:
-        patient = reading.patient
-        targets = HealthProfessionalTargets.objects.get_or_create(
-            patient=patient, professional=user)
-        if reading.glucose_value < targets.premeal_glucose_goal_minimum:
-            c['num_below_range'] += 1
-        elif reading.glucose_value > targets.postmeal_glucose_goal_maximum:
-            c['num_above_range'] += 1
-
-    c['num_in_range'] = (
-        total_patients - c['num_below_range'] - c['num_above_range'])
-    if total_patients == 0:
-        for f in ('in', 'below', 'above'):
-            key = 'percent_{0}_range'.format(f)
-            c[key] = 0
-    else:
-        for f in ('in', 'below', 'above'):
-            key = 'percent_{0}_range'.format(f)
-            num_key = 'num_{0}_range'.format(f)
-            c[key] = c[num_key] * 100. / total_patients
 
-    c['total'] = total_patients
-    return c
+def get_dashboard_days(request, name):
+    """The window POSTed for a dashboard, which must be one whose figures
+    are cached, or the default of one day."""
+    days = request.POST.get(name)
+    if not days:
+        return 1
+    try:
+        days = int(days)
+    except ValueError:
+        raise Http404
+    if days not in DASHBOARD_WINDOWS:
+        raise Http404
+    return days
 
 
-def get_compliance_statistics(user, days):
-    c = {'days': days}
-
-    base_queryset = GlucoseReading.objects.select_related()
-    base_queryset = base_queryset.filter(
-        patient__in=user.professional_profile.get_patients())
-    base_queryset = base_queryset.filter(
-        reading_datetime_utc__range=(now() - timedelta(days=days), now()))
-    base_queryset = base_queryset.annotate(readings_last_period=Count('id'))
-
-    total_patients = user.professional_profile.get_patients().count()
-    c['num_in_compliance'] = 0
-    for reading in base_queryset:
-        patient = reading.patient
-        targets = HealthProfessionalTargets.objects.get_or_create(
-            patient=patient, professional=user)
-        if reading.readings_last_period >= targets.compliance_goal:
-            c['num_in_compliance'] += 1
-    cats = ['in_compliance', 'no_readings', 'out_of_compliance']
-    if total_patients == 0:
-        for cat in cats:
-            percent_key = 'percent_{0}'.format(cat)
-            c[percent_key] = 0
-    else:
-        for cat in cats:
-            percent_key = 'percent_{0}'.format(cat)
-            num_key = 'num_{0}'.format(c)
-            c[percent_key] = c[num_key] * 100. / total_patients
-    c['total'] = total_patients
+def get_range_statistics(user, days):
+    return ProfessionalAnalytics(user).get_range_statistics(days)
 
-    return c
+
+def get_compliance_statistics(user, days):
+    return ProfessionalAnalytics(user).get_compliance_statistics(days)
 
 
 def get_dates():
@@ -115,30 +70,26 @@ def get_dates():
 
 
 def aggregate_readings(user, readings, days=0):
-    aggregates = readings.aggregate(
-        Avg('glucose_value'),
-        Max('glucose_value'),
-        Min('glucose_value'),
-        Count('glucose_value'),
-        StdDev('glucose_value'))
-    aggregates['total'] = readings.count()
+    statistics = get_reading_statistics(
+        readings, get_target_buckets(user.healthinformation))
+    aggregates = dict(
+        (key, statistics[key]) for key in (
+            'glucose_value__avg', 'glucose_value__max', 'glucose_value__min',
+            'glucose_value__count', 'glucose_value__stddev'))
+    aggregates['total'] = statistics['count']
     aggregates['total_days'] = days
-
-    readings.filter(
-        glucose_value__gt=settings.GLUCOSE_LO_VALUE,
-        glucose_value__lt=settings.GLUCOSE_HI_VALUE)
-
-    aggregates['low_readings'] = readings.filter(
-        glucose_value__lt=user.healthinformation.premeal_glucose_goal_minimum
-    ).count()
-    aggregates['high_readings'] = readings.filter(
-        glucose_value__gt=user.healthinformation.postmeal_glucose_goal_maximum
-    ).count()
-    aggregates['hypo_readings'] = readings.filter(
-        glucose_value__lt=user.healthinformation.safe_zone_minimum).count()
-    aggregates['hyper_readings'] = readings.filter(
-        glucose_value__gt=user.healthinformation.safe_zone_maximum).count()
-    aggregates['average_tests_per_day'] = readings.count() / days
+    aggregates['low_readings'] = statistics['low_count']
+    aggregates['high_readings'] = statistics['high_count']
+    aggregates['hypo_readings'] = statistics['hypo_count']
+    aggregates['hyper_readings'] = statistics['hyper_count']
+    if days:
+        aggregates['average_tests_per_day'] = statistics['count'] / days
+    else:
+        aggregates['average_tests_per_day'] = 0
+    # The pre- and post-meal counts come for free; the aggregate report
+    # uses them to tell which graphs are empty.
+    aggregates['premeal_count'] = statistics['premeal_count']
+    aggregates['postmeal_count'] = statistics['postmeal_count']
 
     return aggregates
 
@@ -264,7 +215,7 @@ def logbook_with_summary(request, patient_id=None):
     aggregates = aggregate_readings(user, readings, days=len(grouped_readings))
     c = {
         "aggregates": aggregates,
-        'empty': (len(readings) == 0),
+        'empty': aggregates['total'] == 0,
         'patient': user,
         'dates': get_dates(),
         'start_date': start_datetime.date,
@@ -332,51 +283,46 @@ def print_logbook_context(data):
         days=number_of_days)  # Equal periods of time
 
     # Calculate some stats for "this" period and previous period.
+    health_information = patient.healthinformation
+    period_statistics = get_grouped_reading_statistics(
+        patient.glucose_readings.filter(
+            reading_datetime_utc__range=(
+                previous_start_datetime, end_datetime)),
+        {
+            'this_period': Q(
+                reading_datetime_utc__range=(start_datetime, end_datetime)),
+            'previous_period': Q(reading_datetime_utc__range=(
+                previous_start_datetime, previous_end_datetime)),
+        },
+        get_target_buckets(health_information))
     target_range_stats = {}
-    items = (
-        (start_datetime, end_datetime, 'this_period'),
-        (previous_start_datetime, previous_end_datetime, 'previous_period')
-    )
-    for i in items:
-        readings = patient.glucose_readings.filter(
-            reading_datetime_utc__range=(i[0], i[1]))
-        aggregates = readings.aggregate(Avg('glucose_value'))
-        compliance_goal = patient.healthinformation.compliance_goal
+    for period, statistics in period_statistics.items():
+        compliance_goal = health_information.compliance_goal
         if compliance_goal != 0:
             compliance_percent = (
-                float(readings.count()) /
+                float(statistics['count']) /
                 number_of_days /
                 compliance_goal *
                 100)
         else:
             compliance_percent = 0
-        hypo_readings = readings.filter(
-            glucose_value__lt=patient.healthinformation.safe_zone_minimum)
-        hyper_readings = readings.filter(
-            glucose_value__gt=patient.healthinformation.safe_zone_maximum)
 
-        target_range_stats[i[2]] = {
-            'glucose_average': aggregates['glucose_value__avg'],
+        target_range_stats[period] = {
+            'glucose_average': statistics['glucose_value__avg'],
             'compliance_percent': compliance_percent,
-            'hypo_count': hypo_readings.count(),
-            'hyper_count': hyper_readings.count()
+            'hypo_count': statistics['hypo_count'],
+            'hyper_count': statistics['hyper_count']
         }
 
     # Calculate aggregate statistics
-    readings = patient.glucose_readings.filter(
-        reading_datetime_utc__range=(start_datetime, end_datetime))
-    aggregates = readings.aggregate(StdDev('glucose_value'))
-    readings_in_range = readings.filter(
-        glucose_value__gte=patient.healthinformation.
-        premeal_glucose_goal_minimum,
-        glucose_value__lte=patient.healthinformation.
-        postmeal_glucose_goal_maximum)
-    if readings:
-        percent_in_range = float(readings_in_range.count()) / readings.count()
+    statistics = period_statistics['this_period']
+    if statistics['count']:
+        percent_in_range = (
+            float(statistics['in_range_count']) / statistics['count'])
     else:
         percent_in_range = 0
     if number_of_days:
-        average_readings_per_day = float(readings.count()) / number_of_days
+        average_readings_per_day = float(statistics['count']) / number_of_days
     else:
         average_readings_per_day = 0
     # get AIC if we have a glucose average
@@ -391,11 +337,11 @@ def print_logbook_context(data):
         'glucose_average': target_range_stats[
             'this_period']['glucose_average'],
         'average_readings_per_day': average_readings_per_day,
-        'standard_deviation': aggregates['glucose_value__stddev'],
+        'standard_deviation': statistics['glucose_value__stddev'],
         'percent_in_range': percent_in_range,
         'hypo_count': target_range_stats['this_period']['hypo_count'],
         'hyper_count': target_range_stats['this_period']['hyper_count'],
-        'number_of_readings': readings.count(),
+        'number_of_readings': statistics['count'],
         'estimated_a1c': estimated_a1c
     }
 
@@ -567,27 +513,18 @@ class AggregateReport(ReportView):
         # days, even though the difference in date is only 1.
         days = (end_datetime.date() - start_datetime.date()).days + 1
 
-        for i in ('premeal', 'postmeal', 'combined', 'summary'):
-            # Have to add one to the end_date, or it will not get readings
-            # from that date
-            readings = GlucoseReading.objects.filter(
-                patient=self.user,
-                reading_datetime_utc__range=[
-                    start_datetime, end_datetime + timedelta(days=1)])
-            readings = readings.exclude(measure_type="TEST mode")
-            if i == 'premeal':
-                c['premeal_empty'] = readings.filter(
-                    measure_type=GlucoseReading.MEASURE_TYPE_BEFORE
-                ).count() == 0
-            elif i == 'postmeal':
-                c['postmeal_empty'] = readings.filter(
-                    measure_type=GlucoseReading.MEASURE_TYPE_AFTER
-                ).count() == 0
-            else:
-                c['%s_empty' % i] = readings.count() == 0
-                if i == 'summary':
-                    c['aggregates'] = aggregate_readings(
-                        self.user, readings, days=days)
+        # Have to add one to the end_date, or it will not get readings
+        # from that date
+        readings = GlucoseReading.objects.filter(
+            patient=self.user,
+            reading_datetime_utc__range=[
+                start_datetime, end_datetime + timedelta(days=1)])
+        readings = readings.exclude(measure_type="TEST mode")
+        c['aggregates'] = aggregate_readings(self.user, readings, days=days)
+        c['premeal_empty'] = c['aggregates']['premeal_count'] == 0
+        c['postmeal_empty'] = c['aggregates']['postmeal_count'] == 0
+        c['combined_empty'] = c['summary_empty'] = (
+            c['aggregates']['total'] == 0)
 
         c['days'] = self.form.cleaned_data.get('days')
         c['start_date'] = self.form.cleaned_data.get('start_date')
@@ -790,9 +727,7 @@ compliance = prof_test(ComplianceTableView.as_view())
 @user_passes_test(professional_user)
 def compliance_landing(request):
     c = {'compliance': get_compliance_statistics(
-        request.user,
-        request.POST.get('compliance_days') and
-        int(request.POST.get('compliance_days')) or 1),
+        request.user, get_dashboard_days(request, 'compliance_days')),
     }
 
     return render(request, 'reports/compliance_landing.html', c)
@@ -882,9 +817,7 @@ range_report = prof_test(RangeReportTableView.as_view())
 def range_landing(request):
     c = {}
     c['range'] = get_range_statistics(
-        request.user,
-        request.POST.get('range_days') and
-        int(request.POST.get('range_days')) or 1)
+        request.user, get_dashboard_days(request, 'range_days'))
 
     return render(request, 'reports/range_landing.html', c)
 
@@ -922,6 +855,33 @@ class TempDownloadTableView(GenesisTableView):
 temp_download_index = TempDownloadTableView.as_view()
 
 
+def get_byte_range(range_header, size):
+    """Returns the (start, end) of a single byte range header, None if the
+    header should be ignored, or False if the range can't be satisfied."""
+    match = BYTE_RANGE_RE.match(range_header.strip())
+    if match is None:
+        # Multiple ranges are allowed to be answered with everything.
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        if last:
+            if int(last) < start:
+                return None
+            end = min(int(last) + 1, size)
+        else:
+            end = size
+    elif last:
+        # The final bytes.
+        start = max(size - int(last), 0)
+        end = size
+    else:
+        return None
+    if start >= end:
+        return False
+    return start, end
+
+
 def temp_download(request, download_id):
     try:
         dl = TemporaryDownload.objects.exclude(
@@ -929,7 +889,27 @@ def temp_download(request, download_id):
             for_user=request.user, pk=download_id)
     except TemporaryDownload.DoesNotExist:
         raise Http404
-    response = StreamingHttpResponse(dl.content, content_type=dl.content_type)
+    size = dl.get_size()
+    byte_range = None
+    if 'HTTP_RANGE' in request.META:
+        byte_range = get_byte_range(request.META['HTTP_RANGE'], size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{}'.format(size)
+            return response
+    if byte_range is None:
+        response = StreamingHttpResponse(
+            dl.iter_content(), content_type=dl.content_type)
+        response['Content-Length'] = size
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            dl.iter_content(start, end), status=206,
+            content_type=dl.content_type)
+        response['Content-Length'] = end - start
+        response['Content-Range'] = 'bytes {}-{}/{}'.format(
+            start, end - 1, size)
+    response['Accept-Ranges'] = 'bytes'
     response['Content-Disposition'] = 'attachment; filename="{}"'.format(
         dl.filename)
     return response
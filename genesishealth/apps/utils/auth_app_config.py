@@ -5,21 +5,15 @@ class AuthAppConfig(AuthConfig):
     def ready(self):
         super(AuthAppConfig, self).ready()
 
+        from genesishealth.apps.utils.roles import get_role
+
         User = self.get_model('User')  # noqa
 
         def get_profile(self):
-            for clsName in (
-                    'patient_profile',
-                    'professional_profile',
-                    'demo_profile'):
-                try:
-                    profile = getattr(self, clsName)
-                except:
-                    pass
-                else:
-                    return profile
-
-            raise Exception("Profile not found for user: %s" % self)
+            profile = get_role(self).profile
+            if profile is None:
+                raise Exception("Profile not found for user: %s" % self)
+            return profile
 
         def has_group(self, group):
             try:
@@ -29,35 +23,16 @@ class AuthAppConfig(AuthConfig):
             return True
 
         def is_admin(self):
-            try:
-                self.admin_profile
-            except:
-                return False
-            return True
+            return get_role(self).is_admin
 
         def is_professional(self):
-            try:
-                assert not self.is_admin()
-                self.professional_profile
-            except:
-                return False
-            return True
+            return get_role(self).is_professional
 
         def is_patient(self):
-            try:
-                assert not self.is_admin()
-                self.patient_profile
-            except:
-                return False
-            return True
+            return get_role(self).is_patient
 
         def get_user_type(self):
-            for name in ('patient', 'professional', 'admin'):
-                if hasattr(self, 'is_%s' % name):
-                    fn = getattr(self, 'is_%s' % name)
-                    if fn():
-                        return name
-            return 'unknown'
+            return get_role(self).user_type
 
         def get_initials(self):
             if self.last_name and self.first_name:
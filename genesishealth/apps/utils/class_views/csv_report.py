@@ -1,13 +1,15 @@
 import csv
 import io
 from abc import ABC
-from typing import List, Type, Any, Dict, ClassVar
+from typing import (
+    Any, Callable, ClassVar, Dict, IO, Iterable, Iterator, List, Optional,
+    Type)
 
 from celery.result import AsyncResult
 from django import forms
 from django.contrib.auth.models import User
-from django.db.models import QuerySet
-from django.http import HttpResponse
+from django.db.models import QuerySet, prefetch_related_objects
+from django.http import HttpResponse, StreamingHttpResponse
 
 from genesishealth.apps.reports.models import TemporaryDownload
 from genesishealth.apps.reports.tasks import (
@@ -30,43 +32,51 @@ class CSVReportForm(GenesisForm):
             key=lambda x: x == 'run_async'))
 
 
+class _Echo(object):
+    """A file whose write returns what was written, so csv.writer can
+    produce lines for a StreamingHttpResponse."""
+    def write(self, value: str) -> str:
+        return value
+
+
 class CSVReport(ABC):
     configuration_form_class: ClassVar[Type[CSVReportForm]] = CSVReportForm
     header_rows: ClassVar[List[List[str]]] = []
     max_synchronous_rows: ClassVar[int] = 200
     never_async: ClassVar[bool] = False
+    # Items are fetched, prefetched and written this many at a time.
+    chunk_size: ClassVar[int] = 2000
+    prefetch_fields: ClassVar[List[str]] = []
 
     _config_kwargs: ClassVar[Dict[str, Any]]
 
-    _rows: List[List[str]]
-
     def __init__(self, **kwargs: Any):
         self.config_kwargs = kwargs
         self._configure(**kwargs)
 
-    def create_download(self, data: Dict[str, Any], user: User) -> TemporaryDownload:
-        content = self.generate_csv_content(data)
-        dl = TemporaryDownload.objects.create(
+    def create_download(
+            self, data: Dict[str, Any], user: User,
+            progress: Optional[Callable[[int], None]] = None
+    ) -> TemporaryDownload:
+        return TemporaryDownload.create_from_stream(
+            lambda f: self.write_csv(data, f, progress),
             for_user=user,
-            content=content,
             content_type="text/csv",
             filename=self.get_filename(data))
-        return dl
 
-    def create_download_from_raw_data(self, input_data: Dict[str, Any], user: User) -> TemporaryDownload:
+    def create_download_from_raw_data(
+            self, input_data: Dict[str, Any], user: User,
+            progress: Optional[Callable[[int], None]] = None
+    ) -> TemporaryDownload:
         form_kwargs = self.get_configuration_form_kwargs()
         form = self.get_form_class()(input_data, **form_kwargs)
         if not form.is_valid():
             raise Exception("Form was not valid in process_data")
-        return self.create_download(form.cleaned_data, user)
+        return self.create_download(form.cleaned_data, user, progress)
 
     def generate_csv_content(self, data: Dict[str, Any]) -> str:
-        # Create CSV in memory buffer
         buf = io.StringIO()
-        writer = csv.writer(buf)
-        # Write headers + rows
-        for row in self.get_header_rows(data) + self.get_rows(data):
-            writer.writerow(row)
+        self.write_csv(data, buf)
         return buf.getvalue()
 
     def get_async_handle(self) -> str:
@@ -87,21 +97,84 @@ class CSVReport(ABC):
     def get_item_row(self, item: Any) -> List[str]:
         return []
 
+    def get_prefetch_fields(self) -> List[str]:
+        return self.prefetch_fields
+
     def get_queryset(self, data: Dict[str, Any]) -> QuerySet:
         raise Exception("Must supply a get_queryset function!")
 
-    def get_rows(self, data: Dict[str, Any]) -> List[List[str]]:
-        if not hasattr(self, '_rows'):
-            self._rows = list(map(self.get_item_row, self.get_queryset(data)))
-        return self._rows
+    def get_rows(self, data: Dict[str, Any]) -> Iterable[List[str]]:
+        for chunk in self.iter_item_chunks(data):
+            for item in chunk:
+                yield self.get_item_row(item)
+
+    def iter_item_chunks(self, data: Dict[str, Any]) -> Iterator[List[Any]]:
+        """Yields the queryset's items in lists of chunk_size, with their
+        prefetches done per list, so the whole queryset is never loaded at
+        once."""
+        queryset = self.get_queryset(data)
+        if not isinstance(queryset, QuerySet):
+            yield list(queryset)
+            return
+        # iterator() skips prefetch_related, so it is done per chunk.
+        lookups = list(queryset._prefetch_related_lookups)
+        lookups.extend(self.get_prefetch_fields())
+        chunk = []
+        for item in queryset.iterator(chunk_size=self.chunk_size):
+            chunk.append(item)
+            if len(chunk) == self.chunk_size:
+                prefetch_related_objects(chunk, *lookups)
+                yield chunk
+                chunk = []
+        if chunk:
+            prefetch_related_objects(chunk, *lookups)
+            yield chunk
 
     def should_run_async(self, data: Dict[str, Any]) -> bool:
         if self.never_async:
             return False
-        if self.get_queryset(data).count() > self.max_synchronous_rows:
+        queryset = self.get_queryset(data)
+        limit = self.max_synchronous_rows
+        if isinstance(queryset, QuerySet):
+            # Only count as far as the limit.
+            count = queryset[:limit + 1].count()
+        else:
+            count = len(queryset)
+        if count > limit:
             return True
         return data.get('run_async', False)
 
+    def streaming_response(self, data: Dict[str, Any]) -> StreamingHttpResponse:
+        """Returns a response that writes the report as it is sent."""
+        writer = csv.writer(_Echo())
+        rows = self.iter_csv_rows(data)
+        response = StreamingHttpResponse(
+            (writer.writerow(row) for row in rows), content_type="text/csv")
+        response['Content-Disposition'] = 'attachment; filename="{}"'.format(
+            self.get_filename(data))
+        return response
+
+    def iter_csv_rows(self, data: Dict[str, Any]) -> Iterator[List[str]]:
+        yield from self.get_header_rows(data)
+        yield from self.get_rows(data)
+
+    def write_csv(
+            self, data: Dict[str, Any], f: IO[str],
+            progress: Optional[Callable[[int], None]] = None) -> int:
+        """Writes the report to a text file, calling progress with the
+        number of rows written every chunk_size rows.  Returns the number of
+        rows written."""
+        writer = csv.writer(f)
+        written = 0
+        for row in self.iter_csv_rows(data):
+            writer.writerow(row)
+            written += 1
+            if progress is not None and written % self.chunk_size == 0:
+                progress(written)
+        if progress is not None:
+            progress(written)
+        return written
+
     def run_async(self, user: User, form_data: Dict[str, Any]) -> AsyncResult:
         async_handle = self.get_async_handle()
         if grc_async(async_handle) is None:
@@ -119,12 +192,17 @@ class CSVReportView(GenesisFormView):
     success_message: ClassVar[str] = "Your report has been generated."
     report_class: ClassVar[Type[CSVReport]]
     run_async: ClassVar[bool] = False
+    # Send synchronous reports straight back as they are written, instead
+    # of redirecting to a saved download.
+    stream_synchronous: ClassVar[bool] = False
 
     def form_valid(self, form: CSVReportForm) -> HttpResponse:
         report = self._get_report()
         redirect_kwargs = {'go_back_until': self.go_back_until}
         if report.should_run_async(form.cleaned_data):
             report.run_async(self.request.user, self._get_post_data())
+        elif self.stream_synchronous:
+            return report.streaming_response(self._get_report_data(form))
         else:
             dl = report.create_download(
                 self._get_report_data(form), self.request.user)
@@ -1,21 +1,91 @@
 import json
+import logging
+import time
 
+from contextlib import contextmanager
 from datetime import datetime, date
+from functools import lru_cache
 from urllib.parse import urlencode
 
 from django.conf import settings
 from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
 from django.urls import reverse
-from django.db.models import FieldDoesNotExist, Q
+from django.db import connection
+from django.db.models import FieldDoesNotExist
 from django.db.models.fields.related import ForeignObjectRel, ManyToOneRel
 from django.http import Http404, HttpResponse
-from django.template import Context, Template
 from django.template.loader import get_template, render_to_string
+from django.utils.html import format_html
 
 from genesishealth.apps.utils.exceptions import ConditionNotMetException
 from genesishealth.apps.utils.func import (
     convert_render_datetime, get_attribute)
 from genesishealth.apps.utils.class_views.auth_base import AuthTemplateView
+from genesishealth.apps.utils.table_search import (
+    IcontainsSearchBackend, KeysetPaginator, estimate_count)
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def get_cell_template(template_name):
+    """Loads a cell template once per process rather than once per
+    cell."""
+    return get_template(template_name)
+
+
+def get_relation_paths(model, attribute_name):
+    """Returns the select_related and prefetch_related paths for the
+    relations a dotted attribute name walks through on the model, up to the
+    first part that isn't a relation (e.g. a method)."""
+    select_related = []
+    prefetch_related = []
+    path = []
+    many = False
+    for name in attribute_name.lstrip('!').split('.'):
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            break
+        if not field.is_relation or field.related_model is None:
+            break
+        path.append(name)
+        many = many or field.many_to_many or field.one_to_many
+        if many:
+            prefetch_related.append('__'.join(path))
+        else:
+            select_related.append('__'.join(path))
+        model = field.related_model
+    return select_related, prefetch_related
+
+
+class RenderProfile(object):
+    """Records the queries and time spent rendering each column of a
+    table."""
+    def __init__(self):
+        self.columns = {}
+        self._current = None
+
+    def __call__(self, execute, sql, params, many, context):
+        if self._current is not None:
+            self._current['queries'] += 1
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def measure(self, name):
+        stats = self.columns.setdefault(name, {'queries': 0, 'ms': 0.0})
+        self._current = stats
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats['ms'] += (time.perf_counter() - start) * 1000
+            self._current = None
+
+    def format(self):
+        return ', '.join(
+            '%s: %d queries, %.1fms' % (name, stats['queries'], stats['ms'])
+            for name, stats in self.columns.items())
 
 
 class GenesisBaseAboveTableItem(object):
@@ -174,9 +244,12 @@ class BaseTableColumn(object):
     def __init__(self,
                  name, cell_class=None, searchable=True,
                  sortable=True, hide_for_user_types=None,
-                 default_sort=None, default_sort_direction='asc'):
+                 default_sort=None, default_sort_direction='asc',
+                 required_relations=None):
         if hide_for_user_types is None:
             hide_for_user_types = []
+        if required_relations is None:
+            required_relations = []
         self.name = name
         self.cell_class = cell_class
         self.searchable = searchable
@@ -184,11 +257,18 @@ class BaseTableColumn(object):
         self.hide_for_user_types = hide_for_user_types
         self.default_sort = default_sort
         self.default_sort_direction = default_sort_direction
+        # Dotted paths of relations the cells use, beyond those derived from
+        # the column's attributes.
+        self.required_relations = required_relations
 
     def available_to_user(self, user):
         user_type = user.get_user_type()
         return user_type not in self.hide_for_user_types
 
+    def get_attribute_names(self):
+        """The dotted attribute names the column reads from each row."""
+        return list(self.required_relations)
+
     def render_cell(self, obj, user):
         content = self.get_content(obj, user)
         return GenesisTableCell(
@@ -218,6 +298,10 @@ class AttributeTableColumn(BaseTableColumn):
         self.string_format = string_format
         self.proxy_field = proxy_field
 
+    def get_attribute_names(self):
+        names = super(AttributeTableColumn, self).get_attribute_names()
+        return names + [self.attribute_name]
+
     def get_column_name(self):
         if self.proxy_field:
             return self.proxy_field
@@ -271,6 +355,18 @@ class ActionItem(object):
         self.link_href = link_href
         self.link_data_attrs = link_data_attrs
 
+    def get_attribute_names(self):
+        names = []
+        if self.condition:
+            names.extend(self.condition)
+        if self.link_data_attrs:
+            names.extend(obj_key for _, obj_key in self.link_data_attrs)
+        if self.link is not None:
+            names.extend(
+                arg.attribute_name for arg in self.link.url_args
+                if isinstance(arg, GenesisTableLinkAttrArg))
+        return names
+
     def render_button(self, obj, user):
         data_attrs = []
         if self.link_href:
@@ -330,22 +426,27 @@ class ActionItem(object):
 
 
 class ActionTableColumn(BaseTableColumn):
+    template_name = 'utils/generic_table_templates/action_buttons.html'
+
     def __init__(self, name, actions, **kwargs):
         kwargs.setdefault('sortable', False)
         kwargs.setdefault('searchable', False)
         super(ActionTableColumn, self).__init__(name, **kwargs)
         self.actions = actions
 
+    def get_attribute_names(self):
+        names = super(ActionTableColumn, self).get_attribute_names()
+        for action in self.actions:
+            names.extend(action.get_attribute_names())
+        return names
+
     def get_content(self, obj, user):
         buttons = []
         for action in self.actions:
             if action.should_render(obj, user):
                 buttons.append(action.render_button(obj, user))
-        out = render_to_string(
-            'utils/generic_table_templates/action_buttons.html',
-            {'buttons': buttons}
-        )
-        return out
+        return get_cell_template(self.template_name).render(
+            {'buttons': buttons})
 
     def parse(self, action, user, obj=None, prefix=settings.DASHBOARD_PREFIX):
         assert self.available_to_user(user)
@@ -438,6 +539,11 @@ class GenesisSingleTableBase(GenesisTableBase):
     skip_ajax_sort = False
     ajax_limit = 1000
     focus_on_load = True
+    # Use the planner's row estimates rather than exact counts.
+    estimated_count = False
+    # Page with KeysetPaginator when the sort allows it.
+    keyset_pagination = False
+    search_backend = IcontainsSearchBackend()
 
     def __init__(self, parent=None, request=None, view_kwargs=None):
         self._parent = parent
@@ -458,27 +564,49 @@ class GenesisSingleTableBase(GenesisTableBase):
         for column in columns:
             self.add_column(column)
 
+    def count_queryset(self, queryset):
+        if self.estimated_count:
+            return estimate_count(queryset)
+        return queryset.count()
+
     def create_columns(self):
         return []
 
     def generate_batch_select_box(self, obj):
-        template = Template(
-            """<input type="checkbox" name="batch_{{ obj.id }}" class="batchSelectBox" />""")  # noqa
-        content = template.render(Context({'obj': obj}))
+        content = format_html(
+            '<input type="checkbox" name="batch_{}" class="batchSelectBox" />',
+            obj.id)
         return GenesisTableCell(content)
 
-    def generate_rows(self, queryset=None):
+    def generate_rows(self, queryset=None, profile=None):
+        """Renders the cells of each row.  If a RenderProfile is given, the
+        queries and time spent on each column are recorded in it."""
         if queryset is None:
-            queryset = self.get_queryset()
+            queryset = self.with_required_relations(self.get_queryset())
+        if profile is None:
+            return self._generate_rows(queryset)
+        with connection.execute_wrapper(profile):
+            return self._generate_rows(queryset, profile)
+
+    def _generate_rows(self, queryset, profile=None):
+        if profile is not None:
+            with profile.measure('(rows)'):
+                queryset = list(queryset)
         rows = []
         user = self.get_user()
+        is_batch = self.is_batch()
+        columns = [column for column in self.get_columns()
+                   if column.available_to_user(user)]
         for obj in queryset:
             cells = []
-            if self.is_batch():
+            if is_batch:
                 cells.append(self.generate_batch_select_box(obj))
-            for column in self.get_columns():
-                if column.available_to_user(user):
+            for column in columns:
+                if profile is None:
                     cells.append(column.render_cell(obj, user))
+                else:
+                    with profile.measure(column.name):
+                        cells.append(column.render_cell(obj, user))
             rows.append(cells)
         return rows
 
@@ -499,7 +627,7 @@ class GenesisSingleTableBase(GenesisTableBase):
         if self.fake_count:
             total_count = 10000
         else:
-            total_count = queryset.count()
+            total_count = self.count_queryset(queryset)
 
         json_data = {
             'aaData': [],
@@ -579,22 +707,12 @@ class GenesisSingleTableBase(GenesisTableBase):
             ])
         # Handle searching.
         if len(search_terms) > 0:
-            queries = []
-            for term in search_terms:
-                query = None
-                for column_name, column, column_index in queryable_columns:
-                    search_key = "{}__icontains".format(column_name)
-                    new_q = Q(**{search_key: term})
-                    if query is None:
-                        query = new_q
-                    else:
-                        query |= new_q
-                if query is not None:
-                    queries.append(query)
-            if len(queries) > 0:
-                filtered_queryset = filtered_queryset.filter(*queries).distinct()
+            filtered_queryset = self.get_search_backend().filter(
+                filtered_queryset, search_terms,
+                [column_name for column_name, _, _ in queryable_columns])
             if not self.fake_count:
-                json_data['iTotalDisplayRecords'] = filtered_queryset.count()
+                json_data['iTotalDisplayRecords'] = self.count_queryset(
+                    filtered_queryset)
         # Handle sorting.
         # First figure out which columns we are sorting.
         sort_indices = []
@@ -629,29 +747,42 @@ class GenesisSingleTableBase(GenesisTableBase):
             filtered_queryset = filtered_queryset.order_by(*sort_terms)
         if do_distinct:
             filtered_queryset = filtered_queryset.distinct()
-        if ajax_limit:
-            filtered_queryset = filtered_queryset[:ajax_limit]
         # Pagination
         page_limit = int(request.GET.get('iDisplayLength', 10))
-        page = (int(request.GET.get('iDisplayStart', 0)) / page_limit) + 1
-        prefetch_fields = self.get_prefetch_fields()
-        paginator = Paginator(
-            filtered_queryset.prefetch_related(*prefetch_fields),
-            page_limit
-        )
-        # HACK: Makes paginator not check length of QS which is useful for
-        # large queries.
-        if self.fake_count:
-            paginator._count = ajax_limit
-        try:
-            items = paginator.page(page)
-        except PageNotAnInteger:
-            items = paginator.page(1)
-        except EmptyPage:
-            raise Http404
+        filtered_queryset = self.with_required_relations(filtered_queryset)
+        if (self.keyset_pagination and not self.skip_ajax_sort and
+                KeysetPaginator.supports(queryset.model, sort_terms)):
+            offset = int(request.GET.get('iDisplayStart', 0))
+            if ajax_limit:
+                if offset and offset >= ajax_limit:
+                    raise Http404
+                page_limit = min(page_limit, ajax_limit - offset)
+            qs = KeysetPaginator(filtered_queryset, sort_terms).get_page(
+                offset, page_limit)
+        else:
+            if ajax_limit:
+                filtered_queryset = filtered_queryset[:ajax_limit]
+            page = (int(request.GET.get('iDisplayStart', 0)) / page_limit) + 1
+            paginator = Paginator(filtered_queryset, page_limit)
+            # HACK: Makes paginator not check length of QS which is useful for
+            # large queries.
+            if self.fake_count:
+                paginator._count = ajax_limit
+            try:
+                items = paginator.page(page)
+            except PageNotAnInteger:
+                items = paginator.page(1)
+            except EmptyPage:
+                raise Http404
+            qs = items.object_list
         # Render cell content
-        qs = items.object_list
-        rows = self.generate_rows(qs)
+        if self.should_profile_render(request):
+            profile = RenderProfile()
+            rows = self.generate_rows(qs, profile=profile)
+            logger.info('Rendered %s: %s', type(self).__name__, profile.format())
+            json_data['renderProfile'] = profile.columns
+        else:
+            rows = self.generate_rows(qs)
         for row in rows:
             row_data = []
             for cell in row:
@@ -739,6 +870,26 @@ class GenesisSingleTableBase(GenesisTableBase):
         if self._parent is not None:
             return self._parent.request
 
+    def get_required_relations(self, queryset):
+        """Returns the select_related and prefetch_related paths needed to
+        render the columns without a query per row."""
+        select_related = set()
+        prefetch_related = set()
+        for column in self.get_columns():
+            for attribute_name in column.get_attribute_names():
+                selected, prefetched = get_relation_paths(
+                    queryset.model, attribute_name)
+                select_related.update(selected)
+                prefetch_related.update(prefetched)
+        # Joined columns would make DISTINCT compare whole related rows.
+        if queryset.query.distinct:
+            prefetch_related.update(select_related)
+            select_related = set()
+        return sorted(select_related), sorted(prefetch_related)
+
+    def get_search_backend(self):
+        return self.search_backend
+
     def get_table_context(self):
         data = {
             'columns': self.get_columns(),
@@ -783,6 +934,22 @@ class GenesisSingleTableBase(GenesisTableBase):
             "utils/generic_table_templates/table_include.html")
         return template.render(context)
 
+    def should_profile_render(self, request):
+        """Whether to include a RenderProfile in the AJAX response; admins
+        can ask for one with renderProfile=1."""
+        if settings.TABLE_RENDER_PROFILE:
+            return True
+        return (request.GET.get('renderProfile') == '1' and
+                request.user.is_authenticated and request.user.is_admin())
+
+    def with_required_relations(self, queryset):
+        select_related, prefetch_related = self.get_required_relations(
+            queryset)
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        return queryset.prefetch_related(
+            *prefetch_related, *self.get_prefetch_fields())
+
 
 class GenesisTableView(AuthTemplateView, GenesisSingleTableBase):
     template_name = 'utils/generic_table_templates/base.html'
@@ -1,17 +1,12 @@
-import subprocess
-
 from django.conf import settings
 
-
-def _crypt(data, cmd):
-    po = subprocess.Popen([cmd, str(data), settings.AES_KEY], stdout=subprocess.PIPE)
-    res = po.communicate()
-    return res[0]
+from genesishealth.external.middleman import parse
 
 
 def decrypt(data):
-    return _crypt(data, 'decrypt')
+    code, value = parse.decrypt(str(data), settings.AES_KEY)
+    return value.encode('ascii')
 
 
 def encrypt(data):
-    return _crypt(data, 'encrypt')
+    return parse.encrypt(data, settings.AES_KEY).encode('ascii')
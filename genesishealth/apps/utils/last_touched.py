@@ -0,0 +1,96 @@
+"""Write-behind tracking of profiles' last_touched.
+
+Requests record the time in a per-process buffer instead of saving the
+profile.  A user is recorded at most once every
+settings.LAST_TOUCHED_INTERVAL seconds, and the buffer is written out by
+the process that holds it, at most every settings.LAST_TOUCHED_FLUSH_INTERVAL
+seconds, with one UPDATE ... FROM (VALUES ...) per profile table and batch.
+A process that exits loses at most its unflushed times; last_touched only
+needs to be accurate to within LOGGED_IN_TIME.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.utils.timezone import now
+
+logger = logging.getLogger(__name__)
+
+
+def write_last_touched(touched, batch_size=500):
+    """Sets last_touched for {user id: datetime}, on whichever profile each
+    user has.  Times never move backwards."""
+    from genesishealth.apps.accounts.models import (
+        PatientProfile, ProfessionalProfile)
+    items = sorted(touched.items())
+    with connection.cursor() as cursor:
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            values = ', '.join(['(%s, %s::timestamptz)'] * len(batch))
+            params = [value for item in batch for value in item]
+            for model in (PatientProfile, ProfessionalProfile):
+                cursor.execute(
+                    'UPDATE {0} AS p SET last_touched = v.last_touched '
+                    'FROM (VALUES {1}) AS v (user_id, last_touched) '
+                    'WHERE p.user_id = v.user_id AND (p.last_touched IS NULL '
+                    'OR p.last_touched < v.last_touched)'.format(
+                        model._meta.db_table, values),
+                    params)
+
+
+class LastTouchedBuffer(object):
+    def __init__(self, interval, flush_interval, clock=time.monotonic):
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self._lock = threading.Lock()
+        # User id to the clock time they were last recorded.
+        self._recorded = {}
+        self._pending = {}
+        self._last_flush = self.clock()
+        self.records = 0
+        self.flushes = 0
+
+    def record(self, user_id):
+        """Records activity for the user and flushes the buffer if it is
+        due."""
+        current = self.clock()
+        with self._lock:
+            recorded = self._recorded.get(user_id)
+            if recorded is None or current - recorded >= self.interval:
+                self._recorded[user_id] = current
+                self._pending[user_id] = now()
+                self.records += 1
+            due = (self._pending and
+                   current - self._last_flush >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = self.clock()
+            # Forget users who have been idle, so the map stays small.
+            cutoff = self._last_flush - self.interval
+            self._recorded = dict(
+                (user_id, recorded)
+                for user_id, recorded in self._recorded.items()
+                if recorded > cutoff)
+        if not pending:
+            return
+        try:
+            write_last_touched(pending)
+        except Exception:
+            logger.exception(
+                'Could not write last_touched for %d users.', len(pending))
+            with self._lock:
+                for user_id, touched in pending.items():
+                    self._pending.setdefault(user_id, touched)
+        else:
+            self.flushes += 1
+
+
+last_touched_buffer = LastTouchedBuffer(
+    settings.LAST_TOUCHED_INTERVAL, settings.LAST_TOUCHED_FLUSH_INTERVAL)
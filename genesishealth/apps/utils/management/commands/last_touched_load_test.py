@@ -0,0 +1,109 @@
+"""Compares the database writes LastTouchedMiddleware makes for a stream of
+page views with the original middleware, which saved the user's profile on
+every request.
+
+Page views from --users patients are spread evenly over --minutes of
+simulated time and passed through each middleware.  The write-behind buffer
+runs on the simulated clock, with the configured intervals, and is flushed
+at the end.  The patients are created inside a transaction that is rolled
+back afterwards."""
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from genesishealth.apps.accounts.models import Contact, PatientProfile
+from genesishealth.apps.utils import middleware
+from genesishealth.apps.utils.func import utcnow
+from genesishealth.apps.utils.last_touched import LastTouchedBuffer
+
+
+class LegacyLastTouchedMiddleware(middleware.LastTouchedMiddleware):
+    def process_request(self, request):
+        try:
+            profile = request.user.get_profile()
+        except (Exception, AttributeError):
+            pass
+        else:
+            profile.last_touched = utcnow()
+            profile.save()
+
+
+class SimulatedClock(object):
+    def __init__(self):
+        self.time = 0.
+
+    def __call__(self):
+        return self.time
+
+
+class Command(BaseCommand):
+    help = 'Load tests last_touched tracking.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--views', type=int, default=5000)
+        parser.add_argument('--minutes', type=int, default=30)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            users = self.create_users(options['users'])
+            views = options['views']
+            step = options['minutes'] * 60. / views
+            self.run('original', LegacyLastTouchedMiddleware(), users, views)
+
+            clock = SimulatedClock()
+            buffer = LastTouchedBuffer(
+                settings.LAST_TOUCHED_INTERVAL,
+                settings.LAST_TOUCHED_FLUSH_INTERVAL, clock)
+            original_buffer = middleware.last_touched_buffer
+            middleware.last_touched_buffer = buffer
+            try:
+                self.run('write-behind', middleware.LastTouchedMiddleware(),
+                         users, views, clock, step, buffer.flush)
+            finally:
+                middleware.last_touched_buffer = original_buffer
+            self.stdout.write('  %d times recorded in %d flushes' % (
+                buffer.records, buffer.flushes))
+            transaction.set_rollback(True)
+
+    def create_users(self, count):
+        users = User.objects.bulk_create([
+            User(username='last-touched-load-test-%d' % i)
+            for i in range(count)])
+        contacts = Contact.objects.bulk_create([
+            Contact() for i in range(count)])
+        PatientProfile.objects.bulk_create([
+            PatientProfile(user=user, contact=contact)
+            for user, contact in zip(users, contacts)])
+        return list(User.objects.filter(
+            pk__in=[user.pk for user in users]))
+
+    def run(self, name, instance, users, views, clock=None, step=0,
+            finish=None):
+        factory = RequestFactory()
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            for i in range(views):
+                if clock is not None:
+                    clock.time = i * step
+                request = factory.get('/')
+                # A fresh user object per request, as the auth middleware
+                # would load.
+                request.user = User.objects.get(pk=users[i % len(users)].pk)
+                instance.process_request(request)
+            if finish is not None:
+                finish()
+        elapsed = time.perf_counter() - start
+        writes = len([
+            query for query in queries.captured_queries
+            if query['sql'].lstrip().upper().startswith('UPDATE')])
+        self.stdout.write(
+            '%s: %d queries, %d writes for %d page views '
+            '(%.3f writes per view), %.2fs' % (
+                name, len(queries), writes, views, float(writes) / views,
+                elapsed))
@@ -0,0 +1,43 @@
+"""Refreshes the trigger-maintained search_document columns that table
+searches use (see genesishealth.apps.utils.table_search).
+
+Run after migrating, for the rows saved before the trigger existed, and
+after changing what a trigger puts in the document.  Rows are touched in
+primary key ranges, so this is safe to run while rows are being written."""
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, Max
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds table search documents.'
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            'models', nargs='*',
+            help='Models to rebuild, as app_label.ModelName.  Defaults to '
+                 'every model with a search document.')
+        parser.add_argument('--chunk-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        if options['models']:
+            try:
+                models = [apps.get_model(label) for label in options['models']]
+            except (LookupError, ValueError) as e:
+                raise CommandError(str(e))
+        else:
+            models = [
+                model for model in apps.get_models()
+                if any(field.name == 'search_document'
+                       for field in model._meta.concrete_fields)]
+        chunk_size = options['chunk_size']
+        for model in models:
+            max_pk = model.objects.aggregate(max_pk=Max('pk'))['max_pk'] or 0
+            updated = 0
+            for start in range(0, max_pk, chunk_size):
+                # Updating the column to itself fires the trigger.
+                updated += model.objects.filter(
+                    pk__gt=start, pk__lte=start + chunk_size
+                ).update(search_document=F('search_document'))
+            self.stdout.write('%s: rebuilt %d search documents.' % (
+                model._meta.label, updated))
@@ -0,0 +1,139 @@
+"""Counts the queries made to work out a user's type and profile over a
+simulated request, with the original User role methods and with the
+memoized ones.
+
+Each request loads the user afresh, as the authentication middleware does,
+runs SecurityRedirectMiddleware and then checks --columns table columns
+against the user for each of --rows rows, as the table views do through
+BaseTableColumn.available_to_user."""
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from genesishealth.apps.accounts.models import AdminProfile
+from genesishealth.apps.utils.middleware import SecurityRedirectMiddleware
+from genesishealth.apps.utils.roles import (
+    PROFILE_MODELS, get_role_lookups, reset_role_lookups)
+
+
+def get_profile_legacy(self):
+    for clsName in (
+            'patient_profile',
+            'professional_profile',
+            'demo_profile'):
+        try:
+            profile = getattr(self, clsName)
+        except:
+            pass
+        else:
+            return profile
+
+    raise Exception("Profile not found for user: %s" % self)
+
+
+def is_admin_legacy(self):
+    try:
+        self.admin_profile
+    except:
+        return False
+    return True
+
+
+def is_professional_legacy(self):
+    try:
+        assert not self.is_admin()
+        self.professional_profile
+    except:
+        return False
+    return True
+
+
+def is_patient_legacy(self):
+    try:
+        assert not self.is_admin()
+        self.patient_profile
+    except:
+        return False
+    return True
+
+
+def get_user_type_legacy(self):
+    for name in ('patient', 'professional', 'admin'):
+        if hasattr(self, 'is_%s' % name):
+            fn = getattr(self, 'is_%s' % name)
+            if fn():
+                return name
+    return 'unknown'
+
+
+LEGACY_METHODS = {
+    'get_profile': get_profile_legacy,
+    'is_admin': is_admin_legacy,
+    'is_professional': is_professional_legacy,
+    'is_patient': is_patient_legacy,
+    'get_user_type': get_user_type_legacy,
+}
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks user role lookups per request.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--columns', type=int, default=10)
+        parser.add_argument('--rows', type=int, default=50)
+        parser.add_argument('--requests', type=int, default=20)
+
+    def handle(self, *args, **options):
+        from django.apps import apps
+        profile_tables = [
+            apps.get_model(model)._meta.db_table for model in PROFILE_MODELS]
+        users = [
+            ('patient', User.objects.filter(
+                patient_profile__isnull=False).first()),
+            ('professional', User.objects.filter(
+                professional_profile__isnull=False).first()),
+            ('admin', User.objects.filter(
+                pk__in=AdminProfile.objects.values('user')).first()),
+        ]
+        memoized = dict((name, getattr(User, name)) for name in LEGACY_METHODS)
+        for label, methods in (('original', LEGACY_METHODS),
+                               ('memoized', memoized)):
+            for name, method in methods.items():
+                setattr(User, name, method)
+            try:
+                self.stdout.write('%s:' % label)
+                for user_type, user in users:
+                    if user is None:
+                        continue
+                    self.run(user_type, user.pk, profile_tables, options)
+            finally:
+                for name, method in memoized.items():
+                    setattr(User, name, method)
+
+    def run(self, user_type, user_id, profile_tables, options):
+        factory = RequestFactory()
+        middleware = SecurityRedirectMiddleware()
+        reset_role_lookups()
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            for i in range(options['requests']):
+                request = factory.get('/')
+                request.user = User.objects.get(pk=user_id)
+                middleware.process_request(request)
+                for row in range(options['rows']):
+                    for column in range(options['columns']):
+                        request.user.get_user_type()
+        elapsed = time.perf_counter() - start
+        profile_queries = len([
+            query for query in queries.captured_queries
+            if any(table in query['sql'] for table in profile_tables)])
+        self.stdout.write(
+            '  %s: %.1f profile queries and %.1f role lookups per request, '
+            '%.2fms per request' % (
+                user_type, float(profile_queries) / options['requests'],
+                float(get_role_lookups()) / options['requests'],
+                elapsed * 1000 / options['requests']))
@@ -0,0 +1,106 @@
+"""Compares the transmission log table's AJAX responses with the original
+icontains search and OFFSET paging against the search document, estimated
+counts and keyset paging.
+
+The log entries are inserted inside a transaction that is rolled back
+afterwards.  They are generated in SQL, since building a million model
+instances would take longer than the benchmark."""
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+
+from genesishealth.apps.gdrives.models import GDriveTransmissionLogEntry
+from genesishealth.apps.logs.views.reading import TransmissionLogTableView
+from genesishealth.apps.utils.table_search import IcontainsSearchBackend
+
+INSERT_SQL = """
+INSERT INTO gdrives_gdrivetransmissionlogentry (
+    datetime, content, decrypted_content, error, processing_succeeded,
+    success_sent_to_client, reading_server, recovered, meid, resolution,
+    sent_to_api, received_by_api, hide_from_qa_log, hide_from_orphaned_log,
+    search_document)
+SELECT
+    %s - n * interval '1 second',
+    'benchmark',
+    '{''meid'': ''' || lpad(n::text, 15, '0') || ''', ''value1'': ' ||
+        (n %% 400) || '}',
+    CASE WHEN n %% 100 = 0 THEN 'Unknown device.' ELSE '' END,
+    n %% 100 <> 0, n %% 100 <> 0, 'server-' || (n %% 5), false,
+    lpad(n::text, 15, '0'), 'unresolved', false, false, false, false, ''
+FROM generate_series(1, %s) AS n
+"""
+
+
+class LegacyTransmissionLogTableView(TransmissionLogTableView):
+    fake_count = True
+    estimated_count = False
+    keyset_pagination = False
+    search_backend = IcontainsSearchBackend()
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks table search and paging on a large transmission log.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000)
+        parser.add_argument(
+            '--pages', type=int, default=20,
+            help='How many pages to step through one at a time.')
+        parser.add_argument(
+            '--term', action='append', dest='terms',
+            help='Search to time.  Defaults to a common, a rare and a '
+                 'missing term.')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(admin_profile__isnull=False).first()
+        if user is None:
+            raise CommandError('An admin user is needed to render the table.')
+        terms = options['terms'] or [
+            'server-3', '%015d' % (options['rows'] // 2), 'nomatch']
+        with transaction.atomic():
+            start = time.perf_counter()
+            with connection.cursor() as cursor:
+                cursor.execute(INSERT_SQL, [now(), options['rows']])
+                cursor.execute('ANALYZE gdrives_gdrivetransmissionlogentry')
+            self.stdout.write('Created %d log entries in %.2fs.' % (
+                options['rows'], time.perf_counter() - start))
+            total = GDriveTransmissionLogEntry.objects.count()
+            self.stdout.write('The table has %d entries.' % total)
+            for name, view_class in (
+                    ('original', LegacyTransmissionLogTableView),
+                    ('search document', TransmissionLogTableView)):
+                self.stdout.write('%s:' % name)
+                cache.clear()
+                self.run(view_class, user, 'first page')
+                for page in range(options['pages']):
+                    self.run(
+                        view_class, user, 'page %d' % (page + 1),
+                        iDisplayStart=page * 10,
+                        quiet=page < options['pages'] - 1)
+                for term in terms:
+                    self.run(
+                        view_class, user, 'search "%s"' % term, sSearch=term)
+            transaction.set_rollback(True)
+
+    def run(self, view_class, user, name, quiet=False, **params):
+        params.setdefault('iDisplayStart', 0)
+        params.update({
+            'ajax': '1', 'iDisplayLength': 10,
+            'iSortCol_0': 0, 'sSortDir_0': 'desc'})
+        request = RequestFactory().get('/', params)
+        request.user = user
+        view = view_class()
+        view.request = request
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            view.get_ajax_response(request)
+            elapsed = time.perf_counter() - start
+        if not quiet:
+            self.stdout.write('  %s: %.3fs, %d queries' % (
+                name, elapsed, len(queries)))
@@ -7,7 +7,7 @@ from django.http import HttpResponse, HttpResponseRedirect
 from django.utils.deprecation import MiddlewareMixin
 from django.utils.timezone import now
 
-from genesishealth.apps.utils.func import utcnow
+from genesishealth.apps.utils.last_touched import last_touched_buffer
 
 
 class SessionHistory(object):
@@ -80,13 +80,9 @@ class StoreSessionHistoryMiddleware(MiddlewareMixin):
 
 class LastTouchedMiddleware(MiddlewareMixin):
     def process_request(self, request):
-        try:
-            profile = request.user.get_profile()
-        except (Exception, AttributeError):
-            pass
-        else:
-            profile.last_touched = utcnow()
-            profile.save()
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            last_touched_buffer.record(user.pk)
 
 
 def should_check_password(user):
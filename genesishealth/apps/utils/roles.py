@@ -0,0 +1,130 @@
+"""Resolution of a user's type and profile.
+
+The first of the role methods added to User (see AuthAppConfig) to be
+called on a user object loads all of the user's profile relations in one
+query, and the result is memoized on that object.  Saving or deleting a
+profile clears the memo of the user object it is attached to; other user
+objects, such as the one loaded for the next request, resolve afresh.
+"""
+import threading
+
+from django.db.models.signals import post_delete, post_save
+
+PROFILE_RELATIONS = (
+    'admin_profile', 'patient_profile', 'professional_profile',
+    'demo_profile')
+PROFILE_MODELS = (
+    'accounts.AdminProfile', 'accounts.PatientProfile',
+    'accounts.ProfessionalProfile', 'accounts.DemoPatientProfile')
+ROLE_ATTRIBUTE = '_role'
+
+_counter = threading.local()
+
+
+def get_role_lookups():
+    """The number of queries made to resolve roles in this thread."""
+    return getattr(_counter, 'lookups', 0)
+
+
+def reset_role_lookups():
+    _counter.lookups = 0
+
+
+class Role(object):
+    def __init__(self, profiles):
+        self.profiles = profiles
+
+    @property
+    def is_admin(self):
+        return self.profiles['admin_profile'] is not None
+
+    @property
+    def is_patient(self):
+        return (not self.is_admin and
+                self.profiles['patient_profile'] is not None)
+
+    @property
+    def is_professional(self):
+        return (not self.is_admin and
+                self.profiles['professional_profile'] is not None)
+
+    @property
+    def user_type(self):
+        if self.is_patient:
+            return 'patient'
+        if self.is_professional:
+            return 'professional'
+        if self.is_admin:
+            return 'admin'
+        return 'unknown'
+
+    @property
+    def profile(self):
+        for name in ('patient_profile', 'professional_profile',
+                     'demo_profile'):
+            if self.profiles[name] is not None:
+                return self.profiles[name]
+
+
+def load_profiles(user):
+    """Returns {relation name: profile or None} for the user, loading the
+    relations that are not already cached on it in one query."""
+    profiles = {}
+    missing = []
+    for name in PROFILE_RELATIONS:
+        relation = user._meta.get_field(name)
+        if relation.is_cached(user):
+            profiles[name] = relation.get_cached_value(user)
+        else:
+            missing.append(name)
+    if not missing:
+        return profiles
+    loaded = None
+    if user.pk is not None:
+        _counter.lookups = get_role_lookups() + 1
+        loaded = type(user)._default_manager.select_related(
+            *missing).filter(pk=user.pk).first()
+    for name in missing:
+        relation = user._meta.get_field(name)
+        profile = None
+        if loaded is not None:
+            profile = relation.get_cached_value(loaded, None)
+        relation.set_cached_value(user, profile)
+        if profile is not None:
+            relation.field.set_cached_value(profile, user)
+        profiles[name] = profile
+    return profiles
+
+
+def get_role(user):
+    role = user.__dict__.get(ROLE_ATTRIBUTE)
+    if role is None:
+        role = user.__dict__[ROLE_ATTRIBUTE] = Role(load_profiles(user))
+    return role
+
+
+def clear_role(user):
+    user.__dict__.pop(ROLE_ATTRIBUTE, None)
+
+
+def profile_saved(sender, instance, **kwargs):
+    user_field = sender._meta.get_field('user')
+    if user_field.is_cached(instance):
+        user = user_field.get_cached_value(instance)
+        if user is not None:
+            clear_role(user)
+
+
+def profile_deleted(sender, instance, **kwargs):
+    user_field = sender._meta.get_field('user')
+    if user_field.is_cached(instance):
+        user = user_field.get_cached_value(instance)
+        if user is not None:
+            clear_role(user)
+            if user_field.remote_field.is_cached(user):
+                user_field.remote_field.delete_cached_value(user)
+
+
+for model in PROFILE_MODELS:
+    post_save.connect(profile_saved, sender=model)
+    post_delete.connect(profile_deleted, sender=model)
@@ -0,0 +1,150 @@
+"""Search, count and pagination strategies for the AJAX responses of
+GenesisSingleTableBase.
+
+IcontainsSearchBackend is the original search: every term has to match one
+of the table's searchable columns with icontains.  SearchDocumentBackend
+matches the terms against a lowercased search_document column instead.
+The column is kept up to date by a database trigger (so bulk_create and
+update() are covered too) and indexed with a pg_trgm GIN index, which lets
+Postgres answer substring matches without scanning the table.  See the
+gdrives log entry models for an example.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import F, FieldDoesNotExist, Q
+
+
+class IcontainsSearchBackend(object):
+    def filter(self, queryset, terms, column_names):
+        queries = []
+        for term in terms:
+            query = None
+            for column_name in column_names:
+                new_q = Q(**{'{}__icontains'.format(column_name): term})
+                if query is None:
+                    query = new_q
+                else:
+                    query |= new_q
+            if query is not None:
+                queries.append(query)
+        if len(queries) > 0:
+            queryset = queryset.filter(*queries).distinct()
+        return queryset
+
+
+class SearchDocumentBackend(object):
+    """Searches a trigger-maintained document column.  The trigger has to
+    include the table's searchable columns; column_names is ignored."""
+    def __init__(self, field_name='search_document'):
+        self.field_name = field_name
+
+    def filter(self, queryset, terms, column_names):
+        lookup = '{}__contains'.format(self.field_name)
+        for term in terms:
+            queryset = queryset.filter(**{lookup: term.lower()})
+        return queryset
+
+
+def estimate_count(queryset):
+    """Returns the number of rows the planner expects the queryset to
+    return.  Estimates below settings.TABLE_EXACT_COUNT_THRESHOLD are
+    replaced with an exact count, since small counts are cheap and a wrong
+    one is noticeable."""
+    queryset = queryset.order_by()
+    sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    estimate = int(plan[0]['Plan']['Plan Rows'])
+    if estimate < settings.TABLE_EXACT_COUNT_THRESHOLD:
+        return queryset.count()
+    return estimate
+
+
+class KeysetPaginator(object):
+    """Fetches pages of a queryset by seeking past the sort key of the
+    previous page's last row rather than with OFFSET, which makes the
+    database walk through every skipped row.
+
+    DataTables asks for pages by offset, so the last key of every page
+    served is cached for the next request; when there is no cached key for
+    an offset (the cache is per process by default, or the user jumped
+    ahead) the page is fetched with OFFSET as before.  The ordering has to
+    end in a unique field and must not go through nullable fields, since
+    NULLs don't compare; check with supports() first."""
+    key_prefix = 'table-keyset'
+
+    def __init__(self, queryset, ordering, timeout=300):
+        self.queryset = queryset
+        # (field name, descending) pairs.
+        self.ordering = [
+            (term.lstrip('-'), term.startswith('-')) for term in ordering]
+        signature = '%s|%s' % (queryset.query, ','.join(ordering))
+        self.signature = hashlib.md5(signature.encode('utf-8')).hexdigest()
+        self.timeout = timeout
+
+    @staticmethod
+    def supports(model, ordering):
+        for term in ordering:
+            current = model
+            for name in term.lstrip('-').split('__'):
+                if current is None:
+                    return False
+                try:
+                    field = current._meta.get_field(name)
+                except FieldDoesNotExist:
+                    return False
+                if field.null or not field.concrete:
+                    return False
+                current = field.related_model
+            if current is not None:
+                return False
+        return True
+
+    def get_cache_key(self, offset):
+        return '%s:%s:%d' % (self.key_prefix, self.signature, offset)
+
+    def get_seek_query(self, key):
+        # (a, b) after (x, y) is a > x or (a = x and b > y).  The inclusive
+        # bound on the first field is redundant, but lets Postgres start an
+        # index scan there.
+        first_field, first_descending = self.ordering[0]
+        query = None
+        for index, (field, descending) in enumerate(self.ordering):
+            condition = Q(**{'%s__%s' % (
+                field, 'lt' if descending else 'gt'): key[index]})
+            for previous_index, (previous_field, _) in enumerate(
+                    self.ordering[:index]):
+                condition &= Q(**{previous_field: key[previous_index]})
+            if query is None:
+                query = condition
+            else:
+                query |= condition
+        bound = Q(**{'%s__%s' % (
+            first_field, 'lte' if first_descending else 'gte'): key[0]})
+        return bound & query
+
+    def get_page(self, offset, limit):
+        annotations = dict(
+            ('keyset_%d' % index, F(field))
+            for index, (field, _) in enumerate(self.ordering))
+        queryset = self.queryset.annotate(**annotations)
+        key = cache.get(self.get_cache_key(offset)) if offset else None
+        if key is not None:
+            items = list(queryset.filter(self.get_seek_query(key))[:limit])
+        else:
+            items = list(queryset[offset:offset + limit])
+        if items:
+            last = items[-1]
+            cache.set(
+                self.get_cache_key(offset + len(items)),
+                [getattr(last, 'keyset_%d' % index)
+                 for index in range(len(self.ordering))],
+                self.timeout)
+        return items
@@ -239,6 +239,10 @@ STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(VIRTUALENV_DIR, 'var/static')
 MEDIA_URL = '/uploads/'
 MEDIA_ROOT = os.path.join(VIRTUALENV_DIR, 'var/media')
+# Report downloads; kept out of MEDIA_ROOT so they are never served directly
+TEMPORARY_DOWNLOAD_ROOT = os.path.join(VAR_ROOT, 'downloads')
+# Seconds a download file is kept after it was last written or reused
+TEMPORARY_DOWNLOAD_FILE_GRACE = 24 * 60 * 60
 
 ADMIN_MEDIA_PREFIX = '/static/admin/'
 LOG_PATH = os.path.join(VAR_ROOT, 'log')
@@ -405,6 +409,10 @@ MAX_PRINT_LOGBOOK_ENTRIES = 2
 MAX_LOGBOOK_ENTRIES = 50
 
 LOGGED_IN_TIME = 15 * 60
+# Seconds between recordings of a user's last_touched time
+LAST_TOUCHED_INTERVAL = 60
+# Seconds each process buffers last_touched times before writing them
+LAST_TOUCHED_FLUSH_INTERVAL = 60
 
 # Enables patient messaging (to and from professional).
 ENABLE_PATIENT_MESSAGES = False
@@ -459,6 +467,16 @@ GDRIVE_READING_TIMEOUT = 4
 GDRIVE_READING_BUFFER_LENGTH = 2048
 # How long a reading is
 GDRIVE_READING_DATA_LENGTH = 1111
+# Threads processing readings when reading_spy runs with --concurrent
+GDRIVE_INGEST_WORKERS = 8
+# Connections/unprocessed readings allowed in flight with --concurrent
+GDRIVE_INGEST_MAX_PENDING = 256
+# Where reading_spy --spool writes transmissions for drain_reading_spool
+GDRIVE_SPOOL_DIRECTORY = os.path.join(VAR_DIR, 'spool', 'readings')
+# How many spooled transmissions are processed between checkpoints
+GDRIVE_SPOOL_DRAIN_BATCH_SIZE = 100
+# Seconds the ingest path caches device/patient lookups; 0 disables it
+GDRIVE_RESOLUTION_CACHE_TTL = 60
 # Options for PDF rendering
 WKHTMLTOPDF_CMD_OPTIONS = {'quiet': True}
 WKHTMLTOPDF_CMD = 'xvfb-run /usr/bin/wkhtmltopdf'
@@ -568,6 +586,18 @@ SKIP_DETECT_TIMEZONE = False
 DISABLE_ORDERS = False
 
 TABLE_DEFAULT_AJAX_LIMIT = 10000
+# Tables using estimated counts count exactly below this many rows
+TABLE_EXACT_COUNT_THRESHOLD = 10000
+# Report queries and time per column with every table AJAX response
+TABLE_RENDER_PROFILE = False
+
+# Seconds the professional compliance and range dashboards are cached for
+PROFESSIONAL_ANALYTICS_CACHE_TIMEOUT = 300
+
+# Threads rendering healthsplash blood glucose graphs; 0 renders in the request
+BLOOD_GLUCOSE_GRAPH_RENDER_WORKERS = 0
+# Days an unused blood glucose graph is kept before it is swept
+BLOOD_GLUCOSE_GRAPH_MAX_AGE_DAYS = 7
 
 DISABLE_STAMPS_LABELS = False
 
@@ -575,6 +605,14 @@ CONNECTIONS_API_USERNAME = 'jcross@genesishealthtechnologies.com'
 CONNECTIONS_API_PASSWORD = 'textus138'
 
 SKIP_FORWARD_READINGS = False
+
+# Readings posted to each API partner at once, over pooled connections
+API_FORWARD_CONCURRENCY = 8
+# Times a failed post to an API partner is retried
+API_FORWARD_RETRIES = 2
+# Seconds before the first retry; each later retry waits twice as long
+API_FORWARD_RETRY_BACKOFF = 0.5
+
 RAISE_ON_500 = False
 
 JWT_SUB = 'genesis'
@@ -0,0 +1,188 @@
+"""In-process AES-128 for middleman transmissions.
+
+This mirrors the TI AES implementation compiled into the `decrypt` and
+`encrypt` binaries in extra/decrypt: single 16 byte blocks, no chaining and no
+padding.  When the `cryptography` package is installed its AES primitive is
+used, otherwise a pure Python implementation is used.  Both produce identical
+output.
+"""
+import os
+
+from functools import lru_cache
+
+try:
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives.ciphers import (
+        Cipher, algorithms, modes)
+except ImportError:
+    Cipher = None
+
+
+BLOCK_SIZE = 16
+
+SBOX = bytes((
+    0x63, 0x7c, 0x77, 0x7b, 0xf2, 0x6b, 0x6f, 0xc5, 0x30, 0x01, 0x67, 0x2b, 0xfe, 0xd7, 0xab, 0x76,
+    0xca, 0x82, 0xc9, 0x7d, 0xfa, 0x59, 0x47, 0xf0, 0xad, 0xd4, 0xa2, 0xaf, 0x9c, 0xa4, 0x72, 0xc0,
+    0xb7, 0xfd, 0x93, 0x26, 0x36, 0x3f, 0xf7, 0xcc, 0x34, 0xa5, 0xe5, 0xf1, 0x71, 0xd8, 0x31, 0x15,
+    0x04, 0xc7, 0x23, 0xc3, 0x18, 0x96, 0x05, 0x9a, 0x07, 0x12, 0x80, 0xe2, 0xeb, 0x27, 0xb2, 0x75,
+    0x09, 0x83, 0x2c, 0x1a, 0x1b, 0x6e, 0x5a, 0xa0, 0x52, 0x3b, 0xd6, 0xb3, 0x29, 0xe3, 0x2f, 0x84,
+    0x53, 0xd1, 0x00, 0xed, 0x20, 0xfc, 0xb1, 0x5b, 0x6a, 0xcb, 0xbe, 0x39, 0x4a, 0x4c, 0x58, 0xcf,
+    0xd0, 0xef, 0xaa, 0xfb, 0x43, 0x4d, 0x33, 0x85, 0x45, 0xf9, 0x02, 0x7f, 0x50, 0x3c, 0x9f, 0xa8,
+    0x51, 0xa3, 0x40, 0x8f, 0x92, 0x9d, 0x38, 0xf5, 0xbc, 0xb6, 0xda, 0x21, 0x10, 0xff, 0xf3, 0xd2,
+    0xcd, 0x0c, 0x13, 0xec, 0x5f, 0x97, 0x44, 0x17, 0xc4, 0xa7, 0x7e, 0x3d, 0x64, 0x5d, 0x19, 0x73,
+    0x60, 0x81, 0x4f, 0xdc, 0x22, 0x2a, 0x90, 0x88, 0x46, 0xee, 0xb8, 0x14, 0xde, 0x5e, 0x0b, 0xdb,
+    0xe0, 0x32, 0x3a, 0x0a, 0x49, 0x06, 0x24, 0x5c, 0xc2, 0xd3, 0xac, 0x62, 0x91, 0x95, 0xe4, 0x79,
+    0xe7, 0xc8, 0x37, 0x6d, 0x8d, 0xd5, 0x4e, 0xa9, 0x6c, 0x56, 0xf4, 0xea, 0x65, 0x7a, 0xae, 0x08,
+    0xba, 0x78, 0x25, 0x2e, 0x1c, 0xa6, 0xb4, 0xc6, 0xe8, 0xdd, 0x74, 0x1f, 0x4b, 0xbd, 0x8b, 0x8a,
+    0x70, 0x3e, 0xb5, 0x66, 0x48, 0x03, 0xf6, 0x0e, 0x61, 0x35, 0x57, 0xb9, 0x86, 0xc1, 0x1d, 0x9e,
+    0xe1, 0xf8, 0x98, 0x11, 0x69, 0xd9, 0x8e, 0x94, 0x9b, 0x1e, 0x87, 0xe9, 0xce, 0x55, 0x28, 0xdf,
+    0x8c, 0xa1, 0x89, 0x0d, 0xbf, 0xe6, 0x42, 0x68, 0x41, 0x99, 0x2d, 0x0f, 0xb0, 0x54, 0xbb, 0x16,
+))
+
+RSBOX = bytes(SBOX.index(i) for i in range(256))
+
+RCON = (0x01, 0x02, 0x04, 0x08, 0x10, 0x20, 0x40, 0x80, 0x1b, 0x36)
+
+
+def _xtime(value):
+    value <<= 1
+    if value & 0x100:
+        value ^= 0x11b
+    return value
+
+
+def _gmul(a, b):
+    result = 0
+    while b:
+        if b & 1:
+            result ^= a
+        a = _xtime(a)
+        b >>= 1
+    return result
+
+
+MUL2 = bytes(_gmul(i, 2) for i in range(256))
+MUL3 = bytes(_gmul(i, 3) for i in range(256))
+MUL9 = bytes(_gmul(i, 9) for i in range(256))
+MUL11 = bytes(_gmul(i, 11) for i in range(256))
+MUL13 = bytes(_gmul(i, 13) for i in range(256))
+MUL14 = bytes(_gmul(i, 14) for i in range(256))
+
+# Byte positions after ShiftRows / InvShiftRows on a column-major state.
+SHIFT_ROWS = (0, 5, 10, 15, 4, 9, 14, 3, 8, 13, 2, 7, 12, 1, 6, 11)
+INV_SHIFT_ROWS = (0, 13, 10, 7, 4, 1, 14, 11, 8, 5, 2, 15, 12, 9, 6, 3)
+
+
+def normalize_key(key):
+    """Returns the 16 key bytes the C implementation would read from `key`."""
+    if isinstance(key, str):
+        key = os.fsencode(key)
+    return bytes(key[:BLOCK_SIZE]).ljust(BLOCK_SIZE, b'\0')
+
+
+@lru_cache(maxsize=8)
+def expand_key(key):
+    """Expands a 16 byte key into the 11 round keys used by AES-128."""
+    expanded = bytearray(key)
+    for i in range(1, 11):
+        prev = expanded[(i - 1) * 16:i * 16]
+        word = expanded[-4:]
+        word = bytearray((
+            SBOX[word[1]] ^ RCON[i - 1], SBOX[word[2]],
+            SBOX[word[3]], SBOX[word[0]]))
+        for j in range(16):
+            word_byte = word[j] if j < 4 else expanded[i * 16 + j - 4]
+            expanded.append(prev[j] ^ word_byte)
+    return tuple(bytes(expanded[i * 16:(i + 1) * 16]) for i in range(11))
+
+
+def _add_round_key(state, round_key):
+    return [s ^ k for s, k in zip(state, round_key)]
+
+
+def _python_decrypt_block(block, key):
+    round_keys = expand_key(key)
+    state = _add_round_key(block, round_keys[10])
+    for rnd in range(9, 0, -1):
+        state = [RSBOX[state[i]] for i in INV_SHIFT_ROWS]
+        state = _add_round_key(state, round_keys[rnd])
+        mixed = []
+        for c in range(0, 16, 4):
+            a0, a1, a2, a3 = state[c:c + 4]
+            mixed.extend((
+                MUL14[a0] ^ MUL11[a1] ^ MUL13[a2] ^ MUL9[a3],
+                MUL9[a0] ^ MUL14[a1] ^ MUL11[a2] ^ MUL13[a3],
+                MUL13[a0] ^ MUL9[a1] ^ MUL14[a2] ^ MUL11[a3],
+                MUL11[a0] ^ MUL13[a1] ^ MUL9[a2] ^ MUL14[a3]))
+        state = mixed
+    state = [RSBOX[state[i]] for i in INV_SHIFT_ROWS]
+    return bytes(_add_round_key(state, round_keys[0]))
+
+
+def _python_encrypt_block(block, key):
+    round_keys = expand_key(key)
+    state = _add_round_key(block, round_keys[0])
+    for rnd in range(1, 10):
+        state = [SBOX[state[i]] for i in SHIFT_ROWS]
+        mixed = []
+        for c in range(0, 16, 4):
+            a0, a1, a2, a3 = state[c:c + 4]
+            mixed.extend((
+                MUL2[a0] ^ MUL3[a1] ^ a2 ^ a3,
+                a0 ^ MUL2[a1] ^ MUL3[a2] ^ a3,
+                a0 ^ a1 ^ MUL2[a2] ^ MUL3[a3],
+                MUL3[a0] ^ a1 ^ a2 ^ MUL2[a3]))
+        state = _add_round_key(mixed, round_keys[rnd])
+    state = [SBOX[state[i]] for i in SHIFT_ROWS]
+    return bytes(_add_round_key(state, round_keys[10]))
+
+
+@lru_cache(maxsize=8)
+def _cipher(key):
+    return Cipher(
+        algorithms.AES(key), modes.ECB(), backend=default_backend())
+
+
+def _cryptography_decrypt_block(block, key):
+    decryptor = _cipher(key).decryptor()
+    return decryptor.update(bytes(block)) + decryptor.finalize()
+
+
+def _cryptography_encrypt_block(block, key):
+    encryptor = _cipher(key).encryptor()
+    return encryptor.update(bytes(block)) + encryptor.finalize()
+
+
+if Cipher is not None:
+    ENGINE = 'cryptography'
+    _decrypt_block = _cryptography_decrypt_block
+    _encrypt_block = _cryptography_encrypt_block
+else:
+    ENGINE = 'python'
+    _decrypt_block = _python_decrypt_block
+    _encrypt_block = _python_encrypt_block
+
+
+def decrypt_block(block, key):
+    """Decrypts a single 16 byte block with the given key."""
+    return _decrypt_block(block, normalize_key(key))
+
+
+def encrypt_block(block, key):
+    """Encrypts a single 16 byte block with the given key."""
+    return _encrypt_block(block, normalize_key(key))
+
+
+def decrypt_blocks(blocks, key):
+    """Decrypts a sequence of 16 byte blocks, returning a list of plaintexts.
+
+    With the `cryptography` engine all blocks go through a single ECB call.
+    """
+    key = normalize_key(key)
+    blocks = [bytes(block) for block in blocks]
+    if ENGINE == 'cryptography':
+        decryptor = _cipher(key).decryptor()
+        joined = decryptor.update(b''.join(blocks)) + decryptor.finalize()
+        return [joined[i:i + BLOCK_SIZE]
+                for i in range(0, len(joined), BLOCK_SIZE)]
+    return [_decrypt_block(block, key) for block in blocks]
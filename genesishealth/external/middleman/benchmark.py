@@ -0,0 +1,78 @@
+"""Compares transmission decryption through the decrypt binary (one process
+per field) with the in-process engine.
+
+    python -m genesishealth.external.middleman.benchmark KEY \
+        [--binary PATH] [--count N]
+"""
+import argparse, time
+
+from genesishealth.external.middleman import aes
+from genesishealth.external.middleman.parse import (
+    DECRYPT_BINARY, decrypt_with_binary, encrypt, parse, parse_and_decrypt)
+
+
+SAMPLE_READING = (
+    ('GatewayType', '4123'), ('GatewayID', '0000000000000001'),
+    ('DeviceType', '4123'), ('Serial#', 'A0000001'),
+    ('MEID', 'A0000000000001'), ('ExtensionID', '1'), ('Year', '2020'),
+    ('Month', '6'), ('Day', '1'), ('Hour', '9,-5'), ('Minute', '30'),
+    ('Second', '12'), ('DataType', '1'), ('Value1', '112'), ('Value2', '0'),
+    ('Value3', '0'), ('Value4', '1'), ('Value5', '0'), ('Value6', '0'))
+
+
+def build_transmission(key, fields=SAMPLE_READING):
+    """Builds a transmission in the format sent by the meters."""
+    parts = []
+    for name, value in fields:
+        encrypted = encrypt(value, key)
+        spaced = ' '.join(
+            encrypted[i:i + 2] for i in range(0, len(encrypted), 2))
+        parts.append('%s=%s' % (name, spaced))
+    return '/'.join(parts)
+
+
+def binary_parse_and_decrypt(inp, key, binary=DECRYPT_BINARY):
+    """The previous implementation: one decrypt process per field."""
+    d = dict()
+    for k, data in parse(inp).items():
+        code, value = decrypt_with_binary(data, key, binary)
+        d[k] = {'raw': data, 'plain': value}
+        if code > 0:
+            return False
+    return d
+
+
+def run(func, inp, key, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        result = func(inp, key)
+    elapsed = time.perf_counter() - start
+    return result, count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('key')
+    parser.add_argument('--binary', default=DECRYPT_BINARY)
+    parser.add_argument('--count', type=int, default=200)
+    args = parser.parse_args()
+
+    inp = build_transmission(args.key)
+    in_process, in_process_rate = run(
+        parse_and_decrypt, inp, args.key, args.count)
+    print('in-process (%s engine): %.1f transmissions/second' % (
+        aes.ENGINE, in_process_rate))
+
+    def via_binary(inp, key):
+        return binary_parse_and_decrypt(inp, key, args.binary)
+    binary, binary_rate = run(
+        via_binary, inp, args.key, max(1, args.count // 20))
+    print('decrypt binary: %.1f transmissions/second' % binary_rate)
+    print('speedup: %.0fx' % (in_process_rate / binary_rate))
+    if binary != in_process:
+        raise SystemExit('Output from the decrypt binary does not match!')
+    print('output matches the decrypt binary.')
+
+
+if __name__ == '__main__':
+    main()
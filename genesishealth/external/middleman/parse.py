@@ -1,15 +1,81 @@
-import io, subprocess, sys
+import io, os, subprocess, sys
 
+from genesishealth.external.middleman import aes
 
-def decrypt(data, key):
+
+DECRYPT_BINARY = '/webapps/genesishealth/bin/decrypt'
+
+# Length of an encrypted field: 16 hex encoded bytes plus a checksum byte.
+FIELD_LENGTH = 34
+
+
+def decrypt_with_binary(data, key, binary=DECRYPT_BINARY):
+    """Runs the external decrypt binary on a single field."""
     po = subprocess.Popen(
-        ['/webapps/genesishealth/bin/decrypt', data, key],
+        [binary, data, key],
         stdout=subprocess.PIPE
     )
     res = po.communicate()
     return po.returncode, res[0].decode('ascii')
 
 
+def _nibble(c):
+    # Same arithmetic as CharToHex in decrypt.c, including for bad input.
+    return ((c - 0x37) if c > 0x39 else (c - 0x30)) & 0x0F
+
+
+def _unpack_field(data):
+    """Validates a field the way the decrypt binary does.  Returns either
+    (0, cipher block) or (1, error output)."""
+    raw = os.fsencode(data)
+    if len(raw) != FIELD_LENGTH:
+        return 1, 'parameter error\n'
+    values = bytes((_nibble(raw[i]) << 4) | _nibble(raw[i + 1])
+                   for i in range(0, FIELD_LENGTH, 2))
+    if sum(raw[:-2]) & 0xFF != values[-1]:
+        return 1, 'checksum error\n'
+    return 0, values[:-1]
+
+
+def _plain(block):
+    # The binary printf's the block as a C string.
+    return block.split(b'\0', 1)[0].decode('ascii')
+
+
+def decrypt(data, key):
+    """Decrypts a single field in process.  Returns (returncode, output)
+    exactly as the decrypt binary would."""
+    code, value = _unpack_field(data)
+    if code > 0:
+        return code, value
+    return 0, _plain(aes.decrypt_block(value, key))
+
+
+def decrypt_all(fields, key):
+    """Decrypts every field of a transmission in one call.  Returns a list of
+    (returncode, output) tuples in the same order as `fields`, ending at the
+    first field that fails validation."""
+    unpacked = [_unpack_field(data) for data in fields]
+    blocks = iter(aes.decrypt_blocks(
+        [value for code, value in unpacked if code == 0], key))
+    results = []
+    for code, value in unpacked:
+        if code > 0:
+            results.append((code, value))
+            break
+        results.append((code, _plain(next(blocks))))
+    return results
+
+
+def encrypt(data, key):
+    """Encrypts a single value in process, matching the encrypt binary."""
+    block = os.fsencode(str(data))[:aes.BLOCK_SIZE].ljust(
+        aes.BLOCK_SIZE, b'\0')
+    encrypted = aes.encrypt_block(block, key).hex().upper()
+    checksum = sum(encrypted.encode('ascii')) & 0xFF
+    return '%s%02X' % (encrypted, checksum)
+
+
 def parse(inp):
     d = dict()
     lines = inp.split('/')
@@ -34,8 +100,9 @@ def debug(parsed):
 
 def parse_and_decrypt(inp, key):
     d = dict()
-    for k, data in parse(inp).items():
-        code, value = decrypt(data, key)
+    parsed = parse(inp)
+    results = decrypt_all(parsed.values(), key)
+    for (k, data), (code, value) in zip(parsed.items(), results):
         d[k] = {'raw': data, 'plain': value}
         if code > 0:
             return False
@@ -47,6 +114,34 @@ def verified(inp, key):
         return True
 
 
+class Transmission(object):
+    """A transmission that has been parsed and decrypted once, so it can be
+    passed through verification, processing and logging without decrypting
+    it again.
+
+    `raw` maps each field name to its cipher text and `fields` maps the
+    lowercased field names to their plain text.  `fields` is empty unless the
+    transmission is `verified`."""
+    def __init__(self, content, raw=None, fields=None, verified=False):
+        self.content = content
+        self.raw = raw or {}
+        self.fields = fields or {}
+        self.verified = verified
+
+    @classmethod
+    def decrypt(cls, content, key):
+        try:
+            raw = parse(content)
+            results = decrypt_all(raw.values(), key)
+        except ValueError:
+            # Malformed content or plain text that isn't ASCII.
+            return cls(content)
+        if len(results) < len(raw) or results[-1][0] > 0:
+            return cls(content, raw)
+        fields = dict(
+            (k.lower(), value) for k, (code, value) in zip(raw, results))
+        return cls(content, raw, fields, True)
+
+
 if __name__  == '__main__':
     print(parse_and_decrypt(sys.stdin.read(), sys.argv[1]))
-
@@ -0,0 +1,80 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils.timezone import now
+
+from genesishealth.apps.accounts.models import Contact, PatientProfile
+from genesishealth.apps.api.forwarding import PartnerForwarder
+from genesishealth.apps.api.models import (
+    APILocation, APILogRecord, APIPartner, APIReadingForwardAttempt)
+from genesishealth.apps.readings.models import GlucoseReading
+
+
+class PartnerForwarderTestCase(TestCase):
+    def setUp(self):
+        self.partner = APIPartner.objects.create(
+            name='Partner', short_name='partner', api_version='1.0',
+            forward_readings=True, send_register_updates=False,
+            maximum_send_attempts=3)
+        APILocation.objects.create(
+            partner=self.partner, type='push_data',
+            url='http://partner.example.com/push/')
+        self.patient = User.objects.create(username='forwarding')
+        PatientProfile.objects.create(
+            user=self.patient, contact=Contact.objects.create())
+        self.partner.add_patient(self.patient)
+        GlucoseReading.objects.bulk_create([
+            GlucoseReading(
+                patient=self.patient, reading_datetime_utc=now(),
+                glucose_value=value,
+                measure_type=GlucoseReading.MEASURE_TYPE_NORMAL, raw_data='')
+            for value in (100, 120)])
+        self.readings = list(
+            GlucoseReading.objects.filter(patient=self.patient).order_by('pk'))
+        for reading in self.readings:
+            APIReadingForwardAttempt.objects.create(
+                partner=self.partner, reading=reading)
+        self.bad, self.good = self.readings
+
+    def generate_reading_data(self, reading):
+        # Neither reading has a device, so a 1.0 payload cannot be built;
+        # only the bad reading is left to fail.
+        if reading.pk == self.bad.pk:
+            return reading.device.meid
+        return {'Glucose': {'value': str(reading.glucose_value)}}
+
+    def send_queued(self):
+        with mock.patch.object(
+                APIPartner, 'generate_reading_data', autospec=True,
+                side_effect=lambda partner, reading:
+                    self.generate_reading_data(reading)), \
+                mock.patch.object(
+                    PartnerForwarder, 'post',
+                    return_value=(APILogRecord.STATUS_COMPLETE,
+                                  '{"success": true}')):
+            return PartnerForwarder(
+                self.partner, concurrency=1).send_queued()
+
+    def test_bad_reading_does_not_block_batch(self):
+        self.assertEqual(self.send_queued(), (2, 1))
+        good = self.partner.forward_attempts.get(reading=self.good)
+        self.assertTrue(good.committed)
+        self.assertEqual(good.attempts, 1)
+        bad = self.partner.forward_attempts.get(reading=self.bad)
+        self.assertFalse(bad.committed)
+        self.assertEqual(bad.attempts, 1)
+        log = APILogRecord.objects.get(reading=self.bad)
+        self.assertEqual(log.status, APILogRecord.STATUS_PAYLOAD_ERROR)
+        self.assertIn('AttributeError', log.response)
+        self.assertEqual(
+            APILogRecord.objects.get(reading=self.good).status,
+            APILogRecord.STATUS_COMPLETE)
+
+    def test_bad_reading_ages_out(self):
+        for i in range(self.partner.maximum_send_attempts):
+            self.send_queued()
+        bad = self.partner.forward_attempts.get(reading=self.bad)
+        self.assertEqual(bad.attempts, self.partner.maximum_send_attempts)
+        self.assertFalse(self.partner.get_queued_attempts().exists())
+        self.assertEqual(self.send_queued(), (0, 0))
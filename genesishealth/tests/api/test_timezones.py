@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+from django.test import SimpleTestCase
+
+import pytz
+
+from genesishealth.apps.api.timezones import TimezoneResolver
+
+OFFSETS = (-10, -8, -7, -6, -5, -4, -3, 0, 1, 2, 3, 5, 9, 13)
+
+# US and European DST changes, and Samoa skipping 2011-12-30.
+BOUNDARIES = (
+    datetime(2019, 3, 10), datetime(2019, 11, 3),
+    datetime(2020, 3, 8), datetime(2020, 11, 1),
+    datetime(2020, 3, 29), datetime(2020, 10, 25),
+    datetime(2011, 12, 30),
+)
+
+
+def legacy_timezone_name(offset, reading_datetime_utc):
+    def check_timezone(tz_name):
+        timezone = pytz.timezone(tz_name)
+        naive = reading_datetime_utc.replace(tzinfo=None)
+        try:
+            tz_offset = timezone.utcoffset(naive).total_seconds() / 60 / 60
+        except (pytz.NonExistentTimeError, pytz.AmbiguousTimeError):
+            return False
+        return tz_offset == offset
+
+    for tz in ('America/New_York', 'America/Chicago',
+               'America/Boise', 'America/Los_Angeles'):
+        if check_timezone(tz):
+            return tz
+    for tz in pytz.common_timezones:
+        if check_timezone(tz):
+            return tz
+    return "Unknown"
+
+
+def get_sweep():
+    times = []
+    for boundary in BOUNDARIES:
+        start = boundary - timedelta(days=1)
+        times.extend(start + timedelta(hours=i) for i in range(48))
+    start = datetime(2020, 1, 1)
+    times.extend(start + timedelta(hours=97 * i) for i in range(90))
+    return [t.replace(tzinfo=pytz.UTC) for t in times]
+
+
+class TimezoneResolverTestCase(SimpleTestCase):
+    def test_matches_search(self):
+        resolver = TimezoneResolver()
+        for reading_datetime_utc in get_sweep():
+            for offset in OFFSETS:
+                self.assertEqual(
+                    resolver.get_timezone_name(offset, reading_datetime_utc),
+                    legacy_timezone_name(offset, reading_datetime_utc),
+                    (offset, reading_datetime_utc))
+
+    def test_preferred_zones(self):
+        resolver = TimezoneResolver()
+        summer = datetime(2020, 7, 1, 18, tzinfo=pytz.UTC)
+        winter = datetime(2020, 1, 1, 18, tzinfo=pytz.UTC)
+        self.assertEqual(
+            resolver.get_timezone_name(-4, summer), 'America/New_York')
+        self.assertEqual(
+            resolver.get_timezone_name(-5, summer), 'America/Chicago')
+        self.assertEqual(
+            resolver.get_timezone_name(-5, winter), 'America/New_York')
+        self.assertEqual(
+            resolver.get_timezone_name(-7, winter), 'America/Boise')
+        self.assertEqual(resolver.get_timezone_name(20, winter), 'Unknown')
+
+    def test_dates_cached(self):
+        resolver = TimezoneResolver()
+        day = datetime(2020, 7, 1, tzinfo=pytz.UTC)
+        for hour in range(24):
+            resolver.get_timezone_name(-5, day + timedelta(hours=hour))
+        info = resolver.resolve_date.cache_info()
+        self.assertEqual(info.misses, 1)
+        self.assertEqual(info.hits, 23)
@@ -0,0 +1,69 @@
+import os
+import random
+
+from django.test import SimpleTestCase
+
+from genesishealth.external.middleman import aes
+from genesishealth.external.middleman.benchmark import (
+    SAMPLE_READING, build_transmission)
+from genesishealth.external.middleman.parse import (
+    DECRYPT_BINARY, Transmission, decrypt, decrypt_with_binary, encrypt,
+    parse, parse_and_decrypt, verified)
+
+
+KEY = '0123456789abcdef'
+
+
+class TestAESTestCase(SimpleTestCase):
+    def test_fips_197_vector(self):
+        key = bytes(range(16))
+        plain = bytes.fromhex('00112233445566778899aabbccddeeff')
+        cipher = bytes.fromhex('69c4e0d86a7b0430d8cdb78070b4c55a')
+        self.assertEqual(aes.encrypt_block(plain, key), cipher)
+        self.assertEqual(aes.decrypt_block(cipher, key), plain)
+
+    def test_python_engine_matches_configured_engine(self):
+        key = aes.normalize_key(KEY)
+        block = bytes(random.getrandbits(8) for _ in range(16))
+        self.assertEqual(
+            aes._python_decrypt_block(block, key),
+            aes.decrypt_block(block, key))
+
+
+class TestParseTestCase(SimpleTestCase):
+    def test_round_trip(self):
+        decrypted = parse_and_decrypt(build_transmission(KEY), KEY)
+        self.assertEqual(
+            {k: v['plain'] for k, v in decrypted.items()},
+            dict(SAMPLE_READING))
+
+    def test_checksum_failure(self):
+        field = encrypt('112', KEY)
+        self.assertEqual(
+            decrypt(field[:-2] + '00', KEY), (1, 'checksum error\n'))
+        self.assertEqual(decrypt(field[:20], KEY), (1, 'parameter error\n'))
+        inp = build_transmission(KEY)
+        inp = inp[:-2] + ('01' if inp.endswith('00') else '00')
+        self.assertFalse(verified(inp, KEY))
+
+    def test_transmission(self):
+        inp = build_transmission(KEY)
+        transmission = Transmission.decrypt(inp, KEY)
+        self.assertTrue(transmission.verified)
+        self.assertEqual(transmission.raw, parse(inp))
+        self.assertEqual(
+            transmission.fields,
+            dict((k.lower(), v) for k, v in SAMPLE_READING))
+        corrupted = Transmission.decrypt(inp[:-2] + '0', KEY)
+        self.assertFalse(corrupted.verified)
+        self.assertEqual(corrupted.fields, {})
+        self.assertFalse(Transmission.decrypt('garbage', KEY).verified)
+
+    def test_matches_decrypt_binary(self):
+        if not os.path.exists(DECRYPT_BINARY):
+            self.skipTest('decrypt binary is not installed.')
+        fields = list(parse(build_transmission(KEY)).values())
+        fields += [field[:-2] + '00' for field in fields]
+        for field in fields:
+            self.assertEqual(
+                decrypt(field, KEY), decrypt_with_binary(field, KEY))
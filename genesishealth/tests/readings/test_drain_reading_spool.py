@@ -0,0 +1,53 @@
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import TestCase
+
+from genesishealth.apps.gdrives.models import GDriveTransmissionLogEntry
+from genesishealth.apps.readings.management.commands.drain_reading_spool \
+    import Command, get_spool_position
+from genesishealth.apps.readings.spool import ReadingSpool
+
+
+class DrainReadingSpoolTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        spool = ReadingSpool(self.directory)
+        for content in ('first', 'second'):
+            spool.append(content)
+        spool.close()
+        self.command = Command()
+        self.command.server_name = 'drain'
+        self.command.spool = ReadingSpool(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def create_log_entry(self, content):
+        # Unverified transmissions are only logged.
+        return (GDriveTransmissionLogEntry(
+            content=content, reading_server='drain',
+            processing_succeeded=False, success_sent_to_client=False),
+            mock.Mock(verified=False))
+
+    def test_replayed_transmissions_are_not_logged_twice(self):
+        records = self.command.spool.read((0, 0), 10)
+        # The first was logged before the drain crashed.
+        GDriveTransmissionLogEntry.objects.create(
+            content='first', reading_server='drain',
+            processing_succeeded=False, success_sent_to_client=False,
+            spool_position=get_spool_position(records[0]))
+        with mock.patch.object(
+                self.command, 'create_log_entry',
+                side_effect=self.create_log_entry), \
+                mock.patch.object(self.command, 'forward') as forward, \
+                mock.patch.object(
+                    self.command.spool, 'set_checkpoint') as set_checkpoint:
+            self.command.drain_records(records)
+        self.assertEqual(
+            list(GDriveTransmissionLogEntry.objects.order_by(
+                'pk').values_list('content', flat=True)),
+            ['first', 'second'])
+        forward.assert_called_once_with('second')
+        set_checkpoint.assert_called_once_with(records[-1].next_position)
@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+
+from genesishealth.apps.readings.spool import ReadingSpool
+
+
+class TestReadingSpoolTestCase(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_append_read_checkpoint(self):
+        spool = ReadingSpool(self.directory, segment_size=100)
+        contents = ['reading %d' % i for i in range(20)]
+        for content in contents:
+            spool.append(content)
+        spool.close()
+        self.assertGreater(len(spool.get_segments()), 1)
+
+        spool = ReadingSpool(self.directory, segment_size=100)
+        first = spool.read(spool.get_checkpoint(), 5)
+        self.assertEqual([r.content for r in first], contents[:5])
+        spool.set_checkpoint(first[-1].next_position)
+
+        rest = spool.read(spool.get_checkpoint(), 100)
+        self.assertEqual([r.content for r in rest], contents[5:])
+        spool.set_checkpoint(rest[-1].next_position)
+        self.assertEqual(spool.get_segments(), [rest[-1].position[0]])
+        self.assertEqual(spool.get_backlog(), 0)
+
+    def test_torn_record_is_discarded(self):
+        spool = ReadingSpool(self.directory)
+        spool.append('first')
+        spool.append('second')
+        spool.close()
+        path = os.path.join(self.directory, os.listdir(self.directory)[0])
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 2)
+
+        spool = ReadingSpool(self.directory)
+        self.assertEqual(
+            [r.content for r in spool.read((0, 0), 10)], ['first'])
+        spool.append('third')
+        self.assertEqual(
+            [r.content for r in spool.read((0, 0), 10)], ['first', 'third'])
+
+    def test_park(self):
+        spool = ReadingSpool(self.directory)
+        self.assertEqual(spool.get_parked(), [])
+        spool.append('first')
+        spool.append('second')
+        first, second = spool.read((0, 0), 10)
+        spool.park(second, 'Traceback: failed')
+        spool.set_checkpoint(second.next_position)
+        parked = spool.get_parked()
+        self.assertEqual(len(parked), 1)
+        self.assertEqual(parked[0]['content'], 'second')
+        self.assertEqual(tuple(parked[0]['position']), second.position)
+        self.assertEqual(parked[0]['error'], 'Traceback: failed')
+        self.assertEqual(spool.read(spool.get_checkpoint(), 10), [])
@@ -0,0 +1,47 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils.timezone import now
+
+from genesishealth.apps.accounts.models import Contact, PatientProfile
+from genesishealth.apps.api.models import APIPartner
+from genesishealth.apps.readings.models import GlucoseReading
+from genesishealth.apps.readings.tasks import forward_to_partners
+
+
+class ForwardToPartnersTestCase(TestCase):
+    def setUp(self):
+        self.partner = APIPartner.objects.create(
+            name='Partner', short_name='partner', api_version='1.0',
+            forward_readings=True, send_register_updates=False)
+        self.patient = User.objects.create(username='forwarding')
+        PatientProfile.objects.create(
+            user=self.patient, contact=Contact.objects.create())
+        self.partner.add_patient(self.patient)
+        GlucoseReading.objects.bulk_create([
+            GlucoseReading(
+                patient=self.patient, reading_datetime_utc=now(),
+                glucose_value=100, measure_type=measure_type, raw_data='')
+            for measure_type in (
+                GlucoseReading.MEASURE_TYPE_NORMAL,
+                GlucoseReading.MEASURE_TYPE_NORMAL,
+                GlucoseReading.MEASURE_TYPE_TEST)])
+        self.readings = list(
+            GlucoseReading.objects.filter(patient=self.patient).order_by('pk'))
+
+    @mock.patch('genesishealth.apps.api.tasks.forward_queued_readings.delay')
+    def test_queues_attempts_and_sends_once(self, delay):
+        self.partner.forward_attempts.create(reading=self.readings[0])
+        forward_to_partners(self.readings)
+        self.assertEqual(
+            set(self.partner.forward_attempts.values_list(
+                'reading', flat=True)),
+            set(r.pk for r in self.readings[:2]))
+        delay.assert_called_once_with(self.partner.pk)
+
+    @mock.patch('genesishealth.apps.api.tasks.forward_queued_readings.delay')
+    def test_test_readings_are_not_forwarded(self, delay):
+        forward_to_partners(self.readings[2:])
+        self.assertFalse(self.partner.forward_attempts.exists())
+        delay.assert_not_called()
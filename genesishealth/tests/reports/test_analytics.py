@@ -0,0 +1,76 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from genesishealth.apps.health_information.models import (
+    HealthProfessionalTargets)
+from genesishealth.apps.reports.analytics import ProfessionalAnalytics
+
+# Patient 3 needs one test a day, the others the default three; patient 4
+# has no readings.
+GOALS = {1: 3, 2: 3, 3: 1}
+READING_COUNTS = {
+    7: {1: 21, 2: 20, 3: 7},
+    30: {1: 95, 2: 60, 3: 29},
+}
+
+
+class ComplianceStatisticsTestCase(SimpleTestCase):
+    def setUp(self):
+        professional = mock.Mock()
+        professional.professional_profile.get_patients.return_value \
+            .values_list.return_value = [1, 2, 3, 4]
+        self.analytics = ProfessionalAnalytics(professional)
+
+    def calculate(self, days):
+        statistics = dict(
+            (patient_id, (count, 120.))
+            for patient_id, count in READING_COUNTS[days].items())
+        targets = dict(
+            (patient_id, HealthProfessionalTargets(compliance_goal=goal))
+            for patient_id, goal in GOALS.items())
+        with mock.patch.object(
+                self.analytics, 'get_patient_statistics',
+                return_value=statistics), \
+                mock.patch.object(
+                    self.analytics, 'get_targets', return_value=targets):
+            return self.analytics.calculate_compliance_statistics(days)
+
+    def test_goal_is_daily(self):
+        c = self.calculate(7)
+        self.assertEqual(c['in_compliance_ids'], {1, 3})
+        self.assertEqual(c['out_of_compliance_ids'], {2})
+        self.assertEqual(c['no_readings_ids'], {4})
+
+        c = self.calculate(30)
+        self.assertEqual(c['in_compliance_ids'], {1})
+        self.assertEqual(c['out_of_compliance_ids'], {2, 3})
+        self.assertEqual(c['no_readings_ids'], {4})
+        self.assertEqual(c['num_in_compliance'], 1)
+        self.assertEqual(c['percent_out_of_compliance'], 50.)
+
+
+class RangeStatisticsTestCase(SimpleTestCase):
+    def test_counts_match_ids(self):
+        professional = mock.Mock()
+        professional.professional_profile.get_patients.return_value \
+            .values_list.return_value = [1, 2, 3, 4]
+        analytics = ProfessionalAnalytics(professional)
+        statistics = {1: (3, 80.), 2: (3, 110.), 3: (3, 200.)}
+        targets = dict(
+            (patient_id, HealthProfessionalTargets(
+                premeal_glucose_goal_minimum=90,
+                postmeal_glucose_goal_maximum=120))
+            for patient_id in statistics)
+        with mock.patch.object(
+                analytics, 'get_patient_statistics',
+                return_value=statistics), \
+                mock.patch.object(
+                    analytics, 'get_targets', return_value=targets):
+            c = analytics.calculate_range_statistics(7)
+        self.assertEqual(c['below_range_ids'], {1})
+        self.assertEqual(c['in_range_ids'], {2})
+        self.assertEqual(c['above_range_ids'], {3})
+        # Patient 4 has no readings, so is in no bucket.
+        self.assertEqual(c['num_in_range'], 1)
+        self.assertEqual(c['percent_in_range'], 25.)
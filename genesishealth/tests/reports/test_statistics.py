@@ -0,0 +1,136 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db.models import Avg, Count, Max, Min, Q, StdDev
+from django.test import TestCase
+from django.utils.timezone import now
+
+from genesishealth.apps.health_information.models import HealthInformation
+from genesishealth.apps.readings.models import GlucoseReading
+from genesishealth.apps.readings.statistics import (
+    get_goal_buckets, get_grouped_reading_statistics, get_reading_statistics,
+    get_target_buckets)
+from genesishealth.apps.reports.views.main import aggregate_readings
+
+
+def legacy_aggregate_readings(user, readings, days):
+    aggregates = readings.aggregate(
+        Avg('glucose_value'),
+        Max('glucose_value'),
+        Min('glucose_value'),
+        Count('glucose_value'),
+        StdDev('glucose_value'))
+    aggregates['total'] = readings.count()
+    aggregates['total_days'] = days
+    aggregates['low_readings'] = readings.filter(
+        glucose_value__lt=user.healthinformation.premeal_glucose_goal_minimum
+    ).count()
+    aggregates['high_readings'] = readings.filter(
+        glucose_value__gt=user.healthinformation.postmeal_glucose_goal_maximum
+    ).count()
+    aggregates['hypo_readings'] = readings.filter(
+        glucose_value__lt=user.healthinformation.safe_zone_minimum).count()
+    aggregates['hyper_readings'] = readings.filter(
+        glucose_value__gt=user.healthinformation.safe_zone_maximum).count()
+    aggregates['average_tests_per_day'] = readings.count() / days
+    return aggregates
+
+
+def legacy_trend_counts(readings, bottom, top, targets):
+    counts = dict.fromkeys(('above', 'below', 'within', 'hypo', 'hyper'), 0)
+    for r in readings:
+        if r.glucose_value > top:
+            counts['above'] += 1
+            if r.glucose_value > targets.safe_zone_maximum:
+                counts['hyper'] += 1
+        elif r.glucose_value < bottom:
+            counts['below'] += 1
+            if r.glucose_value < targets.safe_zone_minimum:
+                counts['hypo'] += 1
+        elif bottom <= r.glucose_value <= top:
+            counts['within'] += 1
+    return counts
+
+
+class TestReadingStatisticsTestCase(TestCase):
+    values = (
+        20, 59, 60, 69, 70, 71, 90, 110, 129, 130, 131, 179, 180, 181, 249,
+        250, 251, 400, 600)
+
+    def setUp(self):
+        self.user = User.objects.create(username='statistics')
+        self.targets = HealthInformation.objects.create(patient=self.user)
+        measure_types = (
+            GlucoseReading.MEASURE_TYPE_NORMAL,
+            GlucoseReading.MEASURE_TYPE_BEFORE,
+            GlucoseReading.MEASURE_TYPE_AFTER)
+        start = now() - timedelta(days=10)
+        GlucoseReading.objects.bulk_create([
+            GlucoseReading(
+                patient=self.user,
+                reading_datetime_utc=start + timedelta(hours=7 * index),
+                glucose_value=value,
+                measure_type=measure_types[index % len(measure_types)],
+                raw_data='')
+            for index, value in enumerate(self.values)])
+        self.readings = GlucoseReading.objects.filter(patient=self.user)
+
+    def assertStatisticsEqual(self, first, second):
+        self.assertEqual(set(first), set(second))
+        for key, value in first.items():
+            if isinstance(value, float):
+                self.assertAlmostEqual(value, second[key])
+            else:
+                self.assertEqual(value, second[key])
+
+    def test_aggregate_readings(self):
+        for readings in (
+                self.readings,
+                self.readings.filter(glucose_value__gt=100),
+                self.readings.none()):
+            aggregates = aggregate_readings(self.user, readings, days=7)
+            self.assertEqual(
+                aggregates.pop('premeal_count'),
+                readings.filter(
+                    measure_type=GlucoseReading.MEASURE_TYPE_BEFORE).count())
+            self.assertEqual(
+                aggregates.pop('postmeal_count'),
+                readings.filter(
+                    measure_type=GlucoseReading.MEASURE_TYPE_AFTER).count())
+            self.assertStatisticsEqual(
+                aggregates,
+                legacy_aggregate_readings(self.user, readings, 7))
+
+    def test_goal_buckets(self):
+        for bottom, top in ((70, 130), (90, 180), (70, 180)):
+            statistics = get_reading_statistics(
+                self.readings, get_goal_buckets(bottom, top, self.targets))
+            expected = legacy_trend_counts(
+                self.readings, bottom, top, self.targets)
+            for name, count in expected.items():
+                self.assertEqual(statistics['%s_count' % name], count)
+
+    def test_grouped_statistics(self):
+        ids = list(self.readings.order_by('pk').values_list('pk', flat=True))
+        groups = {'first': ids[:5], 'second': ids[5:12], 'third': ids[12:]}
+        statistics = get_grouped_reading_statistics(
+            self.readings,
+            dict((key, Q(id__in=group_ids))
+                 for key, group_ids in groups.items()),
+            get_target_buckets(self.targets))
+        for key, group_ids in groups.items():
+            readings = GlucoseReading.objects.filter(id__in=group_ids)
+            aggregates = readings.aggregate(
+                Avg('glucose_value'), StdDev('glucose_value'))
+            self.assertEqual(statistics[key]['count'], readings.count())
+            self.assertAlmostEqual(
+                statistics[key]['glucose_value__avg'],
+                aggregates['glucose_value__avg'])
+            self.assertAlmostEqual(
+                statistics[key]['glucose_value__stddev'],
+                aggregates['glucose_value__stddev'])
+            self.assertEqual(
+                statistics[key]['in_range_count'],
+                readings.filter(glucose_value__range=(
+                    self.targets.premeal_glucose_goal_minimum,
+                    self.targets.postmeal_glucose_goal_maximum)).count())